@@ -8,22 +8,37 @@ Contains information about if combinatorial classes have been found by
 if is_empty has been checked.
 """
 
+import pickle
+import sys
+import tempfile
+import threading
 import time
-import zlib
+from array import array
+from collections import OrderedDict
 from datetime import timedelta
+from hashlib import blake2b
 from typing import (
+    BinaryIO,
     Dict,
     Generic,
+    Iterable,
     Iterator,
     List,
     MutableMapping,
     NamedTuple,
     Optional,
+    Tuple,
     Type,
+    TypeVar,
     cast,
 )
 
+from comb_spec_searcher.codec import Codec, ZlibCodec
+from comb_spec_searcher.journal import ADD_CLASS, SET_CODEC, SET_EMPTY, Journal
 from comb_spec_searcher.typing import ClassKey, CombinatorialClassType, Key
+from comb_spec_searcher.utils import size_to_readable
+
+T = TypeVar("T")
 
 
 class Info(NamedTuple):
@@ -32,62 +47,46 @@ class Info(NamedTuple):
     empty: Optional[bool] = None
 
 
-class LabelToInfo(MutableMapping[int, Optional[Info]]):
-    def __init__(
-        self,
-        comb_class_list: List[ClassKey],
-        label_dict: Dict[ClassKey, int],
-        empty_list: List[Optional[bool]],
-    ):
-        self.comb_class_list = comb_class_list
-        self.label_dict = label_dict
-        self.empty_list = empty_list
+class LabelToInfo(MutableMapping[int, Info]):
+    """A view of a ClassDB giving the Info of each label."""
 
-    def __getitem__(self, label: int) -> Optional[Info]:
-        try:
-            return Info(self.comb_class_list[label], label, self.empty_list[label])
-        except KeyError:
-            return None
+    def __init__(self, classdb: "ClassDB"):
+        self.classdb = classdb
 
-    def __setitem__(self, key: int, value: Optional[Info]) -> None:
+    def __getitem__(self, label: int) -> Info:
+        if not 0 <= label < len(self.classdb):
+            raise KeyError(label)
+        return Info(self.classdb._key(label), label, self.classdb._get_empty(label))
+
+    def __setitem__(self, key: int, value: Info) -> None:
         raise NotImplementedError
 
     def __delitem__(self, key: int) -> None:
         raise NotImplementedError
 
     def __iter__(self) -> Iterator:
-        yield from self.label_dict.values()
+        yield from range(len(self.classdb))
 
     def __len__(self) -> int:
-        return len(self.empty_list)
+        return len(self.classdb)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, LabelToInfo):
             return NotImplemented
-        return (
-            self.comb_class_list == other.comb_class_list
-            and self.label_dict == other.label_dict
-            and self.empty_list == other.empty_list
-        )
+        return bool(self.classdb == other.classdb)
 
 
 class ClassToInfo(MutableMapping[ClassKey, Optional[Info]]):
-    def __init__(
-        self,
-        comb_class_list: List[ClassKey],
-        label_dict: Dict[ClassKey, int],
-        empty_list: List[Optional[bool]],
-    ):
-        self.comb_class_list = comb_class_list
-        self.label_dict = label_dict
-        self.empty_list = empty_list
+    """A view of a ClassDB giving the Info of each lookup key."""
+
+    def __init__(self, classdb: "ClassDB"):
+        self.classdb = classdb
 
     def __getitem__(self, class_key: ClassKey) -> Optional[Info]:
-        try:
-            label = self.label_dict[class_key]
-            return Info(self.comb_class_list[label], label, self.empty_list[label])
-        except KeyError:
+        label = self.classdb._find(class_key)
+        if label is None:
             return None
+        return Info(self.classdb._key(label), label, self.classdb._get_empty(label))
 
     def __setitem__(self, key: ClassKey, value: Optional[Info]) -> None:
         raise NotImplementedError
@@ -99,18 +98,76 @@ class ClassToInfo(MutableMapping[ClassKey, Optional[Info]]):
         raise NotImplementedError
 
     def __len__(self) -> int:
-        return len(self.empty_list)
+        return len(self.classdb)
 
-    def __contains__(self, class_key: ClassKey) -> bool:
-        return class_key in self.label_dict
+    def __contains__(self, class_key: object) -> bool:
+        return self.classdb._find(cast(ClassKey, class_key)) is not None
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, ClassToInfo):
             return NotImplemented
+        return bool(self.classdb == other.classdb)
+
+
+class LRUCache(Generic[T]):
+    """
+    The values most recently used, keyed by label.
+
+    At most `max_entries` values are kept and, if `max_size` is given, the
+    sizes of the values kept add up to at most `max_size`. The values are not
+    pickled.
+    """
+
+    def __init__(
+        self, max_entries: Optional[int] = None, max_size: Optional[int] = None
+    ):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values: "OrderedDict[int, Tuple[T, int]]" = OrderedDict()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_values"] = OrderedDict()
+        state["size"] = 0
+        return state
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, label: int) -> Optional[T]:
+        """Return the value for the label if kept, and mark it as used."""
+        value = self._values.get(label)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._values.move_to_end(label)
+        return value[0]
+
+    def put(self, label: int, value: T, size: int = 1) -> None:
+        """Keep the value for the label, evicting the least recently used."""
+        old = self._values.pop(label, None)
+        if old is not None:
+            self.size -= old[1]
+        self._values[label] = (value, size)
+        self.size += size
+        while self._values and (
+            (self.max_entries is not None and len(self._values) > self.max_entries)
+            or (self.max_size is not None and self.size > self.max_size)
+        ):
+            _, (_, evicted_size) = self._values.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def status(self) -> str:
+        """Return a string with the counters of the cache."""
         return (
-            self.comb_class_list == other.comb_class_list
-            and self.label_dict == other.label_dict
-            and self.empty_list == other.empty_list
+            f"{self.hits:,d} hits, {self.misses:,d} misses and "
+            f"{self.evictions:,d} evictions"
         )
 
 
@@ -127,91 +184,207 @@ class ClassDB(Generic[CombinatorialClassType]):
     - DB.set_empty(key) will set empty to be true for key.
     - DB.is_empty(key) will return True if the key is empty, False
     otherwise.
+
+    The bytes of the classes implementing 'to_bytes' are compressed with the
+    codec, by default zlib at level 9. The compressed classes are concatenated
+    in a single arena, the class with label i being between the offsets i and
+    i + 1, and whether each class is empty is stored in two bits. The classes
+    not implementing 'to_bytes' are kept as they are.
+
+    If `class_cache_size` or `class_cache_bytes` is given, the classes most
+    recently returned by `get_class` are kept decompressed, up to that number
+    of classes or that total number of uncompressed bytes. The classes returned
+    are then shared and must not be changed.
     """
 
-    def __init__(self, combinatorial_class: Type[CombinatorialClassType]):
-        self.comb_class_list: List[ClassKey] = []
+    # pylint: disable=too-many-instance-attributes
+    UNKNOWN, EMPTY, NOT_EMPTY = range(3)
+
+    def __init__(
+        self,
+        combinatorial_class: Type[CombinatorialClassType],
+        codec: Optional[Codec] = None,
+        class_cache_size: Optional[int] = None,
+        class_cache_bytes: Optional[int] = None,
+    ):
+        self._arena = bytearray()
+        self._offsets = array("Q", [0])
+        self._objects: Dict[int, ClassKey] = {}
+        self._empty = bytearray()
+        # The label of each class, keyed by a digest of the bytes of the class
+        # if 'to_bytes' is implemented and otherwise by the class itself.
         self.label_dict: Dict[ClassKey, int] = {}
-        self.empty_list: List[Optional[bool]] = []
-        self.class_to_info: ClassToInfo = ClassToInfo(
-            self.comb_class_list, self.label_dict, self.empty_list
-        )
-        self.label_to_info: LabelToInfo = LabelToInfo(
-            self.comb_class_list, self.label_dict, self.empty_list
-        )
+        self.class_to_info: ClassToInfo = ClassToInfo(self)
+        self.label_to_info: LabelToInfo = LabelToInfo(self)
         self.combinatorial_class = combinatorial_class
+        self.codec = ZlibCodec() if codec is None else codec
+        self.journal: Optional[Journal] = None
         self._empty_time = 0.0
         self._empty_num_application = 0
+        self._lookup_time = 0.0
+        self._compress_time = 0.0
+        self._raw_size = 0
+        self._compressed_size = 0
+        self._compressed_classes = 0
+        self.class_cache: Optional[LRUCache[CombinatorialClassType]] = None
+        if class_cache_size is not None or class_cache_bytes is not None:
+            self.class_cache = LRUCache(class_cache_size, class_cache_bytes)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
 
     def __iter__(self) -> Iterator[int]:
         """
         Iterator of labels.
         """
-        yield from self.label_to_info
+        yield from range(len(self))
 
     def __contains__(self, key: Key) -> bool:
         """
         Return true if the the key is already in the database.
         """
         if isinstance(key, self.combinatorial_class):
-            comb_class = self._compress(key)
-            info = self.class_to_info.get(comb_class)
-        elif isinstance(key, int):
-            info = self.label_to_info.get(key)
-        else:
-            raise ValueError("Invalid key")
-        return info is not None
+            return self._find(self._lookup_key(key)[0]) is not None
+        if isinstance(key, int):
+            return 0 <= key < len(self)
+        raise ValueError("Invalid key")
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, ClassDB):
             return NotImplemented
-        return bool(
-            self.class_to_info == other.class_to_info
-            and self.label_to_info == other.label_to_info
+        return (
+            self._offsets == other._offsets
+            and self._arena == other._arena
+            and self._objects == other._objects
+            and self._empty == other._empty
         )
 
-    def add(self, comb_class: ClassKey, compressed: bool = False) -> None:
+    def _key(self, label: int) -> ClassKey:
+        """Return the compressed class with the given label."""
+        if self._objects:
+            obj = self._objects.get(label)
+            if obj is not None:
+                return obj
+        return bytes(self._arena[self._offsets[label] : self._offsets[label + 1]])
+
+    def _find(self, key: ClassKey) -> Optional[int]:
+        """Return the label of the class with the lookup key if in the database."""
+        return self.label_dict.get(key)
+
+    def _store(self, label: int, comb_class: ClassKey) -> None:
+        """Store the compressed class with the new label."""
+        if isinstance(comb_class, bytes):
+            self._arena.extend(comb_class)
+        else:
+            self._objects[label] = comb_class
+        self._offsets.append(len(self._arena))
+
+    def _index(self, key: ClassKey, label: int) -> None:
+        """Index the new label by its lookup key."""
+        self.label_dict[key] = label
+
+    def add(
+        self,
+        comb_class: ClassKey,
+        compressed: bool = False,
+        key: Optional[ClassKey] = None,
+    ) -> int:
         """
-        Add a combinatorial class to the database.
+        Add a combinatorial class to the database and return its label.
+
+        The lookup key of a compressed class can be given, so that it is not
+        decompressed to compute it.
         """
-        if not compressed and not isinstance(comb_class, self.combinatorial_class):
-            raise TypeError(
-                ("Trying to add something that isn't a CombinatorialClass.")
-            )
-        if not compressed:
-            assert isinstance(
-                comb_class, self.combinatorial_class
-            ), "trying to add non combinatorial class to database"
-            compressed_class = self._compress(comb_class)
+        if compressed:
+            if key is None:
+                key = self._compressed_lookup_key(comb_class)
+            raw = None
         else:
-            compressed_class = comb_class
-        if compressed_class not in self.class_to_info:
-            label = len(self.class_to_info)
-            self.comb_class_list.append(compressed_class)
-            self.label_dict[compressed_class] = label
-            self.empty_list.append(None)
+            if not isinstance(comb_class, self.combinatorial_class):
+                raise TypeError(
+                    "Trying to add something that isn't a CombinatorialClass."
+                )
+            key, raw = self._lookup_key(comb_class)
+        return self._add_key(key, raw, comb_class)
+
+    def _add_key(
+        self, key: ClassKey, raw: Optional[bytes], comb_class: ClassKey
+    ) -> int:
+        """
+        Return the label of the class with the lookup key, adding it if new.
+        The raw bytes are given if the class is not compressed yet.
+        """
+        label = self._find(key)
+        if label is None:
+            if raw is not None:
+                comb_class = self._compress_bytes(raw)
+            label = len(self)
+            self._store(label, comb_class)
+            if label % 4 == 0:
+                self._empty.append(0)
+            self._index(key, label)
+            if self.journal is not None:
+                self.journal.record(ADD_CLASS, comb_class)
+        return label
 
     def _get_info(self, key: Key) -> Info:
         """
         Return Info for given key.
         """
-        if isinstance(key, self.combinatorial_class):
-            compressed_key = self._compress(key)
-            info = self.class_to_info.get(compressed_key)
-            if info is None:
-                self.add(compressed_key, compressed=True)
-                info = self.class_to_info[compressed_key]
-        elif isinstance(key, int):
-            info = self.label_to_info.get(key)
-            if info is None:
-                raise KeyError("Key not in ClassDB.")
-        else:
-            raise TypeError(
-                "ClassDB only accepts"
-                "CombinatorialClass and will decompress with"
-                f"{self.combinatorial_class}."
-            )
-        return cast(Info, info)
+        label = self.get_label(key)
+        return Info(self._key(label), label, self._get_empty(label))
+
+    def _get_empty(self, label: int) -> Optional[bool]:
+        state = (self._empty[label >> 2] >> ((label & 3) << 1)) & 3
+        if state == ClassDB.UNKNOWN:
+            return None
+        return state == ClassDB.EMPTY
+
+    def _set_empty(self, label: int, empty: bool) -> None:
+        shift = (label & 3) << 1
+        state = ClassDB.EMPTY if empty else ClassDB.NOT_EMPTY
+        byte = self._empty[label >> 2] & ~(3 << shift)
+        self._empty[label >> 2] = byte | (state << shift)
+
+    def _lookup_key(
+        self, comb_class: CombinatorialClassType
+    ) -> Tuple[ClassKey, Optional[bytes]]:
+        """
+        Return the key used to look up the class and its bytes if 'to_bytes' is
+        implemented.
+
+        The key is a digest of the bytes, so that the class is only compressed
+        when added to the database.
+        """
+        start = time.time()
+        raw: Optional[bytes] = None
+        key: ClassKey = comb_class
+        try:
+            raw = comb_class.to_bytes()
+            key = blake2b(raw, digest_size=16).digest()
+        except NotImplementedError:
+            pass
+        self._lookup_time += time.time() - start
+        return key, raw
+
+    def _compressed_lookup_key(self, key: ClassKey) -> ClassKey:
+        """Return the key used to look up the compressed class."""
+        if isinstance(key, bytes):
+            return blake2b(self.codec.decompress(key), digest_size=16).digest()
+        return key
+
+    def _compress_bytes(self, raw: bytes) -> bytes:
+        """Return the compressed bytes of a class."""
+        start = time.time()
+        version = self.codec.version
+        compressed = self.codec.compress(raw)
+        self._compress_time += time.time() - start
+        self._raw_size += len(raw)
+        self._compressed_size += len(compressed)
+        self._compressed_classes += 1
+        if self.journal is not None and self.codec.version != version:
+            self.journal.record(SET_CODEC, self.codec)
+        return compressed
 
     def _compress(self, key: CombinatorialClassType) -> ClassKey:
         """
@@ -219,7 +392,7 @@ class ClassDB(Generic[CombinatorialClassType]):
         """
         # pylint: disable=no-self-use
         try:
-            return zlib.compress(key.to_bytes(), 9)
+            return self._compress_bytes(key.to_bytes())
         except NotImplementedError:
             # to use compression you should implement a 'to_bytes' function.
             return key
@@ -232,7 +405,7 @@ class ClassDB(Generic[CombinatorialClassType]):
             assert isinstance(key, bytes)
             return cast(
                 CombinatorialClassType,
-                self.combinatorial_class.from_bytes(zlib.decompress(key)),
+                self.combinatorial_class.from_bytes(self.codec.decompress(key)),
             )
         except (AssertionError, NotImplementedError):
             # to use compression you should implement a 'from_bytes' function.
@@ -246,14 +419,45 @@ class ClassDB(Generic[CombinatorialClassType]):
         Return combinatorial class of key.
         """
         info = self._get_info(key)
-        return self._decompress(info.comb_class)
+        return self._cached_class(info.label, info.comb_class)
+
+    def _cached_class(self, label: int, key: ClassKey) -> CombinatorialClassType:
+        """
+        Return the decompressed class with the given label, from the class cache
+        if kept there.
+        """
+        if self.class_cache is None or not isinstance(key, bytes):
+            return self._decompress(key)
+        comb_class = self.class_cache.get(label)
+        if comb_class is None:
+            raw = self.codec.decompress(key)
+            comb_class = cast(
+                CombinatorialClassType, self.combinatorial_class.from_bytes(raw)
+            )
+            self.class_cache.put(label, comb_class, len(raw))
+        return comb_class
 
     def get_label(self, key: Key) -> int:
         """
         Return label of key.
         """
-        info = self._get_info(key)
-        return info.label
+        if isinstance(key, self.combinatorial_class):
+            return self.add(key)
+        if isinstance(key, int):
+            if not 0 <= key < len(self):
+                raise KeyError("Key not in ClassDB.")
+            return key
+        raise TypeError(
+            "ClassDB only accepts"
+            "CombinatorialClass and will decompress with"
+            f"{self.combinatorial_class}."
+        )
+
+    def get_labels(self, keys: Iterable[Key]) -> List[int]:
+        """
+        Return the labels of the keys.
+        """
+        return [self.get_label(key) for key in keys]
 
     def is_empty(
         self, comb_class: CombinatorialClassType, label: Optional[int] = None
@@ -262,15 +466,14 @@ class ClassDB(Generic[CombinatorialClassType]):
         Return True if combinatorial class is empty set, False if not.
         """
         if label is None:
-            label = self.label_dict[self._compress(comb_class)]
-
-        empty = self.empty_list[label]
+            label = self.get_label(comb_class)
+        empty = self._get_empty(label)
         if empty is None:
             if not isinstance(comb_class, self.combinatorial_class):
                 comb_class = self.get_class(comb_class)
             empty = self._is_empty(comb_class)
             self.set_empty(label, empty)
-        return bool(empty)
+        return empty
 
     def _is_empty(self, comb_class: CombinatorialClassType) -> bool:
         if not isinstance(comb_class, self.combinatorial_class):
@@ -285,7 +488,10 @@ class ClassDB(Generic[CombinatorialClassType]):
         """
         Update database about comb class being empty.
         """
-        self.empty_list[self.get_label(key)] = empty
+        label = self.get_label(key)
+        if self.journal is not None and self._get_empty(label) != empty:
+            self.journal.record(SET_EMPTY, label, empty)
+        self._set_empty(label, empty)
 
     def status(self) -> str:
         """
@@ -293,7 +499,249 @@ class ClassDB(Generic[CombinatorialClassType]):
         """
         status = "ClassDB status:\n"
         status += "\tTotal number of combinatorial classes found is"
-        status += f" {len(self.label_to_info):,d}\n"
+        status += f" {len(self):,d}\n"
         status += f"\tis_empty check applied {self._empty_num_application} time. "
-        status += f"Time spent: {timedelta(seconds=int(self._empty_time))}"
+        status += f"Time spent: {timedelta(seconds=int(self._empty_time))}\n"
+        status += self._key_times_status() + "\n"
+        status += self._storage_status()
+        return status
+
+    def _key_times_status(self) -> str:
+        status = "\tTime spent looking up classes: "
+        status += f"{timedelta(seconds=int(self._lookup_time))}, "
+        status += "compressing classes: "
+        status += f"{timedelta(seconds=int(self._compress_time))}"
+        if self._compressed_classes:
+            status += "\n\tAverage bytes per class: "
+            status += f"{self._compressed_size / self._compressed_classes:.1f}"
+            status += f" compressed, {self._raw_size / self._compressed_classes:.1f}"
+            status += " uncompressed"
+        if self.class_cache is not None:
+            status += f"\n\tClass cache: {self.class_cache.status()}"
+        return status
+
+    def _index_bytes(self) -> int:
+        """
+        Return the bytes used by the offsets, the emptiness and the lookup
+        index. The keys that are classes without 'to_bytes' are counted with
+        the classes.
+        """
+        nbytes = self._offsets.itemsize * len(self._offsets) + len(self._empty)
+        nbytes += sys.getsizeof(self.label_dict)
+        if not self._objects:
+            nbytes += sum(map(sys.getsizeof, self.label_dict))
+        return nbytes
+
+    def _class_bytes(self) -> int:
+        """
+        Return the bytes used by the classes: the arena and, for the classes
+        without 'to_bytes', the objects themselves without what they refer to.
+        """
+        nbytes = len(self._arena)
+        if self._objects:
+            nbytes += sys.getsizeof(self._objects)
+            nbytes += sum(map(sys.getsizeof, self._objects.values()))
+        return nbytes
+
+    def _storage_status(self) -> str:
+        classes = self._class_bytes()
+        index = self._index_bytes()
+        status = f"\tClasses stored in memory: {size_to_readable(classes + index)} "
+        status += f"({size_to_readable(classes)} of classes, "
+        status += f"{size_to_readable(index)} of offsets, emptiness and index)"
+        return status
+
+
+class DiskClassDB(ClassDB[CombinatorialClassType]):
+    """
+    A ClassDB keeping the compressed classes in a file rather than in memory.
+
+    Only the digest of each class, its position in the file and whether it
+    is empty are kept in memory, together with the `cache_size` classes most
+    recently used. If no path is given, a temporary file is used. A file
+    already at the path is never overwritten: a FileExistsError is raised
+    instead.
+
+    Classes implementing 'to_bytes' are stored as their compressed bytes and
+    the others are pickled. These are looked up using their hash and compared
+    with the classes in the file with the same hash. As the hash may change
+    from a process to another, this index is not pickled but rebuilt from the
+    file.
+    """
+
+    def __init__(
+        self,
+        combinatorial_class: Type[CombinatorialClassType],
+        path: Optional[str] = None,
+        cache_size: int = 10000,
+        codec: Optional[Codec] = None,
+        class_cache_size: Optional[int] = None,
+        class_cache_bytes: Optional[int] = None,
+    ):
+        super().__init__(
+            combinatorial_class, codec, class_cache_size, class_cache_bytes
+        )
+        self.path = path
+        self.cache_size = cache_size
+        self._file = self._open(path, "x+b")
+        self._pickled = False
+        # For a class without 'to_bytes' the hash is used as lookup key instead
+        # and the labels of the other classes with the same hash are in
+        # _collisions.
+        self._collisions: Dict[int, List[int]] = {}
+        self._cache: LRUCache[ClassKey] = LRUCache(cache_size)
+
+    @staticmethod
+    def _open(path: Optional[str], mode: str) -> BinaryIO:
+        if path is None:
+            return cast(BinaryIO, tempfile.TemporaryFile())
+        # pylint: disable=consider-using-with
+        return cast(BinaryIO, open(path, mode))
+
+    def __getstate__(self) -> dict:
+        """
+        The file is not copied, so a database and its copies must not be used
+        together.
+        """
+        if self.path is None:
+            raise TypeError("Only a DiskClassDB with a path can be pickled.")
+        self._file.flush()
+        state = self.__dict__.copy()
+        del state["_file"]
+        if self._pickled:
+            state["label_dict"] = {}
+            state["_collisions"] = {}
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._file = self._open(self.path, "r+b")
+        if self._pickled:
+            self._file.seek(self._offsets[0])
+            for label in self:
+                size = self._offsets[label + 1] - self._offsets[label]
+                self._index(pickle.loads(self._file.read(size)), label)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DiskClassDB):
+            return NotImplemented
+        return (
+            self._empty == other._empty
+            and self._offsets == other._offsets
+            and all(self._key(label) == other._key(label) for label in self)
+        )
+
+    def close(self) -> None:
+        """Close the file. The database can not be used anymore."""
+        self._file.close()
+
+    def _key(self, label: int) -> ClassKey:
+        key = self._cache.get(label)
+        if key is not None:
+            return key
+        self._file.seek(self._offsets[label])
+        data = self._file.read(self._offsets[label + 1] - self._offsets[label])
+        key = pickle.loads(data) if self._pickled else data
+        self._cache.put(label, key)
+        return key
+
+    def _find(self, key: ClassKey) -> Optional[int]:
+        if isinstance(key, bytes):
+            return self.label_dict.get(key)
+        key_hash = hash(key)
+        label = self.label_dict.get(key_hash)
+        if label is None or self._key(label) == key:
+            return label
+        for label in self._collisions.get(key_hash, ()):
+            if self._key(label) == key:
+                return label
+        return None
+
+    def _store(self, label: int, comb_class: ClassKey) -> None:
+        if isinstance(comb_class, bytes):
+            data = comb_class
+        else:
+            self._pickled = True
+            data = pickle.dumps(comb_class, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.seek(self._offsets[-1])
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._cache.put(label, comb_class)
+
+    def _index(self, key: ClassKey, label: int) -> None:
+        if isinstance(key, bytes):
+            self.label_dict[key] = label
+            return
+        key_hash = hash(key)
+        if key_hash in self.label_dict:
+            self._collisions.setdefault(key_hash, []).append(label)
+        else:
+            self.label_dict[key_hash] = label
+
+    def _index_bytes(self) -> int:
+        nbytes = super()._index_bytes()
+        nbytes += sys.getsizeof(self._collisions)
+        nbytes += sum(map(sys.getsizeof, self._collisions.values()))
+        return nbytes
+
+    def _storage_status(self) -> str:
+        status = "\tClasses stored on disk: "
+        status += f"{size_to_readable(self._offsets[-1])}, "
+        status += "offsets, emptiness and index in memory: "
+        status += f"{size_to_readable(self._index_bytes())}, "
+        status += f"cache {self._cache.status()}"
         return status
+
+
+class ThreadSafeClassDB(ClassDB[CombinatorialClassType]):
+    """
+    A ClassDB that can be used by several threads at once.
+
+    The bytes and the digest of a class are computed without holding the lock,
+    so threads only wait for each other to compress and store a new class. The
+    labels are allocated under the lock, so each class gets a single label.
+    """
+
+    def __init__(
+        self,
+        combinatorial_class: Type[CombinatorialClassType],
+        codec: Optional[Codec] = None,
+        class_cache_size: Optional[int] = None,
+        class_cache_bytes: Optional[int] = None,
+    ):
+        super().__init__(
+            combinatorial_class, codec, class_cache_size, class_cache_bytes
+        )
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _add_key(
+        self, key: ClassKey, raw: Optional[bytes], comb_class: ClassKey
+    ) -> int:
+        label = self._find(key)
+        if label is not None:
+            return label
+        with self._lock:
+            return super()._add_key(key, raw, comb_class)
+
+    def _key(self, label: int) -> ClassKey:
+        with self._lock:
+            return super()._key(label)
+
+    def _cached_class(self, label: int, key: ClassKey) -> CombinatorialClassType:
+        if self.class_cache is None:
+            return super()._cached_class(label, key)
+        with self._lock:
+            return super()._cached_class(label, key)
+
+    def _set_empty(self, label: int, empty: bool) -> None:
+        with self._lock:
+            super()._set_empty(label, empty)
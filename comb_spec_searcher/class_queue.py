@@ -3,15 +3,57 @@ A queue of labels.
 """
 
 import abc
+import heapq
+import math
+import statistics
 from collections import Counter, deque
-from typing import Counter as CounterType
-from typing import Deque, Iterator, List, Set, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import tabulate
 
 from comb_spec_searcher.exception import NoMoreClassesToExpandError
+from comb_spec_searcher.journal import (
+    QUEUE_ADD,
+    QUEUE_NEXT,
+    QUEUE_SET_NOT_INFERRABLE,
+    QUEUE_SET_STOP_YIELDING,
+    Journal,
+)
+from comb_spec_searcher.label_containers import (
+    LabelCounter,
+    LabelSet,
+    SpillCounter,
+    SpillDeque,
+)
 from comb_spec_searcher.strategies.strategy_pack import StrategyPack
-from comb_spec_searcher.typing import WorkPacket
+from comb_spec_searcher.typing import CSSstrategy, WorkPacket
+
+if TYPE_CHECKING:
+    from comb_spec_searcher import CombinatorialSpecificationSearcher
+
+LabelQueue = Union[Deque[int], SpillDeque]
+
+__all__ = [
+    "CSSQueue",
+    "DefaultQueue",
+    "CostQueue",
+    "AdaptiveQueue",
+    "SpillQueue",
+    "depth_score",
+    "size_score",
+    "strategy_cost_score",
+]
 
 
 class CSSQueue(abc.ABC):
@@ -29,6 +71,13 @@ class CSSQueue(abc.ABC):
             return NotImplemented
         return self.__class__ == other.__class__ and self.__dict__ == other.__dict__
 
+    def link_searcher(self, searcher: "CombinatorialSpecificationSearcher") -> None:
+        """
+        Called by the searcher using the queue, before any label is added. The
+        queue can then use the databases of the searcher.
+        """
+        # pylint: disable=no-self-use
+
     @abc.abstractmethod
     def add(self, label: int) -> None:
         """Add a label to the queue."""
@@ -56,6 +105,17 @@ class CSSQueue(abc.ABC):
     def status(self) -> str:
         """Return a string that indicates that current status of the queue."""
 
+    def peek(self, size: int) -> Iterator[WorkPacket]:
+        """
+        Yield up to `size` of the WorkPackets that are expected to be yielded
+        next, without changing the queue.
+
+        This is only a prediction used to expand classes ahead of time and it
+        is fine for it to be wrong or empty.
+        """
+        # pylint: disable=unused-argument
+        return iter(())
+
     def __iter__(self) -> Iterator[WorkPacket]:
         return self
 
@@ -82,22 +142,62 @@ class DefaultQueue(CSSQueue):
     def __init__(self, pack: StrategyPack):
         super().__init__(pack)
         self.working: Deque[int] = deque()
-        self.next_level: CounterType[int] = Counter()
-        self.curr_level: Tuple[Deque[int], ...] = tuple(
+        self.next_level: Union[LabelCounter, SpillCounter] = LabelCounter()
+        self.curr_level: Tuple[LabelQueue, ...] = tuple(
             deque() for _ in self.expansion_strats
         )
         # One extra deque to be able to set ignore
         self.curr_level = self.curr_level + (deque(),)
-        self._inferral_expanded: Set[int] = set()
-        self._initial_expanded: Set[int] = set()
-        self.ignore: Set[int] = set()
+        self._inferral_expanded = LabelSet()
+        self._initial_expanded = LabelSet()
+        self.ignore = LabelSet()
         self.queue_sizes: List[int] = []
         self.staging: Deque[WorkPacket] = deque([])
+        self.journal: Optional[Journal] = None
+        self._searcher: Optional["CombinatorialSpecificationSearcher"] = None
+
+    @property
+    def replayable(self) -> bool:
+        """
+        True if the packets yielded only depend on the changes recorded in the
+        journal, so that the queue can be rebuilt from it.
+        """
+        return True
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, DefaultQueue):
             return NotImplemented
-        return self.__class__ == other.__class__ and self.__dict__ == other.__dict__
+        return self.__class__ == other.__class__ and self._state() == other._state()
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Convert the sets and Counter of queues pickled before LabelSet."""
+        for name, value in state.items():
+            if isinstance(value, set):
+                state[name] = LabelSet(value)
+            elif isinstance(value, Counter):
+                state[name] = LabelCounter(value)
+        state.setdefault("_searcher", None)
+        self.__dict__.update(state)
+
+    def _state(self) -> Dict[str, Any]:
+        """The attributes compared by __eq__, i.e. all but the searcher."""
+        state = self.__dict__.copy()
+        del state["_searcher"]
+        return state
+
+    def link_searcher(self, searcher: "CombinatorialSpecificationSearcher") -> None:
+        self._searcher = searcher
+
+    @property
+    def searcher(self) -> "CombinatorialSpecificationSearcher":
+        """The searcher using the queue."""
+        if self._searcher is None:
+            raise RuntimeError("The queue is not linked with a searcher.")
+        return self._searcher
+
+    def _expansion_order(self, idx: int) -> Tuple[CSSstrategy, ...]:
+        """Return the strategies of the expansion set at index idx in order."""
+        return self.expansion_strats[idx]
 
     @property
     def levels_completed(self):
@@ -105,16 +205,27 @@ class DefaultQueue(CSSQueue):
         return len(self.queue_sizes)
 
     def add(self, label: int) -> None:
+        if self.journal is not None:
+            self.journal.record(QUEUE_ADD, label)
         if self.can_do_inferral(label) or self.can_do_initial(label):
             self.working.append(label)
         elif label not in self.ignore:
-            self.next_level.update((label,))
+            self._to_next_level(label)
+
+    def _to_next_level(self, label: int) -> None:
+        """Queue the label to be expanded with the expansion strategies."""
+        self.next_level.update((label,))
 
     def set_verified(self, label) -> None:
         self.set_stop_yielding(label)
 
     def set_not_inferrable(self, label: int) -> None:
         """Mark the label such that it's not expanded with inferral anymore"""
+        if self.journal is not None:
+            self.journal.record(QUEUE_SET_NOT_INFERRABLE, label)
+        self._set_not_inferrable(label)
+
+    def _set_not_inferrable(self, label: int) -> None:
         if label not in self.ignore:
             self._inferral_expanded.add(label)
 
@@ -124,11 +235,16 @@ class DefaultQueue(CSSQueue):
             self._initial_expanded.add(label)
 
     def set_stop_yielding(self, label: int) -> None:
+        if self.journal is not None:
+            self.journal.record(QUEUE_SET_STOP_YIELDING, label)
+        self._set_stop_yielding(label)
+
+    def _set_stop_yielding(self, label: int) -> None:
         self.ignore.add(label)
         # can remove it elsewhere to keep sets "small"
         self._inferral_expanded.discard(label)
         self._initial_expanded.discard(label)
-        self.next_level.pop(label, None)
+        self.next_level.discard(label)
 
     def can_do_inferral(self, label: int) -> bool:
         """Return true if inferral strategies can be applied."""
@@ -157,13 +273,11 @@ class DefaultQueue(CSSQueue):
         assert not self.staging, "Can't change level is staging is not empty"
         assert not self.working, "Can't change level is working is not empty"
         assert not any(self.curr_level), "Can't change level is curr_level is not empty"
-        self.curr_level[0].extend(
-            label for label, _ in sorted(self.next_level.items(), key=lambda x: -x[1])
-        )
+        self.curr_level[0].extend(self.next_level.by_count())
         if not any(self.curr_level):
             raise StopIteration
         self.queue_sizes.append(len(self.curr_level[0]))
-        self.next_level = Counter()
+        self.next_level.clear()
 
     def _iter_helper_curr(self) -> Iterator[WorkPacket]:
         assert any(self.curr_level), "The current queue is empty"
@@ -176,9 +290,9 @@ class DefaultQueue(CSSQueue):
             )
         )
         if idx == len(self.expansion_strats):
-            self.set_stop_yielding(label)
+            self._set_stop_yielding(label)
             return
-        for strat in self.expansion_strats[idx]:
+        for strat in self._expansion_order(idx):
             yield WorkPacket(label, (strat,), False)
         self.curr_level[idx + 1].append(label)
 
@@ -186,14 +300,42 @@ class DefaultQueue(CSSQueue):
         label = self.working.popleft()
         if self.can_do_inferral(label):
             yield WorkPacket(label, self.inferral_strategies, True)
-            self.set_not_inferrable(label)
+            self._set_not_inferrable(label)
         if self.can_do_initial(label):
             for strat in self.initial_strategies:
                 yield WorkPacket(label, (strat,), False)
             self.set_not_initial(label)
-        self.next_level.update((label,))
+        self._to_next_level(label)
+
+    def peek(self, size: int) -> Iterator[WorkPacket]:
+        if size <= 0:
+            return
+        for wp in self.staging:
+            if wp.label not in self.ignore:
+                yield wp
+                size -= 1
+                if size == 0:
+                    return
+        for label in self.working:
+            if self.can_do_initial(label):
+                for strat in self.initial_strategies:
+                    yield WorkPacket(label, (strat,), False)
+                    size -= 1
+                    if size == 0:
+                        return
+        for idx, queue in enumerate(self.curr_level[:-1]):
+            for label in queue:
+                if label in self.ignore:
+                    continue
+                for strat in self._expansion_order(idx):
+                    yield WorkPacket(label, (strat,), False)
+                    size -= 1
+                    if size == 0:
+                        return
 
     def __next__(self) -> WorkPacket:
+        if self.journal is not None:
+            self.journal.record(QUEUE_NEXT)
         while True:
             while self.staging:
                 wp = self.staging.popleft()
@@ -235,3 +377,275 @@ class DefaultQueue(CSSQueue):
         status += "\tThe size of the current queues at each level: "
         status += ", ".join(map(str, self.queue_sizes))
         return status
+
+
+Scorer = Callable[["CostQueue", int, int], float]
+
+
+def depth_score(queue: "CostQueue", label: int, idx: int) -> float:
+    """The number of rules from the start class to the label."""
+    # pylint: disable=unused-argument
+    return queue.depth.get(label, 0)
+
+
+def size_score(queue: "CostQueue", label: int, idx: int) -> float:
+    """
+    The compressed size of the class in the ClassDB, or 0 for the classes not
+    implementing 'to_bytes'.
+    """
+    # pylint: disable=unused-argument
+    comb_class = queue.searcher.classdb.label_to_info[label].comb_class
+    return len(comb_class) if isinstance(comb_class, bytes) else 0
+
+
+def strategy_cost_score(queue: "CostQueue", label: int, idx: int) -> float:
+    """
+    The average time taken so far by the expansion strategies at index idx,
+    the ones left to apply to the label.
+    """
+    # pylint: disable=unused-argument
+    searcher = queue.searcher
+    cost = 0.0
+    for strategy in queue.expansion_strats[idx]:
+        calls = searcher.func_calls.get(str(strategy), 0)
+        if calls:
+            cost += searcher.func_times[str(strategy)] / calls
+    return cost
+
+
+class CostQueue(DefaultQueue):
+    """
+    A queue expanding first the labels with the lowest score.
+
+    The labels expanded with inferral and initial strategies are handled as in
+    the DefaultQueue. Then each label is pushed on a heap once for each set of
+    expansion strategies, with the score given by `score(queue, label, idx)`
+    where idx is the index of the set. The scorers `depth_score`, `size_score`
+    and `strategy_cost_score` are given, the default being the depth.
+
+    The heap has no levels, so `do_level` yields the packets until the queue is
+    empty.
+    """
+
+    def __init__(self, pack: StrategyPack, score: Scorer = depth_score):
+        super().__init__(pack)
+        self.score = score
+        self.depth: Dict[int, int] = {}
+        self.heap: List[Tuple[float, int, int, int]] = []
+        self._pushes = 0
+        self._queued = LabelSet()
+        self._current: Optional[int] = None
+
+    @property
+    def replayable(self) -> bool:
+        return self.score is not strategy_cost_score
+
+    def add(self, label: int) -> None:
+        if label not in self.depth:
+            parent_depth = -1 if self._current is None else self.depth[self._current]
+            self.depth[label] = parent_depth + 1
+        super().add(label)
+
+    def _to_next_level(self, label: int) -> None:
+        if label not in self._queued:
+            self._queued.add(label)
+            self._push(label, 0)
+
+    def _push(self, label: int, idx: int) -> None:
+        """
+        Push the label to be expanded with the set of expansion strategies at
+        index idx. Once all the sets are applied the label is pushed to be
+        stopped as soon as its packets are yielded.
+        """
+        if idx < len(self.expansion_strats):
+            score = self.score(self, label, idx)
+        else:
+            score = float("-inf")
+        heapq.heappush(self.heap, (score, self._pushes, idx, label))
+        self._pushes += 1
+
+    def _populate_staging(self) -> None:
+        while not self.staging and self.working:
+            self.staging.extend(self._iter_helper_working())
+        while not self.staging:
+            if not self.heap:
+                raise StopIteration
+            self.staging.extend(self._iter_helper_heap())
+
+    def _iter_helper_heap(self) -> Iterator[WorkPacket]:
+        _, _, idx, label = heapq.heappop(self.heap)
+        if label in self.ignore:
+            return
+        if idx == len(self.expansion_strats):
+            self._set_stop_yielding(label)
+            return
+        for strat in self._expansion_order(idx):
+            yield WorkPacket(label, (strat,), False)
+        self._push(label, idx + 1)
+
+    def peek(self, size: int) -> Iterator[WorkPacket]:
+        if size <= 0:
+            return
+        for wp in self.staging:
+            if wp.label not in self.ignore:
+                yield wp
+                size -= 1
+                if size == 0:
+                    return
+        for _, _, idx, label in heapq.nsmallest(size, self.heap):
+            if label in self.ignore or idx == len(self.expansion_strats):
+                continue
+            for strat in self._expansion_order(idx):
+                yield WorkPacket(label, (strat,), False)
+                size -= 1
+                if size == 0:
+                    return
+
+    def __next__(self) -> WorkPacket:
+        wp = super().__next__()
+        self._current = wp.label
+        return wp
+
+    def do_level(self) -> Iterator[WorkPacket]:
+        """Yield the WorkPackets until the queue is empty."""
+        try:
+            yield next(self)
+        except StopIteration as e:
+            raise NoMoreClassesToExpandError from e
+        yield from self
+
+    def status(self) -> str:
+        status = "Queue status:\n"
+        table: List[Tuple[str, str]] = []
+        table.append(("working", f"{len(self.working):,d}"))
+        table.append(("heap", f"{len(self.heap):,d}"))
+        status += "    "
+        headers = ("Queue", "Size")
+        colalign = ("left", "right")
+        status += (
+            tabulate.tabulate(table, headers=headers, colalign=colalign).replace(
+                "\n", "\n    "
+            )
+            + "\n"
+        )
+        name = getattr(self.score, "__name__", repr(self.score))
+        status += f"\tScores ({name}) "
+        scores = sorted(
+            score for score, _, idx, _ in self.heap if idx < len(self.expansion_strats)
+        )
+        if len(scores) < 2:
+            status += "in the heap: " + ", ".join(f"{s:g}" for s in scores)
+            return status
+        quartiles = statistics.quantiles(scores, n=4)
+        status += "in the heap: "
+        status += f"min {scores[0]:g}, first quartile {quartiles[0]:g}, "
+        status += f"median {quartiles[1]:g}, third quartile {quartiles[2]:g}, "
+        status += f"max {scores[-1]:g}"
+        return status
+
+
+class AdaptiveQueue(DefaultQueue):
+    """
+    A DefaultQueue applying the strategies of each expansion set in an order
+    learned from the applications, time and rules of each strategy counted by
+    the searcher.
+
+    Each set is a multi-armed bandit whose arms are its strategies. A strategy
+    is rewarded by the rules it finds per second, each rule whose parent is
+    found to be in a specification counting as `used_weight` rules, relative
+    to the best strategy of the set. The strategies are sorted by their UCB1
+    index, the ones never applied first, so the cheap and productive
+    strategies run first while the others keep being tried. Every strategy of
+    a set is still applied to every label expanded, only the order changes.
+
+    The order depends on the time taken by the strategies, so the queue cannot
+    be used with a journal.
+    """
+
+    def __init__(
+        self, pack: StrategyPack, exploration: float = 1.0, used_weight: float = 10.0
+    ):
+        super().__init__(pack)
+        self.exploration = exploration
+        self.used_weight = used_weight
+
+    @property
+    def replayable(self) -> bool:
+        return False
+
+    def _rate(self, key: str) -> float:
+        """The rules found per second by the strategy."""
+        searcher = self.searcher
+        used = searcher.func_used.get(key, 0)
+        rules = searcher.func_yield.get(key, 0) + self.used_weight * used
+        return rules / max(searcher.func_times.get(key, 0.0), 1e-6)
+
+    def _expansion_order(self, idx: int) -> Tuple[CSSstrategy, ...]:
+        strategies = self.expansion_strats[idx]
+        if self._searcher is None or len(strategies) < 2:
+            return strategies
+        calls = self.searcher.func_calls
+        keys = [str(strategy) for strategy in strategies]
+        rates = [self._rate(key) for key in keys]
+        best = max(rates) or 1.0
+        total = sum(calls.get(key, 0) for key in keys)
+
+        def ucb(i: int) -> float:
+            applied = calls.get(keys[i], 0)
+            if applied == 0:
+                return math.inf
+            bonus = math.sqrt(2 * math.log(total) / applied)
+            return rates[i] / best + self.exploration * bonus
+
+        order = sorted(range(len(strategies)), key=ucb, reverse=True)
+        return tuple(strategies[i] for i in order)
+
+    def status(self) -> str:
+        status = super().status()
+        if self._searcher is None:
+            return status
+        searcher = self.searcher
+        table: List[Tuple[str, str, str, str, str]] = []
+        for idx in range(len(self.expansion_strats)):
+            for strategy in self._expansion_order(idx):
+                key = str(strategy)
+                table.append(
+                    (
+                        f"set {idx + 1}: {key}",
+                        f"{searcher.func_calls.get(key, 0):,d}",
+                        f"{searcher.func_yield.get(key, 0):,d}",
+                        f"{searcher.func_used.get(key, 0):,d}",
+                        f"{self._rate(key):,.1f}",
+                    )
+                )
+        headers = ("Strategy order", "Applications", "Rules", "In specs", "Rules/s")
+        colalign = ("left", "right", "right", "right", "right")
+        status += "\n    "
+        status += tabulate.tabulate(table, headers=headers, colalign=colalign).replace(
+            "\n", "\n    "
+        )
+        return status
+
+
+class SpillQueue(DefaultQueue):
+    """
+    A DefaultQueue for levels too big to be held in memory.
+
+    The next level and each current level keep at most about `max_labels`
+    labels in memory, the others being written to temporary files in
+    `spill_dir`, the default temporary directory if None. The next level is
+    written as runs sorted by label and merged when the level changes, so the
+    classes are expanded in the same order as by the DefaultQueue.
+    """
+
+    def __init__(
+        self,
+        pack: StrategyPack,
+        max_labels: int = 1_000_000,
+        spill_dir: Optional[str] = None,
+    ):
+        super().__init__(pack)
+        self.next_level = SpillCounter(max_labels, spill_dir)
+        self.curr_level = tuple(
+            SpillDeque(max_labels, spill_dir) for _ in self.curr_level
+        )
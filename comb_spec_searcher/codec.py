@@ -0,0 +1,120 @@
+"""
+The codecs used by a ClassDB to compress the bytes of combinatorial classes.
+
+All the codecs produce zlib streams, so any codec can decompress what the
+others compressed, except for the streams using a preset dictionary that need
+the codec holding it. The zlib header of these give the checksum of the
+dictionary used.
+"""
+
+import abc
+import zlib
+from collections import Counter
+from typing import List, Optional
+
+__all__ = ["Codec", "ZlibCodec", "ZdictCodec"]
+
+# The flag of the zlib header indicating a preset dictionary
+FDICT = 0x20
+
+
+class Codec(abc.ABC):
+    """
+    A way to compress the bytes of combinatorial classes.
+
+    The version is increased whenever the codec changes in a way that is needed
+    to decompress what it compresses from then on.
+    """
+
+    version = 0
+
+    @abc.abstractmethod
+    def compress(self, raw: bytes) -> bytes:
+        """Return the compressed bytes."""
+
+    def decompress(self, data: bytes) -> bytes:
+        """Return the bytes that were compressed."""
+        # pylint: disable=no-self-use
+        return zlib.decompress(data)
+
+
+class ZlibCodec(Codec):
+    """
+    Compress each class independently with zlib at the given level. Level 9
+    gives the best ratio and level 1 is the fastest.
+    """
+
+    def __init__(self, level: int = 9):
+        self.level = level
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ZlibCodec):
+            return NotImplemented
+        return self.level == other.level
+
+    def compress(self, raw: bytes) -> bytes:
+        return zlib.compress(raw, self.level)
+
+
+class ZdictCodec(Codec):
+    """
+    Compress the classes with a zlib preset dictionary trained from the first
+    `training_size` classes compressed, which are compressed without it.
+
+    The bytes shared by the classes of a universe, like the headers, then only
+    need to be stored once, in the dictionary. The dictionary is made of the
+    chunks of `chunk_size` bytes appearing the most in the training classes, the
+    most common being last where zlib finds them faster.
+    """
+
+    def __init__(
+        self,
+        level: int = 9,
+        training_size: int = 1000,
+        dict_size: int = 32768,
+        chunk_size: int = 8,
+    ):
+        self.level = level
+        self.training_size = training_size
+        self.dict_size = dict_size
+        self.chunk_size = chunk_size
+        self.zdict: Optional[bytes] = None
+        self._samples: List[bytes] = []
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ZdictCodec):
+            return NotImplemented
+        return self.__dict__ == other.__dict__
+
+    def compress(self, raw: bytes) -> bytes:
+        if self.zdict is None:
+            self._samples.append(raw)
+            if len(self._samples) >= self.training_size:
+                self.train()
+            return zlib.compress(raw, self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        return compressor.compress(raw) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        if not data[1] & FDICT:
+            return zlib.decompress(data)
+        assert self.zdict is not None, "The data needs a dictionary"
+        decompressor = zlib.decompressobj(zdict=self.zdict)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def train(self) -> None:
+        """Set the dictionary from the classes compressed so far."""
+        chunks: Counter = Counter()
+        for sample in self._samples:
+            chunks.update(
+                sample[i : i + self.chunk_size]
+                for i in range(0, len(sample) - self.chunk_size + 1)
+            )
+        common = [
+            chunk
+            for chunk, count in chunks.most_common(self.dict_size // self.chunk_size)
+            if count > 1
+        ]
+        self.zdict = b"".join(reversed(common))
+        self._samples = []
+        self.version += 1
@@ -9,8 +9,10 @@ from collections import defaultdict
 from datetime import timedelta
 from typing import (
     Any,
+    Callable,
     Dict,
     Generic,
+    Iterable,
     Iterator,
     List,
     Optional,
@@ -24,9 +26,9 @@ import logzero
 import tabulate
 from logzero import logger
 
-from comb_spec_searcher.typing import CombinatorialClassType, CSSstrategy
+from comb_spec_searcher.typing import CombinatorialClassType, CSSstrategy, WorkPacket
 
-from .class_db import ClassDB
+from .class_db import ClassDB, ThreadSafeClassDB
 from .class_queue import CSSQueue, DefaultQueue
 from .exception import (
     ExceededMaxtimeError,
@@ -34,8 +36,24 @@ from .exception import (
     SpecificationNotFound,
     StrategyDoesNotApply,
 )
-from .rule_db import RuleDB
-from .rule_db.base import RuleDBAbstract
+from .expansion_cache import ExpansionCache
+from .journal import (
+    ADD_CLASS,
+    ADD_RULE,
+    INFERRAL_EXPANDED,
+    QUEUE_ADD,
+    QUEUE_NEXT,
+    QUEUE_SET_NOT_INFERRABLE,
+    QUEUE_SET_STOP_YIELDING,
+    SET_CODEC,
+    SET_EMPTY,
+    SYMMETRY_EXPANDED,
+    TRIED_TO_VERIFY,
+    Journal,
+)
+from .parallel import ExpansionPool, ThreadExpansionPool, WorkerStats
+from .rule_db import RuleDB, ThreadSafeRuleDB
+from .rule_db.base import RuleDBAbstract, RuleDBBase
 from .specification import CombinatorialSpecification
 from .strategies import AbstractStrategy, StrategyFactory, StrategyPack
 from .strategies.rule import AbstractRule
@@ -65,6 +83,7 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
     to the given strategies and search for a combinatorial specification.
     """
 
+    # pylint: disable=too-many-instance-attributes
     def __init__(
         self,
         start_class: CombinatorialClassType,
@@ -75,6 +94,10 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         classqueue: Optional[CSSQueue] = None,
         expand_verified: bool = False,
         debug: bool = False,
+        workers: int = 1,
+        threads: int = 1,
+        journal: Optional[str] = None,
+        expansion_cache: Optional[ExpansionCache] = None,
     ):
         """
         Initialise CombinatorialSpecificationSearcher.
@@ -89,6 +112,26 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
             still be expanded using the strategies in strategy pack
           - `debug`: if True every rule found will be sanity checked and logged
             to logging.DEBUG
+          - `workers`: the number of processes used to apply strategies during
+            the auto search. With more than one worker, WorkPackets are expanded
+            by a pool of processes while this process adds the rules found in
+            the same order as a serial run.
+          - `threads`: the number of threads used to apply strategies and label
+            the rules found during the auto search. The rules are added in the
+            same order as a serial run, but the classes may get other labels.
+            The ClassDB must be a ThreadSafeClassDB, and the default ClassDB and
+            RuleDB are then thread-safe.
+          - `journal`: the path of a file where every change to the universe is
+            recorded. If the file already contains a journal, the search resumes
+            from it. Each transaction is synced to the disk when written, so it
+            survives a crash of the machine. See also
+            `CombinatorialSpecificationSearcher.resume`.
+          - `expansion_cache`: an ExpansionCache where the children found by
+            the strategies are looked up before applying them, and stored
+            after. It can be shared by runs using the same file. With worker
+            processes or threads, the strategies in the cache are applied by
+            the searcher and the children found by the others in the pool are
+            stored; the strategies yielded by factories skip it.
         """
         self.strategy_pack = strategy_pack
         self.debug = debug
@@ -99,27 +142,140 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         self.func_times: Dict[str, float] = defaultdict(float)
         self.func_calls: Dict[str, int] = defaultdict(int)
         self.func_yield: Dict[str, int] = defaultdict(int)
-
-        self.classdb = (
-            classdb
-            if classdb is not None
-            else ClassDB[CombinatorialClassType](type(start_class))
-        )
+        # The number of rules of each strategy in a specification of their parent,
+        # counted when the parent is found to be in one
+        self.func_used: Dict[str, int] = defaultdict(int)
+        if workers > 1 and threads > 1:
+            raise InvalidOperationError("Use either worker processes or threads.")
+        self.workers = workers
+        self.threads = threads
+        self.worker_stats = WorkerStats()
+        self._pool: Optional[ExpansionPool] = None
+        self.expansion_cache = expansion_cache
+
+        if classdb is None and threads > 1:
+            classdb = ThreadSafeClassDB[CombinatorialClassType](type(start_class))
+        elif classdb is None:
+            classdb = ClassDB[CombinatorialClassType](type(start_class))
+        elif threads > 1 and not isinstance(classdb, ThreadSafeClassDB):
+            raise InvalidOperationError("Threads need a ThreadSafeClassDB.")
+        self.classdb = classdb
         self.classqueue = (
             DefaultQueue(strategy_pack) if classqueue is None else classqueue
         )
-        self.ruledb: RuleDBAbstract = ruledb if ruledb is not None else RuleDB()
+        if ruledb is None:
+            ruledb = ThreadSafeRuleDB() if threads > 1 else RuleDB()
+        self.ruledb: RuleDBAbstract = ruledb
         self.ruledb.link_searcher(self)
+        self.classqueue.link_searcher(self)
+        self.tried_to_verify: Set[int] = set()
+        self.symmetry_expanded: Set[int] = set()
+        self.inferral_expanded: Set[int] = set()
+
+        if journal is not None:
+            self._check_journal_support()
+            opened_journal = Journal(journal, start_class, strategy_pack)
+            resumed = self._replay_journal(opened_journal)
+            self._attach_journal(opened_journal)
+            if resumed:
+                self.start_label = self.classdb.get_label(start_class)
+                return
+            opened_journal.record(SET_CODEC, self.classdb.codec)
 
         # initialise the run with start_class
         self.start_label = self.classdb.get_label(start_class)
         self.classqueue.add(self.start_label)
-        self.tried_to_verify: Set[int] = set()
-        self.symmetry_expanded: Set[int] = set()
-        self.inferral_expanded: Set[int] = set()
         self.try_verify(start_class, self.start_label)
         if self.symmetries:
             self._symmetry_expand(start_class, self.start_label)
+        self._commit()
+
+    @classmethod
+    def resume(
+        cls, path: str, **kwargs
+    ) -> "CombinatorialSpecificationSearcher[CombinatorialClassType]":
+        """
+        Return the searcher recorded in the journal at path as it was after the
+        last WorkPacket expanded. The search keeps being recorded in the
+        journal and the kwargs are passed to the searcher.
+        """
+        start_class, pack = Journal.read_header(path)
+        return cls(start_class, pack, journal=path, **kwargs)
+
+    def _check_journal_support(self) -> None:
+        """
+        Raise an InvalidOperationError if the search cannot be rebuilt from a
+        journal, i.e. the queue or the ruledb do not record their changes or the
+        order of the queue depends on the time taken by the strategies.
+        """
+        if not (
+            isinstance(self.classqueue, DefaultQueue)
+            and isinstance(self.ruledb, RuleDBBase)
+        ):
+            raise InvalidOperationError(
+                "A journal can only be used with a DefaultQueue and a RuleDBBase."
+            )
+        if not self.classqueue.replayable:
+            raise InvalidOperationError(
+                f"A journal cannot be used with a {type(self.classqueue).__name__} "
+                "whose order depends on the time taken by the strategies."
+            )
+
+    def _attach_journal(self, journal: Journal) -> None:
+        """Record the changes made to the universe in the journal."""
+        assert isinstance(self.classqueue, DefaultQueue)
+        assert isinstance(self.ruledb, RuleDBBase)
+        self.classdb.journal = journal
+        self.ruledb.journal = journal
+        self.classqueue.journal = journal
+
+    def _replay_journal(self, journal: Journal) -> bool:
+        """
+        Apply the changes recorded in the journal and return True if there were
+        any.
+        """
+        classdb, ruledb, classqueue = self.classdb, self.ruledb, self.classqueue
+        assert isinstance(ruledb, RuleDBBase)
+        handlers: Dict[int, Callable[..., Any]] = {
+            ADD_CLASS: lambda key: classdb.add(key, compressed=True),
+            SET_EMPTY: classdb.set_empty,
+            ADD_RULE: lambda start, ends, ref, *flags: ruledb.insert(
+                start, ends, journal.get_strategy(ref), *flags
+            ),
+            QUEUE_ADD: classqueue.add,
+            QUEUE_SET_NOT_INFERRABLE: classqueue.set_not_inferrable,
+            QUEUE_SET_STOP_YIELDING: classqueue.set_stop_yielding,
+            QUEUE_NEXT: lambda: next(classqueue, None),
+            TRIED_TO_VERIFY: self.tried_to_verify.add,
+            SYMMETRY_EXPANDED: self.symmetry_expanded.add,
+            INFERRAL_EXPANDED: self.inferral_expanded.add,
+            SET_CODEC: lambda codec: setattr(classdb, "codec", codec),
+        }
+        resumed = False
+        for transaction in journal.transactions():
+            resumed = True
+            for kind, *args in transaction:
+                handlers[kind](*args)
+        return resumed
+
+    @property
+    def journal(self) -> Optional[Journal]:
+        """The journal recording the changes to the universe, if any."""
+        return self.classdb.journal
+
+    def _record(self, *record: Any) -> None:
+        if self.journal is not None:
+            self.journal.record(*record)
+
+    def _commit(self) -> None:
+        """
+        Write the changes recorded since the last commit to the journal and the
+        expansion cache.
+        """
+        if self.journal is not None:
+            self.journal.commit()
+        if self.expansion_cache is not None:
+            self.expansion_cache.commit()
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, CombinatorialSpecificationSearcher):
@@ -148,15 +304,19 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         if label in self.tried_to_verify:
             return
         self.tried_to_verify.add(label)
+        self._record(TRIED_TO_VERIFY, label)
         if self.classdb.is_empty(comb_class, label):
             return
         for strategy in self.verification_strategies:
             if self.ruledb.is_verified(label):
                 return
-            for start_label, end_labels, rule in self._expand_class_with_strategy(
-                comb_class, strategy, label
-            ):
-                self.add_rule(start_label, end_labels, rule)
+            for (
+                start_label,
+                end_labels,
+                rule,
+                hint,
+            ) in self._expand_class_with_strategy(comb_class, strategy, label):
+                self.add_rule(start_label, end_labels, rule, hint)
 
     def _expand(
         self,
@@ -171,30 +331,53 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         """
         if inferral:
             self._inferral_expand(comb_class, label, strategies)
+        elif self._pool is not None:
+            self._pool_expand(comb_class, label, strategies)
         else:
             for strategy_generator in strategies:
-                for start_label, end_labels, rule in self._expand_class_with_strategy(
+                for (
+                    start_label,
+                    end_labels,
+                    rule,
+                    hint,
+                ) in self._expand_class_with_strategy(
                     comb_class, strategy_generator, label
                 ):
-                    self.add_rule(start_label, end_labels, rule)
+                    self.add_rule(start_label, end_labels, rule, hint)
 
     @staticmethod
     def _rules_from_strategy(
-        comb_class: CombinatorialClassType, strategy: CSSstrategy
-    ) -> Iterator[AbstractRule]:
-        """Yield all the rules given by a strategy/strategy factory."""
+        comb_class: CombinatorialClassType,
+        strategy: CSSstrategy,
+        cache: Optional[ExpansionCache] = None,
+    ) -> Iterator[Tuple[int, AbstractRule]]:
+        """
+        Yield all the rules given by a strategy/strategy factory, with the
+        children of the strategies found in the cache if given.
+
+        Each rule comes with the position of the strategy or rule yielded by
+        the factory that gave it, or -1 for a strategy.
+        """
         if isinstance(strategy, AbstractStrategy):
             try:
-                yield strategy(comb_class)
+                yield -1, (
+                    strategy(comb_class)
+                    if cache is None
+                    else cache.apply(strategy, comb_class)
+                )
             except StrategyDoesNotApply:
                 pass
         elif isinstance(strategy, StrategyFactory):
-            for strat in strategy(comb_class):
+            for ordinal, strat in enumerate(strategy(comb_class)):
                 if isinstance(strat, AbstractRule):
-                    yield strat
+                    yield ordinal, strat
                 elif isinstance(strat, AbstractStrategy):
                     try:
-                        yield strat(comb_class)
+                        yield ordinal, (
+                            strat(comb_class)
+                            if cache is None
+                            else cache.apply(strat, comb_class)
+                        )
                     except StrategyDoesNotApply:
                         continue
                 else:
@@ -216,9 +399,11 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         strategy_generator: CSSstrategy,
         label: Optional[int] = None,
         initial: bool = False,
-    ) -> Iterator[Tuple[int, Tuple[int, ...], AbstractRule]]:
+    ) -> Iterator[Tuple[int, Tuple[int, ...], AbstractRule, int]]:
         """
         Will expand the class with given strategy. Return time taken.
+
+        Each rule is given with its labels and hint, see `_rule_hint`.
         """
         logger.debug(
             "Expanding label %s with %s",
@@ -228,7 +413,9 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         if label is None:
             label = self.classdb.get_label(comb_class)
 
-        for rule in self._rules_from_strategy(comb_class, strategy_generator):
+        for ordinal, rule in self._rules_from_strategy(
+            comb_class, strategy_generator, self.expansion_cache
+        ):
             try:
                 children = rule.children
             except StrategyDoesNotApply:
@@ -241,37 +428,67 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
                     comb_class,
                 )
                 continue
-            end_labels = [self.classdb.get_label(child) for child in children]
-            if rule.comb_class == comb_class:
-                start_label = label
-            else:
-                start_label = self.classdb.get_label(rule.comb_class)
+            start_label, end_labels, rule = self._label_rule(comb_class, label, rule)
+            hint = self._rule_hint(strategy_generator, ordinal, start_label == label)
+            yield start_label, end_labels, rule, hint
 
-            # TODO: observe that creating this constructor could be costly,
-            # e.g. Cartesian
-            if self.debug:
+    def _rule_hint(self, strategy: CSSstrategy, ordinal: int, own: bool) -> int:
+        """
+        Return the hint for recomputing the strategy of a rule given by the
+        strategy of the pack, or by the strategy at position `ordinal` yielded
+        by the factory of the pack. It is `idx + n * (ordinal + 1)` for the
+        strategy at index idx of the n strategies of the pack, with ordinal -1
+        for a strategy, and -1 if the strategy is not in the pack or the rule is
+        not `own`, i.e. not for the class expanded.
+        """
+        strategies = list(self.strategy_pack)
+        if own:
+            for idx, strat in enumerate(strategies):
+                if strat is strategy:
+                    return idx + len(strategies) * (ordinal + 1)
+        return -1
+
+    def _label_rule(
+        self, comb_class: CombinatorialClassType, label: int, rule: AbstractRule
+    ) -> Tuple[int, Tuple[int, ...], AbstractRule]:
+        """
+        Return the labels of the parent and children of a rule found when
+        expanding the class with the given label.
+        """
+        end_labels = self.classdb.get_labels(rule.children)
+        if rule.comb_class == comb_class:
+            start_label = label
+        else:
+            start_label = self.classdb.get_label(rule.comb_class)
+
+        # TODO: observe that creating this constructor could be costly,
+        # e.g. Cartesian
+        if self.debug:
+            logger.debug(
+                "Adding combinatorial rule %s -> %s\n%s",
+                start_label,
+                tuple(end_labels),
+                rule,
+            )
+            try:
+                n = 4
+                for i in range(n + 1):
+                    rule.sanity_check(n=i)
+                logger.debug("Sanity checked rule to length %s.", n)
+            except NotImplementedError as e:
                 logger.debug(
-                    "Adding combinatorial rule %s -> %s\n%s",
-                    start_label,
-                    tuple(end_labels),
-                    rule,
+                    "Could not sanity check rule due to:\nNotImplementedError: %s",
+                    e,
                 )
-                try:
-                    n = 4
-                    for i in range(n + 1):
-                        rule.sanity_check(n=i)
-                    logger.debug("Sanity checked rule to length %s.", n)
-                except NotImplementedError as e:
-                    logger.debug(
-                        "Could not sanity check rule due to:\n"
-                        "NotImplementedError: %s",
-                        e,
-                    )
-            yield start_label, tuple(end_labels), rule
+        return start_label, tuple(end_labels), rule
 
     @cssmethodtimer("add rule")
     def add_rule(
-        self, start_label: int, end_labels: Tuple[int, ...], rule: AbstractRule
+        self,
+        start_label: int,
+        end_labels: Tuple[int, ...],
+        rule: AbstractRule,
+        hint: int = -1,
     ) -> None:
         """
         Add the rule to the searcher
@@ -293,22 +510,109 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
             self.try_verify(comb_class, child_label)
         if rule.ignore_parent:
             self.classqueue.set_stop_yielding(start_label)
-        self.ruledb.add(start_label, end_labels, rule)
+        self.ruledb.add(start_label, end_labels, rule, hint)
+
+    def _pool_expand(
+        self,
+        comb_class: CombinatorialClassType,
+        label: int,
+        strategies: Tuple[CSSstrategy, ...],
+    ) -> None:
+        """
+        Expand the combinatorial class with the given label using the worker
+        pool. The packets expected to come next are expanded ahead of time.
+
+        The strategies whose children are in the expansion cache are applied
+        here instead, and the children the pool finds for a strategy are
+        stored in the cache.
+        """
+        assert self._pool is not None
+        cached = [self._in_expansion_cache(comb_class, strat) for strat in strategies]
+        for strategy, in_cache in zip(strategies, cached):
+            if not in_cache:
+                self._pool.submit(label, comb_class, strategy)
+        self._pool.speculate(
+            self._uncached_packets(
+                wp
+                for wp in self.classqueue.peek(self._pool.window)
+                if self.expand_verified or not self.ruledb.is_verified(wp.label)
+            ),
+            self.classdb.get_class,
+        )
+        for strategy, in_cache in zip(strategies, cached):
+            if in_cache:
+                for (
+                    start_label,
+                    end_labels,
+                    rule,
+                    hint,
+                ) in self._expand_class_with_strategy(comb_class, strategy, label):
+                    self.add_rule(start_label, end_labels, rule, hint)
+                continue
+            key = str(strategy)
+            self.func_calls[key] += 1
+            time_taken, found = self._pool.rules(label, comb_class, strategy)
+            self.func_times[key] += time_taken
+            rules = list(found)
+            if self.expansion_cache is not None and isinstance(
+                strategy, AbstractStrategy
+            ):
+                self.expansion_cache.store(
+                    strategy,
+                    comb_class,
+                    next((rule.children for (_, _, rule), _ in rules), None),
+                )
+            for (start_label, end_labels, rule), ordinal in rules:
+                self.func_yield[key] += 1
+                hint = self._rule_hint(strategy, ordinal, start_label == label)
+                self.add_rule(start_label, end_labels, rule, hint)
+
+    def _in_expansion_cache(
+        self, comb_class: CombinatorialClassType, strategy: CSSstrategy
+    ) -> bool:
+        """Return True if the children given by the strategy are in the cache."""
+        return (
+            self.expansion_cache is not None
+            and isinstance(strategy, AbstractStrategy)
+            and self.expansion_cache.contains(strategy, comb_class)
+        )
+
+    def _uncached_packets(self, packets: Iterable[WorkPacket]) -> Iterator[WorkPacket]:
+        """Yield the packets without the strategies in the expansion cache."""
+        for packet in packets:
+            if self.expansion_cache is None or packet.inferral:
+                yield packet
+                continue
+            comb_class = self.classdb.get_class(packet.label)
+            yield packet._replace(
+                strategies=tuple(
+                    strategy
+                    for strategy in packet.strategies
+                    if not self._in_expansion_cache(comb_class, strategy)
+                )
+            )
 
     def _symmetry_expand(self, comb_class: CombinatorialClassType, label: int) -> None:
         """Add symmetries of combinatorial class to the database."""
         sym_labels = set([label])
         empty = self.classdb.is_empty(comb_class, label)
         for strategy_generator in self.symmetries:
-            for start_label, end_labels, rule in self._expand_class_with_strategy(
+            for (
+                start_label,
+                end_labels,
+                rule,
+                hint,
+            ) in self._expand_class_with_strategy(
                 comb_class, strategy_generator, label=label
             ):
                 sym_label = end_labels[0]
                 self.classdb.set_empty(sym_label, empty)
-                self.ruledb.add(start_label, (sym_label,), rule)
+                self.ruledb.add(start_label, (sym_label,), rule, hint)
                 self.classqueue.set_stop_yielding(sym_label)
                 sym_labels.add(sym_label)
         self.symmetry_expanded.update(sym_labels)
+        for sym_label in sym_labels:
+            self._record(SYMMETRY_EXPANDED, sym_label)
 
     def _inferral_expand(
         self,
@@ -329,15 +633,21 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         if label in self.inferral_expanded:
             return
         self.inferral_expanded.add(label)
+        self._record(INFERRAL_EXPANDED, label)
         for i, strategy_generator in enumerate(inferral_strategies):
             if strategy_generator == skip:
                 continue
-            for start_label, end_labels, rule in self._expand_class_with_strategy(
+            for (
+                start_label,
+                end_labels,
+                rule,
+                hint,
+            ) in self._expand_class_with_strategy(
                 comb_class, strategy_generator, label=label
             ):
                 inf_class = rule.children[0]
                 inf_label = end_labels[0]
-                self.add_rule(start_label, end_labels, rule)
+                self.add_rule(start_label, end_labels, rule, hint)
                 self.classqueue.set_not_inferrable(start_label)
                 inferral_strategies = (
                     inferral_strategies[i + 1 :] + inferral_strategies[0 : i + 1]
@@ -358,6 +668,8 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         for label, strategies, inferral in self.classqueue.do_level():
             comb_class = self.classdb.get_class(label)
             self._expand(comb_class, label, strategies, inferral)
+            self._commit()
+        self._commit()
 
     @cssmethodtimer("status")
     def status(self, elaborate: bool) -> str:
@@ -378,6 +690,10 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         status += self.classdb.status() + "\n"
         status += self.classqueue.status() + "\n"
         status += self.ruledb.status(elaborate) + "\n"
+        if self.workers > 1 or self.threads > 1:
+            status += self.worker_stats.status() + "\n"
+        if self.expansion_cache is not None:
+            status += self.expansion_cache.status() + "\n"
         status += self._mem_status(elaborate)
         return status
 
@@ -540,6 +856,24 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
                 "Percentage not between 0 and 100, so assuming 1% search percentage."
             )
             perc = 1
+        if max(self.workers, self.threads) > 1 and self._pool is None:
+            pool_class = ThreadExpansionPool if self.threads > 1 else ExpansionPool
+            with pool_class(
+                self.strategy_pack,
+                self.classdb.combinatorial_class,
+                max(self.workers, self.threads),
+                self.worker_stats,
+                self._label_rule,
+            ) as self._pool:
+                try:
+                    return self._auto_search_rules(
+                        max_expansion_time=max_expansion_time,
+                        perc=perc,
+                        smallest=smallest,
+                        status_update=status_update,
+                    )
+                finally:
+                    self._pool = None
         auto_search_start = time.time()
         expansion_time: float = 0
         status_start = time.time()
@@ -601,6 +935,7 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
                     strategies,
                     inferral,
                 )
+            self._commit()
             if time.time() - expansion_start > expansion_time:
                 break
             if status_update is not None and time.time() - status_start > status_update:
@@ -609,6 +944,7 @@ class CombinatorialSpecificationSearcher(Generic[CombinatorialClassType]):
         else:
             expanding = False
             logger.info("No more classes to expand.")
+            self._commit()
         return expanding, status_start
 
     @cssmethodtimer("has specification")
@@ -0,0 +1,591 @@
+"""
+Searching a single universe with several processes, possibly on different
+machines.
+
+A coordinator process owns the universe: it is the only one to allocate labels,
+store emptiness, add rules and maintain the queue. Any number of workers connect
+to it and each runs a CombinatorialSpecificationSearcher using the RemoteClassDB,
+RemoteRuleDB and RemoteQueue below. These forward every call to the coordinator.
+Calls that do not need an answer are buffered and sent with the next call that
+does, so a single round trip carries a batch of operations.
+
+    >>> manager = start_coordinator(start_class, pack)  # doctest: +SKIP
+    >>> searcher = remote_searcher(
+    ...     start_class, pack, manager.address, manager.authkey
+    ... )  # doctest: +SKIP
+    >>> searcher.auto_search()  # doctest: +SKIP
+"""
+
+import threading
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing.managers import BaseManager
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
+
+from comb_spec_searcher.class_db import ClassDB
+from comb_spec_searcher.class_queue import CSSQueue
+from comb_spec_searcher.comb_spec_searcher import CombinatorialSpecificationSearcher
+from comb_spec_searcher.exception import NoMoreClassesToExpandError
+from comb_spec_searcher.rule_db.abstract import RuleDBAbstract
+from comb_spec_searcher.rule_db.base import RuleDB
+from comb_spec_searcher.strategies.rule import AbstractRule, VerificationRule
+from comb_spec_searcher.strategies.strategy import AbstractStrategy
+from comb_spec_searcher.strategies.strategy_pack import StrategyPack
+from comb_spec_searcher.typing import ClassKey, CombinatorialClassType, Key, WorkPacket
+
+__all__ = [
+    "Coordinator",
+    "CoordinatorClient",
+    "RemoteClassDB",
+    "RemoteQueue",
+    "RemoteRuleDB",
+    "remote_searcher",
+    "start_coordinator",
+]
+
+Operation = Tuple[str, Tuple[Any, ...]]
+StrategyRef = Union[int, AbstractStrategy]
+
+# The state of the queue given with each batch of WorkPackets.
+PACKETS, WAIT, DONE = range(3)
+
+
+class Coordinator:
+    """
+    The universe shared by the workers.
+
+    Only `register` and `execute` are exposed to the workers. The operations are
+    applied in the order they are received, one batch at a time.
+    """
+
+    def __init__(self, start_class: Any, pack: StrategyPack):
+        self.ruledb = RuleDB()
+        self.searcher = CombinatorialSpecificationSearcher(
+            start_class, pack, ruledb=self.ruledb
+        )
+        self._strategies = tuple(self.searcher.strategy_pack)
+        self._lock = threading.Lock()
+        # The number of WorkPackets each worker took and has not come back for.
+        self._leased: Dict[int, int] = {}
+
+    def register(self) -> int:
+        """Return a new worker id."""
+        with self._lock:
+            worker = len(self._leased)
+            self._leased[worker] = 0
+            return worker
+
+    def execute(self, worker: int, operations: List[Operation]) -> List[Any]:
+        """Apply the operations and return their results."""
+        with self._lock:
+            return [
+                getattr(self, f"_{name}")(worker, *args) for name, args in operations
+            ]
+
+    def _get_labels(
+        self, _: int, classes: List[Tuple[ClassKey, ClassKey]]
+    ) -> List[Tuple[int, Optional[bool], bool]]:
+        """
+        Return the label, emptiness and whether verified of each compressed
+        class, given with its lookup key.
+        """
+        classdb = self.searcher.classdb
+        res = []
+        for key, compressed in classes:
+            label = classdb.add(compressed, compressed=True, key=key)
+            res.append(
+                (
+                    label,
+                    classdb.label_to_info[label].empty,
+                    self.searcher.ruledb.is_verified(label),
+                )
+            )
+        return res
+
+    def _get_class(self, _: int, label: int) -> ClassKey:
+        return self.searcher.classdb.label_to_info[label].comb_class
+
+    def _set_empty(self, _: int, label: int, empty: bool) -> None:
+        self.searcher.classdb.set_empty(label, empty)
+
+    def _insert(
+        self,
+        _: int,
+        start: int,
+        ends: Tuple[int, ...],
+        strategy: StrategyRef,
+        verification: bool,
+        two_way: bool,
+    ) -> None:
+        if isinstance(strategy, int):
+            strategy = cast(AbstractStrategy, self._strategies[strategy])
+        self.ruledb.insert(start, ends, strategy, verification, two_way)
+
+    def _is_verified(self, _: int, label: int) -> bool:
+        return self.searcher.ruledb.is_verified(label)
+
+    def _has_specification(self, _: int) -> bool:
+        return self.searcher.ruledb.has_specification()
+
+    def _get_specification_rules(
+        self, _: int, kwargs: Dict[str, Any]
+    ) -> List[AbstractRule]:
+        return list(self.searcher.ruledb.get_specification_rules(**kwargs))
+
+    def _queue_add(self, _: int, label: int) -> None:
+        self.searcher.classqueue.add(label)
+
+    def _set_not_inferrable(self, _: int, label: int) -> None:
+        self.searcher.classqueue.set_not_inferrable(label)
+
+    def _set_verified(self, _: int, label: int) -> None:
+        self.searcher.classqueue.set_verified(label)
+
+    def _set_stop_yielding(self, _: int, label: int) -> None:
+        self.searcher.classqueue.set_stop_yielding(label)
+
+    def _next_packets(
+        self, worker: int, size: int, level: Optional[int]
+    ) -> Tuple[int, int, List[Tuple[WorkPacket, bool, Optional[bool]]]]:
+        """
+        Return the state of the queue, its level and up to `size` WorkPackets,
+        each with whether its label is verified and its emptiness if known.
+        Asking for WorkPackets means the worker is done with the previous ones.
+
+        If level is given, stop once the queue has moved past that level.
+        """
+        self._leased[worker] = 0
+        queue = self.searcher.classqueue
+        ruledb = self.searcher.ruledb
+        if level is None:
+            level = getattr(queue, "levels_completed", 0)
+        packets: List[Tuple[WorkPacket, bool, Optional[bool]]] = []
+        while len(packets) < size:
+            if getattr(queue, "levels_completed", 0) != level:
+                break
+            try:
+                packet = next(queue)
+            except StopIteration:
+                if packets:
+                    break
+                # The other workers may still add classes to the queue, unless
+                # the search is over.
+                if any(self._leased.values()) and not ruledb.has_specification():
+                    return WAIT, level, packets
+                return DONE, level, packets
+            packets.append(
+                (
+                    packet,
+                    ruledb.is_verified(packet.label),
+                    self.searcher.classdb.label_to_info[packet.label].empty,
+                )
+            )
+        self._leased[worker] = len(packets)
+        return PACKETS, level, packets
+
+    def _status(self, _: int, name: str, *args: Any) -> str:
+        if name == "ruledb":
+            return self.searcher.ruledb.status(*args)
+        if name == "classdb":
+            return self.searcher.classdb.status()
+        return self.searcher.classqueue.status()
+
+
+class CoordinatorManager(BaseManager):
+    """A manager giving access to the coordinator."""
+
+
+_COORDINATOR: Optional[Coordinator] = None
+
+
+def _init_coordinator(start_class: Any, pack: StrategyPack) -> None:
+    global _COORDINATOR  # pylint: disable=global-statement
+    _COORDINATOR = Coordinator(start_class, pack)
+
+
+def _get_coordinator() -> Coordinator:
+    assert _COORDINATOR is not None, "The coordinator is not initialised"
+    return _COORDINATOR
+
+
+CoordinatorManager.register("coordinator", callable=_get_coordinator)
+
+
+def start_coordinator(
+    start_class: Any,
+    pack: StrategyPack,
+    address: Tuple[str, int] = ("127.0.0.1", 0),
+    authkey: Optional[bytes] = None,
+) -> CoordinatorManager:
+    """
+    Start the coordinator in a new process listening on the given address and
+    return the manager. Use port 0 to pick a free port, the actual address is
+    given by `manager.address`. Call `manager.shutdown()` when the search is over.
+    """
+    manager = CoordinatorManager(address=address, authkey=authkey)
+    manager.start(  # pylint: disable=consider-using-with
+        _init_coordinator, (start_class, pack)
+    )
+    return manager
+
+
+class CoordinatorClient:
+    """
+    The connection of a worker to the coordinator.
+
+    Operations without results are buffered until the next call that needs an
+    answer, or until there are `batch_size` of them.
+    """
+
+    def __init__(
+        self, address: Any, authkey: Optional[bytes] = None, batch_size: int = 1000
+    ):
+        manager = CoordinatorManager(address=address, authkey=authkey)
+        manager.connect()
+        self._coordinator = manager.coordinator()  # type: ignore
+        self.worker = self._coordinator.register()
+        self.batch_size = batch_size
+        self.round_trips = 0
+        self._operations: List[Operation] = []
+        # A label once verified stays verified, but a label that is not may be
+        # verified by the operations of any worker so this is only trusted until
+        # the next round trip.
+        self.verified: Set[int] = set()
+        self.unverified: Set[int] = set()
+        # The emptiness of a label never changes once known. It is given with
+        # the labels and WorkPackets, or computed by the worker.
+        self.emptiness: Dict[int, bool] = {}
+
+    def send(self, name: str, *args: Any) -> None:
+        """Queue an operation whose result is not needed."""
+        self._operations.append((name, args))
+        if len(self._operations) >= self.batch_size:
+            self.flush()
+
+    def call(self, name: str, *args: Any) -> Any:
+        """Send the operation, with any that are queued, and return its result."""
+        self._operations.append((name, args))
+        return self._execute()[-1]
+
+    def flush(self) -> None:
+        """Send all queued operations."""
+        if self._operations:
+            self._execute()
+
+    def set_verified(self, label: int, verified: bool) -> None:
+        """Record whether the coordinator has the label verified."""
+        if verified:
+            self.verified.add(label)
+        else:
+            self.unverified.add(label)
+
+    def _execute(self) -> List[Any]:
+        operations, self._operations = self._operations, []
+        self.round_trips += 1
+        self.unverified.clear()
+        return cast(List[Any], self._coordinator.execute(self.worker, operations))
+
+
+class RemoteClassDB(ClassDB[CombinatorialClassType]):
+    """
+    A ClassDB whose labels are given by the coordinator.
+
+    Labels, classes and emptiness never change once known, so they are cached.
+    """
+
+    def __init__(
+        self,
+        combinatorial_class: Type[CombinatorialClassType],
+        client: CoordinatorClient,
+    ):
+        super().__init__(combinatorial_class)
+        self.client = client
+        self._labels: Dict[ClassKey, int] = {}
+        self._classes: Dict[int, ClassKey] = {}
+
+    def __iter__(self) -> Iterator[int]:
+        raise NotImplementedError("The labels are only known by the coordinator.")
+
+    def __contains__(self, key: Key) -> bool:
+        if isinstance(key, int):
+            return key in self._classes
+        return self._lookup_key(key)[0] in self._labels
+
+    def add(
+        self,
+        comb_class: ClassKey,
+        compressed: bool = False,
+        key: Optional[ClassKey] = None,
+    ) -> int:
+        if compressed:
+            if key is None:
+                key = self._compressed_lookup_key(comb_class)
+        else:
+            assert isinstance(comb_class, self.combinatorial_class)
+            key, raw = self._lookup_key(comb_class)
+            if key not in self._labels and raw is not None:
+                comb_class = self._compress_bytes(raw)
+        self._fetch_labels({key: comb_class})
+        return self._labels[key]
+
+    def _fetch_labels(self, missing: Dict[ClassKey, ClassKey]) -> None:
+        """
+        Ask the coordinator for the labels of the compressed classes, given with
+        their lookup key, that are not known yet. The lookup keys are sent too,
+        so the coordinator does not decompress the classes to find them.
+        """
+        missing = {
+            key: compressed
+            for key, compressed in missing.items()
+            if key not in self._labels
+        }
+        if missing:
+            for (key, compressed), (label, empty, verified) in zip(
+                missing.items(), self.client.call("get_labels", list(missing.items()))
+            ):
+                self._labels[key] = label
+                self._classes[label] = compressed
+                if empty is not None:
+                    self.client.emptiness[label] = empty
+                self.client.set_verified(label, verified)
+
+    def get_labels(self, keys: Iterable[Key]) -> List[int]:
+        """
+        Return the labels of the keys, asking the coordinator for all the unknown
+        ones at once.
+        """
+        keys = list(keys)
+        lookup_keys: List[ClassKey] = []
+        missing: Dict[ClassKey, ClassKey] = {}
+        for key in keys:
+            if isinstance(key, int):
+                continue
+            lookup_key, raw = self._lookup_key(key)
+            lookup_keys.append(lookup_key)
+            if lookup_key not in self._labels and lookup_key not in missing:
+                missing[lookup_key] = key if raw is None else self._compress_bytes(raw)
+        self._fetch_labels(missing)
+        labels = (self._labels[lookup_key] for lookup_key in lookup_keys)
+        return [key if isinstance(key, int) else next(labels) for key in keys]
+
+    def get_label(self, key: Key) -> int:
+        return self.get_labels((key,))[0]
+
+    def get_class(self, key: Key) -> CombinatorialClassType:
+        if not isinstance(key, int):
+            assert isinstance(key, self.combinatorial_class)
+            return key
+        if key not in self._classes:
+            self._classes[key] = self.client.call("get_class", key)
+        return self._cached_class(key, self._classes[key])
+
+    def is_empty(
+        self, comb_class: CombinatorialClassType, label: Optional[int] = None
+    ) -> bool:
+        if label is None:
+            label = self.get_label(comb_class)
+        emptiness = self.client.emptiness
+        if label not in emptiness:
+            # Unknown to the coordinator when the label was given, so computed
+            # here rather than asking again.
+            emptiness[label] = self._is_empty(comb_class)
+            self.client.send("set_empty", label, emptiness[label])
+        return emptiness[label]
+
+    def set_empty(self, key: Key, empty: bool = True) -> None:
+        label = self.get_label(key)
+        if self.client.emptiness.get(label) != empty:
+            self.client.emptiness[label] = empty
+            self.client.send("set_empty", label, empty)
+
+    def status(self) -> str:
+        status = cast(str, self.client.call("status", "classdb"))
+        status += f"\n\tRound trips to the coordinator: {self.client.round_trips:,d}"
+        return status
+
+
+class RemoteRuleDB(RuleDBAbstract):
+    """
+    A rule database kept by the coordinator.
+
+    The rules are sent without their classes, as the labels of the children
+    that are not empty and the strategy, referred to by its position in the
+    pack if it is in it.
+    """
+
+    def __init__(self, client: CoordinatorClient):
+        super().__init__()
+        self.client = client
+        self._strategy_refs: Optional[Dict[int, int]] = None
+
+    def _strategy_ref(self, strategy: AbstractStrategy) -> StrategyRef:
+        if self._strategy_refs is None:
+            self._strategy_refs = {
+                id(strat): idx for idx, strat in enumerate(self.strategy_pack)
+            }
+        return self._strategy_refs.get(id(strategy), strategy)
+
+    def is_verified(self, label: int) -> bool:
+        """
+        Return True if label has been verified, asking the coordinator unless
+        known since the last round trip.
+        """
+        if label not in self.client.verified and label not in self.client.unverified:
+            self.client.set_verified(label, self.client.call("is_verified", label))
+        return label in self.client.verified
+
+    def add(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule, hint: int = -1
+    ) -> None:
+        # The emptiness is computed here rather than by the coordinator.
+        ends = self._clean_labels(ends, rule)
+        verification = isinstance(rule, VerificationRule)
+        if verification:
+            self.client.set_verified(start, True)
+        self.client.send(
+            "insert",
+            start,
+            ends,
+            self._strategy_ref(rule.strategy),
+            verification,
+            len(ends) == 1 and rule.is_two_way(),
+        )
+
+    def status(self, elaborate: bool) -> str:
+        return cast(str, self.client.call("status", "ruledb", elaborate))
+
+    def has_specification(self) -> bool:
+        return cast(bool, self.client.call("has_specification"))
+
+    def get_specification_rules(self, **kwargs) -> Iterator[AbstractRule]:
+        return iter(self.client.call("get_specification_rules", kwargs))
+
+
+class RemoteQueue(CSSQueue):
+    """
+    A queue kept by the coordinator. WorkPackets are taken in batches of
+    `batch_size`.
+    """
+
+    def __init__(
+        self,
+        pack: StrategyPack,
+        client: CoordinatorClient,
+        batch_size: int = 16,
+        poll_interval: float = 0.05,
+    ):
+        super().__init__(pack)
+        self.client = client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._packets: Deque[WorkPacket] = deque()
+        # The WorkPackets taken are only filtered by the coordinator when taken, so
+        # those set to stop yielding since are skipped here.
+        self._stop_yielding: Set[int] = set()
+
+    def add(self, label: int) -> None:
+        self.client.send("queue_add", label)
+
+    def set_not_inferrable(self, label: int) -> None:
+        self.client.send("set_not_inferrable", label)
+
+    def set_verified(self, label: int) -> None:
+        self.client.send("set_verified", label)
+
+    def set_stop_yielding(self, label: int) -> None:
+        self._stop_yielding.add(label)
+        self.client.send("set_stop_yielding", label)
+
+    def _next_packet(self) -> Optional[WorkPacket]:
+        """Return the next WorkPacket taken that should still be yielded."""
+        while self._packets:
+            packet = self._packets.popleft()
+            if packet.label not in self._stop_yielding:
+                return packet
+        return None
+
+    def _fetch(self, level: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Take new WorkPackets from the coordinator, waiting while the other
+        workers may still add classes, and return the state and level of the
+        queue.
+        """
+        while True:
+            state, current_level, packets = self.client.call(
+                "next_packets", self.batch_size, level
+            )
+            if state != WAIT:
+                break
+            time.sleep(self.poll_interval)
+        for packet, verified, empty in packets:
+            self.client.set_verified(packet.label, verified)
+            if empty is not None:
+                self.client.emptiness[packet.label] = empty
+            self._packets.append(packet)
+        return state, current_level
+
+    def peek(self, size: int) -> Iterator[WorkPacket]:
+        return islice(self._packets, size)
+
+    def __next__(self) -> WorkPacket:
+        while True:
+            packet = self._next_packet()
+            if packet is not None:
+                return packet
+            if self._fetch()[0] == DONE:
+                raise StopIteration
+
+    def do_level(self) -> Iterator[WorkPacket]:
+        """
+        Yield the WorkPackets of the current level of the coordinator queue.
+        """
+        level = None
+        while True:
+            packet = self._next_packet()
+            while packet is not None:
+                yield packet
+                packet = self._next_packet()
+            state, level = self._fetch(level)
+            if state == DONE:
+                raise NoMoreClassesToExpandError
+            if not self._packets:
+                return
+
+    def status(self) -> str:
+        return cast(str, self.client.call("status", "queue"))
+
+
+def remote_searcher(
+    start_class: CombinatorialClassType,
+    pack: StrategyPack,
+    address: Any,
+    authkey: Optional[bytes] = None,
+    **kwargs,
+) -> CombinatorialSpecificationSearcher:
+    """
+    Return a searcher working on the universe of the coordinator at the given
+    address. The kwargs are passed to the searcher.
+    """
+    client = CoordinatorClient(address, authkey)
+    return CombinatorialSpecificationSearcher(
+        start_class,
+        pack,
+        classdb=RemoteClassDB(type(start_class), client),
+        ruledb=RemoteRuleDB(client),
+        classqueue=RemoteQueue(pack, client),
+        **kwargs,
+    )
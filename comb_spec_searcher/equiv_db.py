@@ -11,7 +11,7 @@ integer, that the classdb gives.
 """
 
 from collections import defaultdict, deque
-from typing import Deque, Dict, Iterator, List, Set, Tuple
+from typing import Callable, Deque, Dict, Iterator, List, Set, Tuple
 
 from .utils import cssmethodtimer
 
@@ -36,7 +36,17 @@ class EquivalenceDB:
         self.weights: Dict[int, int] = {}
         self.verified_roots: Set[int] = set()
         self.vertices: Dict[int, Set[int]] = defaultdict(set)
-        self._one_way_vertices: Dict[int, Set[int]] = defaultdict(set)
+        # The graph of strong components, i.e. equivalence roots, given by the
+        # edges added. The position of each root is a topological order of it, which
+        # is maintained as edges are added as described in "A dynamic topological
+        # sort algorithm for directed acyclic graphs" by Pearce and Kelly.
+        self._successors: Dict[int, Set[int]] = defaultdict(set)
+        self._predecessors: Dict[int, Set[int]] = defaultdict(set)
+        self._position: Dict[int, int] = {}
+        self._next_position = 0
+        # The pairs (old_root, new_root) for every union performed, in order.
+        # Consumers are responsible for clearing it once read.
+        self.merges: List[Tuple[int, int]] = []
         self.func_times: Dict[str, float] = defaultdict(float)
         self.func_calls: Dict[str, int] = defaultdict(int)
 
@@ -76,57 +86,110 @@ class EquivalenceDB:
         Return the adjacency table where vertices are strong components,
         and edges are those that connect some vertex in a strong component
         to the other.
-
-        Note: this might not be accurate, you should use the connect_cycle
-        method first if needed.
         """
-        res: Dict[int, Set[int]] = defaultdict(set)
-        for start, ends in self._one_way_vertices.items():
-            start = self[start]
-            for end in ends:
-                end = self[end]
-                if start != end:
-                    res[start].add(end)
-        self._one_way_vertices = res
-        return res
+        return {start: set(ends) for start, ends in self._successors.items() if ends}
 
     def add_one_way_edge(self, label: int, other_label: int) -> None:
         """Add an edge from label to other label in the directed graph."""
         self._add_edge(label, other_label)
-        self._one_way_vertices[self[label]].add(self[other_label])
+        self._add_component_edge(label, other_label)
 
-    @cssmethodtimer("find_paths")
     def connect_cycles(self) -> None:
-        """Look for cycles using one way edges that have been added."""
-        one_way_vertices = self.get_one_way_vertices()
-        stack: List[Tuple[int, ...]] = []
-        stack.extend([(label,) for label in one_way_vertices.keys()])
-        visited = set()
-        while stack:
-            path = stack.pop()
-            end = path[-1]
-            if end in visited:
-                continue
-            visited.add(end)
-            for new_end in one_way_vertices[end]:
-                for i, vertex in enumerate(path[:-1]):
-                    if self.equivalent(vertex, new_end):
-                        # we've detected a cycle!
-                        for eqv_vertix in path[i:]:
-                            self._set_equivalent(eqv_vertix, new_end)
-                        break
-                if new_end not in path:
-                    # new end is not in the path, so we haven't tried looking for
-                    # cycles from here.
-                    stack.append(
-                        path + (new_end,)
-                    )  # appending left makes this a depth first search
+        """
+        Look for cycles using one way edges that have been added.
+
+        The cycles are connected as soon as the edges closing them are added so
+        there is nothing left to do.
+        """
 
     def add_two_way_edge(self, label: int, other_label: int) -> None:
         """Add a two way edge to the directed graph."""
         self._add_edge(label, other_label)
         self._add_edge(other_label, label)
-        self._set_equivalent(label, other_label)
+        self._add_component_edge(label, other_label)
+        self._add_component_edge(other_label, label)
+
+    @cssmethodtimer("find_paths")
+    def _add_component_edge(self, label: int, other_label: int) -> None:
+        """
+        Add an edge between the strong components of label and other_label, and
+        set as equivalent the components on any cycle it closes.
+        """
+        start, end = self[label], self[other_label]
+        if start == end or end in self._successors[start]:
+            return
+        for root in (start, end):
+            if root not in self._position:
+                self._position[root] = self._next_position
+                self._next_position += 1
+        self._successors[start].add(end)
+        self._predecessors[end].add(start)
+        lower, upper = self._position[end], self._position[start]
+        if upper < lower:
+            return
+        # The order is broken, so we look at the components in between that can be
+        # reached from end and those that reach start.
+        forward = self._reachable(end, self._successors, lambda pos: pos <= upper)
+        backward = self._reachable(start, self._predecessors, lambda pos: pos >= lower)
+        cycle = forward.intersection(backward)
+        backward_order = sorted(backward - cycle, key=self._position.__getitem__)
+        forward_order = sorted(forward - cycle, key=self._position.__getitem__)
+        positions = sorted(map(self._position.__getitem__, forward | backward))
+        if cycle:
+            # The components on the cycle are merged and take a single position.
+            root = self._merge_components(cycle)
+            new_order = backward_order + [root] + forward_order
+            positions = (
+                positions[: len(backward_order) + 1]
+                + positions[len(positions) - len(forward_order) :]
+            )
+        else:
+            new_order = backward_order + forward_order
+        for root, position in zip(new_order, positions):
+            self._position[root] = position
+
+    def _reachable(
+        self, root: int, edges: Dict[int, Set[int]], in_bounds: Callable[[int], bool]
+    ) -> Set[int]:
+        """
+        Return the components reachable from root using the given edges, only
+        going through those whose position is in bounds.
+        """
+        reached = {root}
+        stack = [root]
+        while stack:
+            for other in edges[stack.pop()]:
+                if other not in reached and in_bounds(self._position[other]):
+                    reached.add(other)
+                    stack.append(other)
+        return reached
+
+    def _merge_components(self, roots: Set[int]) -> int:
+        """
+        Set the strong components as equivalent, merging their edges, and return
+        the root of the new component. The new root is left without a position.
+        """
+        first = next(iter(roots))
+        for other in roots:
+            self._set_equivalent(first, other)
+        new_root = self[first]
+        successors: Set[int] = set()
+        predecessors: Set[int] = set()
+        for root in roots:
+            successors.update(self._successors.pop(root, ()))
+            predecessors.update(self._predecessors.pop(root, ()))
+            self._position.pop(root)
+        successors -= roots
+        predecessors -= roots
+        for other in successors:
+            self._predecessors[other] -= roots
+            self._predecessors[other].add(new_root)
+        for other in predecessors:
+            self._successors[other] -= roots
+            self._successors[other].add(new_root)
+        self._successors[new_root] = successors
+        self._predecessors[new_root] = predecessors
+        return new_root
 
     def _add_edge(self, label: int, other_label: int) -> None:
         """Add an edge from label to other_label."""
@@ -158,6 +221,7 @@ class EquivalenceDB:
             if r != heaviest:
                 self.weights[heaviest] += self.weights[r]
                 self.parents[r] = heaviest
+                self.merges.append((r, heaviest))
         if verified:
             self.set_verified(label)
 
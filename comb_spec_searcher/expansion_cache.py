@@ -0,0 +1,259 @@
+"""
+A cache of the children found by applying strategies to combinatorial classes,
+kept in a sqlite file so that it is shared by the runs using the same file.
+
+An entry is keyed by the JSON of the strategy and the bytes of the class, so
+only strategies with a `to_jsonable` method applied to classes with a
+`to_bytes` method are cached. The strategies are assumed to give the same
+children whenever they are applied to the same class.
+"""
+
+import json
+import pickle
+import sqlite3
+from typing import Any, Optional, Tuple
+
+from comb_spec_searcher.exception import StrategyDoesNotApply
+from comb_spec_searcher.strategies.rule import AbstractRule
+from comb_spec_searcher.strategies.strategy import AbstractStrategy
+from comb_spec_searcher.typing import CombinatorialClassType
+
+__all__ = ["ExpansionCache"]
+
+# The number of entries evicted at once
+EVICT_BATCH = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expansions (
+    strategy TEXT NOT NULL,
+    class BLOB NOT NULL,
+    children BLOB,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (strategy, class)
+);
+CREATE INDEX IF NOT EXISTS expansions_used ON expansions (used);
+"""
+
+
+class ExpansionCache:
+    """
+    A cache in the sqlite file at path of the children given by a strategy
+    applied to a class, or of the strategy not applying.
+
+    The entries least recently used are evicted once the cache holds more than
+    `max_bytes` bytes of keys and children, until it holds `evict_to` of that.
+    The changes are written to the file when `commit` is called.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = 1 << 30, evict_to: float = 0.9
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._size = 0
+        self._clock = 0
+        self._dirty = False
+
+    def __getstate__(self) -> dict:
+        """The connection is opened again when the cache is next used."""
+        self.commit()
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ExpansionCache):
+            return NotImplemented
+        return (self.path, self.max_bytes, self.evict_to) == (
+            other.path,
+            other.max_bytes,
+            other.evict_to,
+        )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection to the file, opened on first use."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=OFF")
+            self._connection.executescript(SCHEMA)
+            size, clock = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) "
+                "FROM expansions"
+            ).fetchone()
+            self._size, self._clock = size, clock
+        return self._connection
+
+    def commit(self) -> None:
+        """Write the changes to the file."""
+        if self._connection is not None and self._dirty:
+            self._connection.commit()
+            self._dirty = False
+
+    def close(self) -> None:
+        """Write the changes and close the file."""
+        self.commit()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def apply(
+        self,
+        strategy: AbstractStrategy,
+        comb_class: CombinatorialClassType,
+    ) -> AbstractRule:
+        """
+        Return the rule given by the strategy applied to the class, with the
+        children found in the cache if they are there. Raise
+        StrategyDoesNotApply if the strategy does not apply.
+        """
+        key = self._key(strategy, comb_class)
+        if key is None:
+            self.bypassed += 1
+            return strategy(comb_class)
+        row = self.connection.execute(
+            "SELECT children FROM expansions WHERE strategy = ? AND class = ?", key
+        ).fetchone()
+        self._clock += 1
+        if row is not None:
+            self.hits += 1
+            self._execute(
+                "UPDATE expansions SET used = ? WHERE strategy = ? AND class = ?",
+                (self._clock,) + key,
+            )
+            if row[0] is None:
+                raise StrategyDoesNotApply(f"{strategy} does not apply")
+            return strategy(comb_class, children=self._children(row[0]))
+        self.misses += 1
+        try:
+            rule = strategy(comb_class)
+            children = rule.children
+        except StrategyDoesNotApply:
+            self._store(key, None)
+            raise
+        blob = self._blob(children)
+        if blob is not None:
+            self._store(key, blob)
+        return rule
+
+    def contains(
+        self, strategy: AbstractStrategy, comb_class: CombinatorialClassType
+    ) -> bool:
+        """Return True if the children given by the strategy are in the cache."""
+        key = self._key(strategy, comb_class)
+        return (
+            key is not None
+            and self.connection.execute(
+                "SELECT 1 FROM expansions WHERE strategy = ? AND class = ?", key
+            ).fetchone()
+            is not None
+        )
+
+    def store(
+        self,
+        strategy: AbstractStrategy,
+        comb_class: CombinatorialClassType,
+        children: Optional[Tuple[CombinatorialClassType, ...]],
+    ) -> None:
+        """
+        Add the children given by the strategy applied to the class, found
+        without the cache, or None if the strategy does not apply.
+        """
+        key = self._key(strategy, comb_class)
+        if key is None:
+            self.bypassed += 1
+            return
+        self.misses += 1
+        self._clock += 1
+        if children is None:
+            self._store(key, None)
+            return
+        blob = self._blob(children)
+        if blob is not None:
+            self._store(key, blob)
+
+    @staticmethod
+    def _key(
+        strategy: AbstractStrategy, comb_class: CombinatorialClassType
+    ) -> Optional[Tuple[str, bytes]]:
+        """Return the key of the entry, or None if it can not be cached."""
+        try:
+            return (
+                json.dumps(strategy.to_jsonable(), sort_keys=True),
+                comb_class.to_bytes(),
+            )
+        except (NotImplementedError, TypeError):
+            return None
+
+    @staticmethod
+    def _blob(children: Tuple[CombinatorialClassType, ...]) -> Optional[bytes]:
+        """Return the bytes of the children, or None if they have no bytes."""
+        try:
+            return pickle.dumps(
+                tuple((type(child), child.to_bytes()) for child in children),
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except NotImplementedError:
+            return None
+
+    @staticmethod
+    def _children(blob: bytes) -> Tuple[Any, ...]:
+        return tuple(cls.from_bytes(raw) for cls, raw in pickle.loads(blob))
+
+    def _execute(self, sql: str, parameters: Tuple[Any, ...]) -> None:
+        self.connection.execute(sql, parameters)
+        self._dirty = True
+
+    def _store(self, key: Tuple[str, bytes], children: Optional[bytes]) -> None:
+        """
+        Add the entry, with no children if the strategy does not apply, and
+        evict the least recently used ones if needed.
+        """
+        size = len(key[0]) + len(key[1]) + len(children or b"")
+        self._execute(
+            "INSERT OR REPLACE INTO expansions VALUES (?, ?, ?, ?, ?)",
+            key + (children, size, self._clock),
+        )
+        self._size += size
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        Evict the entries least recently used, a batch at a time, until the
+        cache holds at most `evict_to` of `max_bytes`.
+        """
+        target = self.max_bytes * self.evict_to
+        while self._size > target:
+            evicted = self.connection.execute(
+                "SELECT strategy, class, size FROM expansions ORDER BY used LIMIT ?",
+                (EVICT_BATCH,),
+            ).fetchall()
+            if not evicted:
+                break
+            self.connection.executemany(
+                "DELETE FROM expansions WHERE strategy = ? AND class = ?",
+                [(strategy, comb_class) for strategy, comb_class, _ in evicted],
+            )
+            self._size -= sum(size for _, _, size in evicted)
+            self.evictions += len(evicted)
+        self._dirty = True
+
+    def status(self) -> str:
+        """Return a string with the hit rate of the cache."""
+        looked_up = self.hits + self.misses
+        rate = f"{100 * self.hits / looked_up:.1f}%" if looked_up else "-"
+        return (
+            f"Expansion cache at {self.path}: {self.hits:,d} hits, "
+            f"{self.misses:,d} misses ({rate} hit rate), {self.bypassed:,d} "
+            f"not cacheable and {self.evictions:,d} evictions, "
+            f"{self._size:,d} bytes stored"
+        )
@@ -0,0 +1,161 @@
+"""
+An append-only log of the changes made to the universe of a searcher.
+
+Every class added, emptiness set, rule added, queue transition and class
+tried for verification or symmetries is recorded, as well as the codec of the
+ClassDB whenever it changes. The records are written in
+transactions, one for each WorkPacket fully expanded, so that the universe can
+be rebuilt as it was after the last expansion written, without applying any
+strategy again. A transaction cut by a crash is discarded.
+
+The journal starts with the start class and the strategy pack. Strategies of
+the pack are referred to by their position in the pack and any other strategy
+is pickled with its rule.
+"""
+
+import os
+import pickle
+import threading
+from typing import Any, BinaryIO, Iterator, List, Optional, Tuple, Union, cast
+
+from comb_spec_searcher.strategies.strategy import AbstractStrategy
+from comb_spec_searcher.strategies.strategy_pack import StrategyPack
+
+__all__ = ["Journal"]
+
+# The kind of each record, given as its first entry
+(
+    ADD_CLASS,
+    SET_EMPTY,
+    ADD_RULE,
+    QUEUE_ADD,
+    QUEUE_SET_NOT_INFERRABLE,
+    QUEUE_SET_STOP_YIELDING,
+    QUEUE_NEXT,
+    TRIED_TO_VERIFY,
+    SYMMETRY_EXPANDED,
+    INFERRAL_EXPANDED,
+    SET_CODEC,
+) = range(11)
+
+Record = Tuple[Any, ...]
+StrategyRef = Union[int, AbstractStrategy]
+
+
+class Journal:
+    """
+    A journal stored in the file at path.
+
+    If the file already contains a journal, the transactions written are given
+    by `transactions` and any new record is appended after them.
+
+    If `durable` is True, the file is synced to the disk after each
+    transaction so that a committed transaction survives an OS crash or a
+    power loss. Otherwise it is only flushed to the OS, which is faster but
+    only survives a crash of the process.
+
+    Records can be added by several threads while a transaction is written,
+    they are then part of the next transaction.
+    """
+
+    def __init__(
+        self, path: str, start_class: Any, pack: StrategyPack, durable: bool = True
+    ):
+        self.path = path
+        self.durable = durable
+        self.is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        # pylint: disable=consider-using-with
+        self._file: Optional[BinaryIO] = open(path, "w+b" if self.is_new else "r+b")
+        if self.is_new:
+            self._dump((start_class, pack))
+            self._sync()
+        else:
+            journal_class, _ = pickle.load(self._file)
+            if journal_class != start_class:
+                raise ValueError(f"The journal at {path} is for another start class.")
+        self._end = self._file.tell()
+        self._strategies = tuple(pack)
+        self._strategy_refs = {id(strat): idx for idx, strat in enumerate(pack)}
+        self._records: List[Record] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """
+        A journal is closed once pickled, so a searcher restored from a pickle
+        is no longer recorded.
+        """
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_records"] = []
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def read_header(path: str) -> Tuple[Any, StrategyPack]:
+        """Return the start class and the strategy pack of the journal at path."""
+        with open(path, "rb") as journal_file:
+            start_class, pack = pickle.load(journal_file)
+        return start_class, pack
+
+    def transactions(self) -> Iterator[List[Record]]:
+        """
+        Yield the transactions in the journal. The end of the file that does
+        not contain a full transaction is removed once they are all read.
+        """
+        assert self._file is not None, "The journal is closed"
+        self._file.seek(self._end)
+        while True:
+            try:
+                transaction = pickle.load(self._file)
+            except (EOFError, pickle.UnpicklingError):
+                break
+            self._end = self._file.tell()
+            yield transaction
+        self._file.seek(self._end)
+        self._file.truncate()
+
+    def record(self, *record: Any) -> None:
+        """Record a change in the current transaction."""
+        with self._lock:
+            if self._file is not None:
+                self._records.append(record)
+
+    def commit(self) -> None:
+        """Write the current transaction to the file."""
+        with self._lock:
+            records, self._records = self._records, []
+        if self._file is not None and records:
+            self._dump(records)
+            self._sync()
+
+    def close(self) -> None:
+        """Write the current transaction and close the file."""
+        if self._file is not None:
+            self.commit()
+            self._file.close()
+            self._file = None
+
+    def _sync(self) -> None:
+        """Flush the file, and sync it to the disk if the journal is durable."""
+        assert self._file is not None
+        self._file.flush()
+        if self.durable:
+            os.fsync(self._file.fileno())
+
+    def _dump(self, obj: Any) -> None:
+        assert self._file is not None
+        pickle.dump(obj, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def strategy_ref(self, strategy: AbstractStrategy) -> StrategyRef:
+        """Return how the strategy is recorded."""
+        return self._strategy_refs.get(id(strategy), strategy)
+
+    def get_strategy(self, ref: StrategyRef) -> AbstractStrategy:
+        """Return the strategy recorded."""
+        if isinstance(ref, int):
+            return cast(AbstractStrategy, self._strategies[ref])
+        return ref
@@ -0,0 +1,535 @@
+"""
+Containers of labels taking advantage of the labels given by a ClassDB being
+the dense integers 0, 1, 2, ...
+
+They are used by the queues for the bookkeeping of every label of the universe,
+where a set or a Counter would cost a hash table entry per label. The spilling
+containers keep the labels of a level of a queue on disk past a number of
+labels.
+"""
+
+import heapq
+import itertools
+import tempfile
+from array import array
+from collections import deque
+from collections.abc import MutableSet
+from typing import (
+    IO,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+__all__ = ["LabelSet", "LabelCounter", "SpillDeque", "SpillCounter"]
+
+
+class LabelSet(MutableSet):
+    """
+    A set of labels stored as a bitmap, the label i being in the set if the
+    bit i % 8 of the byte i // 8 is set. It takes one bit for each label up to
+    the largest one added.
+    """
+
+    def __init__(self, labels: Iterable[int] = ()):
+        self._bits = bytearray()
+        self._len = 0
+        for label in labels:
+            self.add(label)
+
+    def __contains__(self, label: int) -> bool:  # type: ignore[override]
+        byte = label >> 3
+        return 0 <= byte < len(self._bits) and bool(
+            self._bits[byte] & (1 << (label & 7))
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        for byte, bits in enumerate(self._bits):
+            if bits:
+                for bit in range(8):
+                    if bits & (1 << bit):
+                        yield (byte << 3) | bit
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LabelSet):
+            return self._len == other._len and self._bits.rstrip(
+                b"\0"
+            ) == other._bits.rstrip(b"\0")
+        return super().__eq__(other)
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"LabelSet({list(self)})"
+
+    def add(self, value: int) -> None:
+        byte = value >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte + 1 - len(self._bits)))
+        mask = 1 << (value & 7)
+        if not self._bits[byte] & mask:
+            self._bits[byte] |= mask
+            self._len += 1
+
+    def discard(self, value: int) -> None:
+        if value in self:
+            self._bits[value >> 3] &= ~(1 << (value & 7)) & 0xFF
+            self._len -= 1
+
+
+class LabelCounter:
+    """
+    A counter of labels stored as an array of counts indexed by label.
+
+    As for a Counter, the labels are given by `items` in the order they were
+    counted first, or since they were last popped.
+    """
+
+    def __init__(self, counts: Optional[Mapping[int, int]] = None):
+        self._counts = array("L")
+        self._order = array("Q")
+        self._len = 0
+        if counts is not None:
+            for label, count in counts.items():
+                self._grow(label)
+                if count > 0:
+                    self._order.append(label)
+                    self._len += 1
+                    self._counts[label] = count
+
+    def __contains__(self, label: int) -> bool:
+        return 0 <= label < len(self._counts) and self._counts[label] > 0
+
+    def __getitem__(self, label: int) -> int:
+        return self._counts[label] if 0 <= label < len(self._counts) else 0
+
+    def __iter__(self) -> Iterator[int]:
+        return (label for label, _ in self.items())
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, LabelCounter):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __repr__(self) -> str:
+        return f"LabelCounter({dict(self.items())})"
+
+    def _grow(self, label: int) -> None:
+        missing = label + 1 - len(self._counts)
+        if missing > 0:
+            self._counts.frombytes(bytes(missing * self._counts.itemsize))
+
+    def update(self, labels: Iterable[int]) -> None:
+        """Count each of the labels once more."""
+        for label in labels:
+            self._grow(label)
+            if not self._counts[label]:
+                self._order.append(label)
+                self._len += 1
+            self._counts[label] += 1
+
+    def pop(self, label: int, default: Optional[int] = None) -> Optional[int]:
+        """Remove the label and return its count, or default if not counted."""
+        if label not in self:
+            return default
+        count = self._counts[label]
+        self._counts[label] = 0
+        self._len -= 1
+        return count
+
+    def discard(self, label: int) -> None:
+        """Remove the label if counted."""
+        self.pop(label)
+
+    def items(self) -> List[Tuple[int, int]]:
+        """Return the pairs (label, count) in the order the labels were counted."""
+        seen = LabelSet()
+        res: List[Tuple[int, int]] = []
+        for label in reversed(self._order):
+            if self._counts[label] and label not in seen:
+                seen.add(label)
+                res.append((label, self._counts[label]))
+        res.reverse()
+        return res
+
+    def by_count(self) -> Iterator[int]:
+        """Yield the labels from the most counted to the least counted."""
+        return (label for label, _ in sorted(self.items(), key=lambda x: -x[1]))
+
+    def clear(self) -> None:
+        """Remove all the labels."""
+        self._counts = array("L")
+        self._order = array("Q")
+        self._len = 0
+
+
+Entry = Tuple[int, int, int]
+
+
+class _Run:
+    """
+    A temporary file of entries (label, count, seq) written in order, each
+    stored as three unsigned 64-bit integers.
+    """
+
+    block = 4096
+
+    def __init__(self, entries: Iterable[Entry], spill_dir: Optional[str]):
+        # pylint: disable=consider-using-with
+        self.file: IO[bytes] = tempfile.TemporaryFile(dir=spill_dir)
+        self.len = 0
+        chunk = array("Q")
+        for entry in entries:
+            chunk.extend(entry)
+            if len(chunk) >= 3 * self.block:
+                self._write(chunk)
+                chunk = array("Q")
+        self._write(chunk)
+
+    def _write(self, chunk: "array[int]") -> None:
+        self.file.seek(self.len * 24)
+        self.file.write(chunk.tobytes())
+        self.len += len(chunk) // 3
+
+    def __iter__(self) -> Iterator[Entry]:
+        for start in range(0, self.len, self.block):
+            self.file.seek(start * 24)
+            chunk = array("Q")
+            chunk.frombytes(self.file.read(min(self.block, self.len - start) * 24))
+            for i in range(0, len(chunk), 3):
+                yield chunk[i], chunk[i + 1], chunk[i + 2]
+
+    def find(self, label: int) -> Optional[Entry]:
+        """Return the entry of the label in a run sorted by label."""
+        low, high = 0, self.len
+        while low < high:
+            mid = (low + high) // 2
+            self.file.seek(mid * 24)
+            entry = array("Q")
+            entry.frombytes(self.file.read(24))
+            if entry[0] == label:
+                return entry[0], entry[1], entry[2]
+            if entry[0] < label:
+                low = mid + 1
+            else:
+                high = mid
+        return None
+
+    def close(self) -> None:
+        """Close and remove the file."""
+        self.file.close()
+
+
+class SpillDeque:
+    """
+    A queue of labels holding at most about `2 * max_labels` labels in memory.
+
+    Once `max_labels` labels are waiting, those appended are buffered and
+    written to a temporary file in `spill_dir`, from which they are read back
+    `max_labels` at a time once the labels before them are popped.
+    """
+
+    def __init__(
+        self,
+        max_labels: int,
+        spill_dir: Optional[str] = None,
+        labels: Iterable[int] = (),
+    ):
+        self.max_labels = max_labels
+        self.spill_dir = spill_dir
+        self._head: Deque[int] = deque()
+        self._tail = array("Q")
+        self._file: Optional[IO[bytes]] = None
+        self._read = 0
+        self._written = 0
+        self.extend(labels)
+
+    def __getstate__(self) -> dict:
+        return {
+            "max_labels": self.max_labels,
+            "spill_dir": self.spill_dir,
+            "labels": array("Q", self).tobytes(),
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        labels = array("Q")
+        labels.frombytes(state["labels"])
+        self.__init__(state["max_labels"], state["spill_dir"], labels)  # type: ignore
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SpillDeque):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __len__(self) -> int:
+        return len(self._head) + (self._written - self._read) // 8 + len(self._tail)
+
+    def __bool__(self) -> bool:
+        return bool(self._head) or self._written > self._read or bool(self._tail)
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self._head
+        for start in range(self._read, self._written, 8 * self.max_labels):
+            yield from self._read_labels(start, self.max_labels)
+        yield from self._tail
+
+    def __repr__(self) -> str:
+        return f"SpillDeque({list(self)})"
+
+    def append(self, label: int) -> None:
+        """Add the label to the end of the queue."""
+        if self._written == self._read and not self._tail:
+            if len(self._head) < self.max_labels:
+                self._head.append(label)
+                return
+        self._tail.append(label)
+        if len(self._tail) >= self.max_labels:
+            self._spill()
+
+    def extend(self, labels: Iterable[int]) -> None:
+        """Add the labels to the end of the queue."""
+        for label in labels:
+            self.append(label)
+
+    def popleft(self) -> int:
+        """Remove and return the label at the front of the queue."""
+        if not self._head:
+            self._refill()
+        return self._head.popleft()
+
+    def close(self) -> None:
+        """Remove the labels and the temporary file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._head.clear()
+        self._tail = array("Q")
+        self._read = self._written = 0
+
+    def _spill(self) -> None:
+        if self._file is None:
+            # pylint: disable=consider-using-with
+            self._file = tempfile.TemporaryFile(dir=self.spill_dir)
+        self._file.seek(self._written)
+        self._file.write(self._tail.tobytes())
+        self._written += 8 * len(self._tail)
+        self._tail = array("Q")
+
+    def _read_labels(self, start: int, size: int) -> "array[int]":
+        assert self._file is not None
+        self._file.seek(start)
+        labels = array("Q")
+        labels.frombytes(self._file.read(min(8 * size, self._written - start)))
+        return labels
+
+    def _refill(self) -> None:
+        if self._written > self._read:
+            labels = self._read_labels(self._read, self.max_labels)
+            self._read += 8 * len(labels)
+            self._head.extend(labels)
+            if self._read == self._written:
+                assert self._file is not None
+                self._file.truncate(0)
+                self._read = self._written = 0
+        else:
+            self._head.extend(self._tail)
+            self._tail = array("Q")
+
+
+class SpillCounter:
+    """
+    A counter of labels holding the counts of at most `max_labels` labels in
+    memory, the others being written to sorted runs in temporary files in
+    `spill_dir`. Only the sets of labels counted and of labels removed are
+    kept whole in memory, as LabelSets. The entries of the removed labels are
+    left in the runs and skipped when they are merged.
+
+    The labels are given by `by_count`, from the most counted to the least
+    counted and then in the order they were counted first, as the labels of a
+    LabelCounter sorted by count. The runs are merged lazily as they are
+    given.
+    """
+
+    def __init__(self, max_labels: int, spill_dir: Optional[str] = None):
+        self.max_labels = max_labels
+        self.spill_dir = spill_dir
+        self._counts: Dict[int, int] = {}
+        self._seq = 0
+        self._runs: List[_Run] = []
+        self._labels = LabelSet()
+        # The labels removed and not counted since
+        self._popped = LabelSet()
+        # The labels counted again after being removed, for each run and for
+        # the counts in memory, whose entries in the earlier runs are skipped
+        self._run_restarts: List["array[int]"] = []
+        self._restarts: Set[int] = set()
+
+    def __getstate__(self) -> dict:
+        return {
+            "max_labels": self.max_labels,
+            "spill_dir": self.spill_dir,
+            "seq": self._seq + len(self._counts),
+            "entries": array(
+                "Q", (n for entry in self._merged() for n in entry)
+            ).tobytes(),
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["max_labels"], state["spill_dir"])  # type: ignore
+        self._seq = state["seq"]
+        entries = array("Q")
+        entries.frombytes(state["entries"])
+        if entries:
+            self._runs.append(
+                _Run(
+                    (
+                        (entries[i], entries[i + 1], entries[i + 2])
+                        for i in range(0, len(entries), 3)
+                    ),
+                    self.spill_dir,
+                )
+            )
+            self._run_restarts.append(array("Q"))
+            self._labels = LabelSet(entries[::3])
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SpillCounter):
+            return NotImplemented
+        return list(self._merged()) == list(other._merged())
+
+    def __contains__(self, label: int) -> bool:
+        return label in self._labels
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def update(self, labels: Iterable[int]) -> None:
+        """Count each of the labels once more."""
+        for label in labels:
+            if label in self._counts:
+                self._counts[label] += 1
+            else:
+                self._counts[label] = 1
+                self._labels.add(label)
+                if label in self._popped:
+                    self._popped.discard(label)
+                    self._restarts.add(label)
+                if len(self._counts) >= self.max_labels:
+                    self._spill()
+
+    def pop(self, label: int, default: Optional[int] = None) -> Optional[int]:
+        """
+        Remove the label and return its count, or default if not counted. The
+        count is looked for in each run, use `discard` if it is not needed.
+        """
+        if label not in self._labels:
+            return default
+        entries = [
+            (entry[2], entry[1], label in restarts)
+            for run, restarts in zip(self._runs, self._run_restarts)
+            for entry in (run.find(label),)
+            if entry is not None
+        ]
+        if label in self._counts:
+            entries.append((self._seq, self._counts[label], label in self._restarts))
+        self.discard(label)
+        restart = max((seq for seq, _, restarted in entries if restarted), default=0)
+        return sum(count for seq, count, _ in entries if seq >= restart)
+
+    def discard(self, label: int) -> None:
+        """Remove the label if counted."""
+        if label in self._labels:
+            self._labels.discard(label)
+            self._popped.add(label)
+            self._counts.pop(label, None)
+            self._restarts.discard(label)
+
+    def by_count(self) -> Iterator[int]:
+        """Yield the labels from the most counted to the least counted."""
+        runs: List[_Run] = []
+        try:
+            entries = self._merged()
+            while True:
+                chunk = list(itertools.islice(entries, self.max_labels))
+                if not chunk:
+                    break
+                chunk.sort(key=_count_order)
+                runs.append(_Run(chunk, self.spill_dir))
+            for label, _, _ in heapq.merge(*runs, key=_count_order):
+                yield label
+        finally:
+            for run in runs:
+                run.close()
+
+    def clear(self) -> None:
+        """Remove all the labels and the temporary files."""
+        for run in self._runs:
+            run.close()
+        self._counts = {}
+        self._seq = 0
+        self._runs = []
+        self._labels = LabelSet()
+        self._popped = LabelSet()
+        self._run_restarts = []
+        self._restarts = set()
+
+    def _memory_entries(self) -> List[Entry]:
+        return sorted(
+            (label, count, self._seq + idx)
+            for idx, (label, count) in enumerate(self._counts.items())
+        )
+
+    def _spill(self) -> None:
+        self._runs.append(_Run(self._memory_entries(), self.spill_dir))
+        self._run_restarts.append(array("Q", sorted(self._restarts)))
+        self._seq += len(self._counts)
+        self._counts = {}
+        self._restarts = set()
+
+    def _merged(self) -> Iterator[Entry]:
+        """
+        Yield the entries (label, count, seq) of the labels counted, sorted by
+        label, with the count summed over the runs and the first seq.
+
+        The entries of the labels removed are skipped, as are those written
+        before the label was counted again after being removed.
+        """
+        runs = [
+            _flag_restarts(run, restarts)
+            for run, restarts in zip(self._runs, self._run_restarts)
+        ]
+        runs.append(_flag_restarts(self._memory_entries(), self._restarts))
+        for label, group in itertools.groupby(
+            heapq.merge(*runs), key=lambda entry: entry[0]
+        ):
+            if label in self._popped:
+                continue
+            entries = list(group)
+            restart = max((e[2] for e in entries if e[3]), default=0)
+            entries = [e for e in entries if e[2] >= restart]
+            yield label, sum(e[1] for e in entries), min(e[2] for e in entries)
+
+
+def _flag_restarts(
+    entries: Iterable[Entry], restarts: Iterable[int]
+) -> Iterator[Tuple[int, int, int, bool]]:
+    """Yield the entries with whether the label was counted again there."""
+    restarted = set(restarts)
+    for label, count, seq in entries:
+        yield label, count, seq, label in restarted
+
+
+def _count_order(entry: Entry) -> Tuple[int, int]:
+    return -entry[1], entry[2]
@@ -0,0 +1,425 @@
+"""
+Pools of worker processes or threads used to expand combinatorial classes in
+parallel.
+
+The worker processes only apply strategies to combinatorial classes. They send
+back a compact description of every rule found, i.e. the strategy used together
+with the children encoded with the 'to_bytes' method when it is implemented.
+The main process rebuilds the rules and remains the only one to write to the
+ClassDB, RuleDB and the queue.
+
+The worker threads also label the rules they find, which needs a ClassDB that
+can be used by several threads, but the rules are still added to the RuleDB and
+the queue by the thread of the searcher.
+
+Expansions are pure functions of the class and the strategy, so the pool
+speculatively expands the WorkPackets the queue is expected to yield next. The
+main process still consumes the results in the exact order of the queue which
+makes a parallel run identical to a serial one.
+"""
+
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from multiprocessing.pool import AsyncResult
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
+
+import tabulate
+
+from comb_spec_searcher.exception import StrategyDoesNotApply
+from comb_spec_searcher.strategies.rule import AbstractRule, Rule, VerificationRule
+from comb_spec_searcher.strategies.strategy import AbstractStrategy
+from comb_spec_searcher.strategies.strategy_pack import StrategyPack
+from comb_spec_searcher.typing import CombinatorialClassType, CSSstrategy, WorkPacket
+
+if TYPE_CHECKING:
+    from multiprocessing.sharedctypes import Synchronized
+
+__all__ = ["ExpansionPool", "ThreadExpansionPool", "WorkerStats"]
+
+# How a rule is sent back by a worker
+SAME_STRATEGY, NEW_STRATEGY, FULL_RULE = range(3)
+EncodedClass = Union[bytes, Any]
+RuleDescription = Tuple[int, int, Any, Optional[EncodedClass], Tuple[EncodedClass, ...]]
+TaskResult = Tuple[int, float, List[RuleDescription]]
+StrategyRef = Union[int, CSSstrategy]
+LabelledRule = Tuple[int, Tuple[int, ...], AbstractRule]
+LabelRule = Callable[[Any, int, AbstractRule], LabelledRule]
+# A labelled rule with the position of the strategy yielded by the factory
+OrdinalRule = Tuple[LabelledRule, int]
+
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def encode_class(comb_class: Any) -> EncodedClass:
+    """
+    Return the bytes of the class if 'to_bytes' is implemented and otherwise
+    the class itself.
+    """
+    try:
+        return comb_class.to_bytes()
+    except NotImplementedError:
+        return comb_class
+
+
+def decode_class(
+    combinatorial_class: Type[CombinatorialClassType], encoded: EncodedClass
+) -> CombinatorialClassType:
+    """Return the class from the output of `encode_class`."""
+    if isinstance(encoded, bytes):
+        return combinatorial_class.from_bytes(encoded)
+    return cast(CombinatorialClassType, encoded)
+
+
+def _init_worker(strategies: Tuple[CSSstrategy, ...], counter: "Synchronized") -> None:
+    with counter.get_lock():
+        _WORKER_STATE["index"] = counter.value
+        counter.value += 1
+    _WORKER_STATE["strategies"] = strategies
+
+
+def _new_rules(
+    comb_class: Any, strategy: CSSstrategy
+) -> Iterator[Tuple[int, AbstractRule]]:
+    """
+    Yield the rules given by applying the strategy to the class, skipping the
+    ones that do not apply or give back the class itself, each with the
+    position of the strategy yielded by the factory that gave it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .comb_spec_searcher import CombinatorialSpecificationSearcher
+
+    # pylint: disable=protected-access
+    for ordinal, rule in CombinatorialSpecificationSearcher._rules_from_strategy(
+        comb_class, strategy
+    ):
+        try:
+            children = rule.children
+        except StrategyDoesNotApply:
+            continue
+        if len(children) == 1 and rule.comb_class == children[0]:
+            continue
+        yield ordinal, rule
+
+
+def _expand_task(comb_class: Any, strategy_ref: StrategyRef) -> TaskResult:
+    """
+    Apply the strategy to the class and return the rules found.
+
+    This is the function run by the worker processes.
+    """
+    start = time.time()
+    if isinstance(strategy_ref, int):
+        strategy = _WORKER_STATE["strategies"][strategy_ref]
+    else:
+        strategy = strategy_ref
+    descriptions: List[RuleDescription] = []
+    for ordinal, rule in _new_rules(comb_class, strategy):
+        children = rule.children
+        parent = (
+            None if rule.comb_class == comb_class else encode_class(rule.comb_class)
+        )
+        encoded_children = tuple(map(encode_class, children))
+        if rule.strategy is strategy:
+            descriptions.append(
+                (SAME_STRATEGY, ordinal, None, parent, encoded_children)
+            )
+        elif type(rule) in (Rule, VerificationRule):
+            descriptions.append(
+                (NEW_STRATEGY, ordinal, rule.strategy, parent, encoded_children)
+            )
+        else:
+            descriptions.append((FULL_RULE, ordinal, rule, None, ()))
+    return _WORKER_STATE["index"], time.time() - start, descriptions
+
+
+class WorkerStats:
+    """
+    The time spent by each worker expanding classes and the time the pool was
+    alive for.
+    """
+
+    def __init__(self) -> None:
+        self.busy_time: Dict[int, float] = {}
+        self.tasks: Dict[int, int] = {}
+        self.wall_time = 0.0
+        self.wasted_tasks = 0
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, WorkerStats):
+            return NotImplemented
+        return self.__dict__ == other.__dict__
+
+    def record(self, worker: int, time_taken: float) -> None:
+        """Record a task that took `time_taken` second for the given worker."""
+        self.busy_time[worker] = self.busy_time.get(worker, 0.0) + time_taken
+        self.tasks[worker] = self.tasks.get(worker, 0) + 1
+
+    def status(self) -> str:
+        """Return a string with the utilisation of each worker."""
+        status = "Worker pool status:\n"
+        table: List[Tuple[str, str, str, str]] = []
+        for worker in sorted(self.busy_time):
+            busy = self.busy_time[worker]
+            if self.wall_time > 0:
+                utilisation = f"{int(100 * busy / self.wall_time)}%"
+            else:
+                utilisation = "? %"
+            table.append(
+                (
+                    f"worker {worker}",
+                    f"{self.tasks[worker]:,d}",
+                    str(timedelta(seconds=int(busy))),
+                    utilisation,
+                )
+            )
+        headers = ("", "Tasks", "Busy time", "Utilisation")
+        colalign = ("left", "right", "right", "right")
+        status += "    "
+        status += tabulate.tabulate(table, headers=headers, colalign=colalign).replace(
+            "\n", "\n    "
+        )
+        status += f"\n\tPool alive for {timedelta(seconds=int(self.wall_time))}"
+        status += f", {self.wasted_tasks:,d} speculative expansions unused"
+        return status
+
+
+class ExpansionPool:
+    """
+    A pool of processes expanding classes with the strategies of a pack.
+
+    Use as a context manager. Each expansion is identified by the label of the
+    class and the strategy applied to it. The rules found are labelled with
+    `label_rule` by the main process, as they are consumed. The expansions
+    queued by `speculate` are kept until they are either requested or no
+    longer predicted.
+    """
+
+    def __init__(
+        self,
+        pack: StrategyPack,
+        combinatorial_class: Type[CombinatorialClassType],
+        workers: int,
+        stats: WorkerStats,
+        label_rule: LabelRule,
+    ):
+        self.combinatorial_class = combinatorial_class
+        self.label_rule = label_rule
+        self.workers = workers
+        self.window = 4 * workers
+        self.stats = stats
+        strategies = tuple(pack)
+        self._strategy_index = {id(strat): idx for idx, strat in enumerate(strategies)}
+        self._strategies = strategies
+        self._pool: Optional[Any] = None
+        self._start_time = 0.0
+        self._pending: "OrderedDict[Tuple[int, int], Any]" = OrderedDict()
+        self._speculative: Set[Tuple[int, int]] = set()
+
+    def __enter__(self) -> "ExpansionPool":
+        context = multiprocessing.get_context()
+        counter = context.Value("i", 0)
+        self._pool = context.Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(self._strategies, counter),
+        )
+        self._start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        assert self._pool is not None
+        self.stats.wasted_tasks += len(self._pending)
+        self._pending.clear()
+        self._speculative.clear()
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        self.stats.wall_time += time.time() - self._start_time
+
+    def _strategy_ref(self, strategy: CSSstrategy) -> StrategyRef:
+        return self._strategy_index.get(id(strategy), strategy)
+
+    def submit(self, label: int, comb_class: Any, strategy: CSSstrategy) -> None:
+        """Queue the expansion of the class with the strategy if not already."""
+        assert self._pool is not None, "The pool is not running"
+        key = (label, id(strategy))
+        self._speculative.discard(key)
+        if key not in self._pending:
+            self._pending[key] = self._start(label, comb_class, strategy)
+
+    def _start(self, label: int, comb_class: Any, strategy: CSSstrategy) -> Any:
+        """Start the expansion and return the handle to its result."""
+        # pylint: disable=unused-argument
+        assert self._pool is not None
+        return cast(
+            AsyncResult,
+            self._pool.apply_async(
+                _expand_task, (comb_class, self._strategy_ref(strategy))
+            ),
+        )
+
+    def _cancel(self, handle: Any) -> None:
+        """Stop the expansion if it has not started. A process can not be."""
+
+    def speculate(
+        self, packets: Iterable[WorkPacket], get_class: Callable[[int], Any]
+    ) -> None:
+        """
+        Queue the expansion of the packets that are likely to come next, until
+        the window of the pool is full. The expansions queued earlier for the
+        packets no longer predicted are dropped.
+        """
+        predicted = [
+            (packet.label, strategy)
+            for packet in packets
+            if not packet.inferral
+            for strategy in packet.strategies
+        ]
+        keys = {(label, id(strategy)) for label, strategy in predicted}
+        for key in self._speculative - keys:
+            self._cancel(self._pending.pop(key))
+            self.stats.wasted_tasks += 1
+        self._speculative &= keys
+        last_label, comb_class = None, None
+        for label, strategy in predicted:
+            if len(self._pending) >= self.window:
+                return
+            key = (label, id(strategy))
+            if key in self._pending:
+                continue
+            if label != last_label:
+                last_label, comb_class = label, get_class(label)
+            self._pending[key] = self._start(label, comb_class, strategy)
+            self._speculative.add(key)
+
+    def rules(
+        self, label: int, comb_class: Any, strategy: CSSstrategy
+    ) -> Tuple[float, Iterator[OrdinalRule]]:
+        """
+        Return the time taken by the worker and the labelled rules found by
+        expanding the class with the strategy, each with the position of the
+        strategy yielded by the factory that gave it, or -1 for a strategy.
+        """
+        self.submit(label, comb_class, strategy)
+        worker, time_taken, descriptions = self._pending.pop(
+            (label, id(strategy))
+        ).get()
+        self.stats.record(worker, time_taken)
+        return time_taken, (
+            (
+                self.label_rule(
+                    comb_class,
+                    label,
+                    self._decode_rule(comb_class, strategy, description),
+                ),
+                description[1],
+            )
+            for description in descriptions
+        )
+
+    def _decode_rule(
+        self, comb_class: Any, strategy: CSSstrategy, description: RuleDescription
+    ) -> AbstractRule:
+        kind, _, payload, parent, children = description
+        if kind == FULL_RULE:
+            assert isinstance(payload, AbstractRule)
+            return payload
+        if parent is not None:
+            comb_class = decode_class(self.combinatorial_class, parent)
+        decoded_children = tuple(
+            decode_class(self.combinatorial_class, child) for child in children
+        )
+        if kind == SAME_STRATEGY:
+            assert isinstance(strategy, AbstractStrategy)
+            payload = strategy
+        return cast(AbstractRule, payload(comb_class, decoded_children))
+
+
+class ThreadExpansionPool(ExpansionPool):
+    """
+    A pool of threads expanding classes with the strategies of a pack.
+
+    The threads also label the rules they find, so `label_rule` must only use
+    a ClassDB that can be used by several threads at once.
+    """
+
+    def __init__(
+        self,
+        pack: StrategyPack,
+        combinatorial_class: Type[CombinatorialClassType],
+        threads: int,
+        stats: WorkerStats,
+        label_rule: LabelRule,
+    ):
+        super().__init__(pack, combinatorial_class, threads, stats, label_rule)
+        self._local = threading.local()
+        self._index_lock = threading.Lock()
+        self._next_index = 0
+
+    def __enter__(self) -> "ThreadExpansionPool":
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        assert self._pool is not None
+        self.stats.wasted_tasks += len(self._pending)
+        self._pending.clear()
+        self._speculative.clear()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+        self.stats.wall_time += time.time() - self._start_time
+
+    def _thread_index(self) -> int:
+        """Return the index of the current thread in the pool."""
+        index = getattr(self._local, "index", None)
+        if index is None:
+            with self._index_lock:
+                index = self._next_index
+                self._next_index += 1
+            self._local.index = index
+        return cast(int, index)
+
+    def _start(self, label: int, comb_class: Any, strategy: CSSstrategy) -> Any:
+        assert self._pool is not None
+        return cast(Future, self._pool.submit(self._task, label, comb_class, strategy))
+
+    def _cancel(self, handle: Any) -> None:
+        cast(Future, handle).cancel()
+
+    def _task(
+        self, label: int, comb_class: Any, strategy: CSSstrategy
+    ) -> Tuple[int, float, List[OrdinalRule]]:
+        """Apply the strategy to the class and label the rules found."""
+        start = time.time()
+        labelled = [
+            (self.label_rule(comb_class, label, rule), ordinal)
+            for ordinal, rule in _new_rules(comb_class, strategy)
+        ]
+        return self._thread_index(), time.time() - start, labelled
+
+    def rules(
+        self, label: int, comb_class: Any, strategy: CSSstrategy
+    ) -> Tuple[float, Iterator[OrdinalRule]]:
+        self.submit(label, comb_class, strategy)
+        worker, time_taken, labelled = self._pending.pop((label, id(strategy))).result()
+        self.stats.record(worker, time_taken)
+        return time_taken, iter(labelled)
@@ -1,5 +1,12 @@
-from .base import RuleDB
+from .base import RuleDB, ThreadSafeRuleDB
+from .flat import RuleDBFlat
 from .forest import RuleDBForest
 from .forget import RuleDBForgetStrategy
 
-__all__ = ["RuleDB", "RuleDBForgetStrategy", "RuleDBForest"]
+__all__ = [
+    "RuleDB",
+    "RuleDBFlat",
+    "RuleDBForgetStrategy",
+    "RuleDBForest",
+    "ThreadSafeRuleDB",
+]
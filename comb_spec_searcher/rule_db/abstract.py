@@ -14,6 +14,8 @@ from typing import (
     cast,
 )
 
+from logzero import logger
+
 from comb_spec_searcher.class_db import ClassDB
 from comb_spec_searcher.exception import SpecificationNotFound
 from comb_spec_searcher.strategies.rule import AbstractRule
@@ -64,14 +66,34 @@ class RuleDBAbstract(abc.ABC):
         """Return True if label has been verified."""
 
     @abc.abstractmethod
-    def add(self, start: int, ends: Tuple[int, ...], rule: AbstractRule) -> None:
+    def add(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule, hint: int = -1
+    ) -> None:
         """
         Add a rule to the database.
 
         - start is a single integer.
         - ends is a tuple of integers, representing the children.
         - rule is a Rule that creates start -> ends.
+        - hint is where the strategy of the rule is in the pack, for the
+          databases recomputing it, or -1 if not known. See
+          `CombinatorialSpecificationSearcher._rule_hint`.
+        """
+
+    def _clean_labels(
+        self, ends: Tuple[int, ...], rule: AbstractRule
+    ) -> Tuple[int, ...]:
+        """
+        Remove the empty label and sort the remaining one.
         """
+        cleaned_ends = []
+        for comb_class, child_label in zip(rule.children, ends):
+            if rule.possibly_empty and self.classdb.is_empty(comb_class, child_label):
+                logger.debug("Label %s is empty.", child_label)
+                self.searcher.classqueue.set_stop_yielding(child_label)
+                continue
+            cleaned_ends.append(child_label)
+        return tuple(sorted(cleaned_ends))
 
     @abc.abstractmethod
     def status(self, elaborate: bool) -> str:
@@ -4,9 +4,11 @@ A database to search for tree.
 
 import abc
 import itertools
+import threading
 from collections import defaultdict
 from typing import (
     Any,
+    Callable,
     Dict,
     Iterable,
     Iterator,
@@ -23,6 +25,7 @@ from logzero import logger
 
 from comb_spec_searcher.equiv_db import EquivalenceDB
 from comb_spec_searcher.exception import InvalidOperationError
+from comb_spec_searcher.journal import ADD_RULE, Journal
 from comb_spec_searcher.rule_db.abstract import RuleDBAbstract, ensure_specification
 from comb_spec_searcher.specification_extrator import SpecificationRuleExtractor
 from comb_spec_searcher.strategies import AbstractStrategy, VerificationRule
@@ -30,9 +33,7 @@ from comb_spec_searcher.strategies.rule import AbstractRule
 from comb_spec_searcher.tree_searcher import (
     Node,
     iterative_proof_tree_finder,
-    iterative_prune,
     proof_tree_generator_dfs,
-    prune,
     smallish_random_proof_tree,
 )
 from comb_spec_searcher.typing import CombinatorialClassType, RuleKey, RulesDict
@@ -51,6 +52,26 @@ class RuleDBBase(RuleDBAbstract):
         # Store the pruned dict. Should be set back to None every time the ruledb is
         # edited. Use the propertu for clean access.
         self._pruned_dict: Optional[RulesDict] = None
+        # The equivalence labels known to be in a specification, i.e. the keys of
+        # the pruned dict. They are maintained incrementally using the rules added
+        # since the last update and the reverse index from a child to its parents.
+        self._productive: Set[int] = set()
+        self._pending_rules: List[RuleKey] = []
+        self._label_rules: Dict[int, List[Tuple[int, ...]]] = defaultdict(list)
+        self._label_parents: Dict[int, List[int]] = defaultdict(list)
+        self._eqv_members: Dict[int, List[int]] = defaultdict(list)
+        self._merged_roots: Set[int] = set()
+        # An index from a rule up to equivalence to the pairs (is_two_way, rule) of
+        # the rules in the database with it. Each is mapped to its position to
+        # preserve the order of the database. The keys of the index using each
+        # equivalence label are kept so that only those are updated when two
+        # equivalence classes are merged.
+        self._eqv_rule_index: Dict[RuleKey, Dict[Tuple[bool, RuleKey], int]] = (
+            defaultdict(dict)
+        )
+        self._eqv_label_index_keys: Dict[int, Set[RuleKey]] = defaultdict(set)
+        self._rules_indexed = 0
+        self.journal: Optional[Journal] = None
 
     @property
     def iterative(self) -> bool:
@@ -65,17 +86,19 @@ class RuleDBBase(RuleDBAbstract):
         Returned the prune dict of all the rules that are in a specification.
 
         The dict needs to be recomputed every time the database changes and it
-        is costly to so. Call with moderation.
+        is costly to so. Call with moderation, `has_specification` does not need
+        it.
         """
         if self._pruned_dict is None:
-            rules_dict = self.rules_up_to_equivalence()
-            if self.iterative:
-                rules_dict = iterative_prune(rules_dict, root=self.root_label)
-            else:
-                prune(rules_dict)
+            self._update_productive()
+            rules_dict: RulesDict = defaultdict(set)
+            for start, rules in self.rules_up_to_equivalence().items():
+                if start not in self._productive:
+                    continue
+                rules = set(filter(self._is_productive_rule, rules))
+                if rules:
+                    rules_dict[start] = rules
             self._pruned_dict = rules_dict
-            for ver_label in rules_dict.keys():
-                self.equivdb.set_verified(ver_label)
         return self._pruned_dict
 
     @property
@@ -97,39 +120,72 @@ class RuleDBBase(RuleDBAbstract):
             and self.eqv_rule_to_strategy == other.eqv_rule_to_strategy
         )
 
-    def add(self, start: int, ends: Tuple[int, ...], rule: AbstractRule) -> None:
-        self._pruned_dict = None
+    def add(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule, hint: int = -1
+    ) -> None:
+        # pylint: disable=unused-argument
         ends = self._clean_labels(ends, rule)
         if ends == [start]:
             return
-        if isinstance(rule, VerificationRule):
+        self.insert(
+            start,
+            ends,
+            rule.strategy,
+            isinstance(rule, VerificationRule),
+            len(ends) == 1 and rule.is_two_way(),
+        )
+
+    def insert(
+        self,
+        start: int,
+        ends: Tuple[int, ...],
+        strategy: AbstractStrategy,
+        verification: bool,
+        two_way: bool,
+    ) -> None:
+        """
+        Add the rule start -> ends given by the strategy once the empty children
+        are removed from ends.
+        """
+        if self.journal is not None:
+            self.journal.record(
+                ADD_RULE,
+                start,
+                ends,
+                self.journal.strategy_ref(strategy),
+                verification,
+                two_way,
+            )
+        self._pruned_dict = None
+        if verification:
             self.equivdb.set_verified(start)
         if len(ends) == 1:
-            if rule.is_two_way():
+            if two_way:
                 self.equivdb.add_two_way_edge(start, ends[0])
-                self.eqv_rule_to_strategy[(start, ends)] = rule.strategy
-                self.rule_to_strategy.pop((start, ends), None)
-                self.rule_to_strategy.pop((ends[0], (start,)), None)
+                for rule_key in ((start, ends), (ends[0], (start,))):
+                    if rule_key in self.rule_to_strategy:
+                        del self.rule_to_strategy[rule_key]
+                        self._unindex_rule(*rule_key)
+                if (start, ends) not in self.eqv_rule_to_strategy:
+                    self._index_rule(start, ends, True)
+                self.eqv_rule_to_strategy[(start, ends)] = strategy
             else:
                 self.equivdb.add_one_way_edge(start, ends[0])
-                self.rule_to_strategy[(start, ends)] = rule.strategy
+                self._add_rule_key(start, ends, strategy)
         else:
-            self.rule_to_strategy[(start, ends)] = rule.strategy
+            self._add_rule_key(start, ends, strategy)
 
-    def _clean_labels(
-        self, ends: Tuple[int, ...], rule: AbstractRule
-    ) -> Tuple[int, ...]:
+    def _add_rule_key(
+        self, start: int, ends: Tuple[int, ...], strategy: AbstractStrategy
+    ) -> None:
         """
-        Remove the empty label and sort the remaining one.
+        Store the strategy for the rule start -> ends, and keep the rule for the
+        next update of the labels in a specification if it is new.
         """
-        cleaned_ends = []
-        for comb_class, child_label in zip(rule.children, ends):
-            if rule.possibly_empty and self.classdb.is_empty(comb_class, child_label):
-                logger.debug("Label %s is empty.", child_label)
-                self.searcher.classqueue.set_stop_yielding(child_label)
-                continue
-            cleaned_ends.append(child_label)
-        return tuple(sorted(cleaned_ends))
+        if (start, ends) not in self.rule_to_strategy:
+            self._pending_rules.append((start, ends))
+            self._index_rule(start, ends, False)
+        self.rule_to_strategy[(start, ends)] = strategy
 
     def is_verified(self, label: int) -> bool:
         """Return True if label has been verified."""
@@ -141,7 +197,6 @@ class RuleDBBase(RuleDBAbstract):
 
     def rules_up_to_equivalence(self) -> Dict[int, Set[Tuple[int, ...]]]:
         """Return a defaultdict containing all rules up to the equivalence."""
-        self.equivdb.connect_cycles()
         rules_dict: Dict[int, Set[Tuple[int, ...]]] = defaultdict(set)
         for start, ends in self:
             if len(ends) == 1 and self.are_equivalent(start, ends[0]):
@@ -220,7 +275,300 @@ class RuleDBBase(RuleDBAbstract):
 
     def has_specification(self) -> bool:
         """Return True if a specification has been found, false otherwise."""
-        return self.equivdb[self.root_label] in self.pruned_dict
+        self._update_productive()
+        return self.equivdb[self.root_label] in self._productive
+
+    def _is_productive_rule(self, eqv_ends: Iterable[int]) -> bool:
+        """
+        Return True if every equivalence label in eqv_ends is in a specification.
+
+        When searching for an iterative specification the root is also allowed.
+        """
+        root = self.equivdb[self.root_label] if self.iterative else None
+        return all(end in self._productive or end == root for end in eqv_ends)
+
+    def _eqv_rules(self, eqv_label: int) -> Iterator[Tuple[int, ...]]:
+        """
+        Yield the children of the rules of the equivalence class, up to
+        equivalence. Rules within the equivalence class are skipped.
+        """
+        for label in self._eqv_members[eqv_label]:
+            for ends in self._label_ends(label):
+                eqv_ends = tuple(self.equivdb[end] for end in ends)
+                if eqv_ends != (eqv_label,):
+                    yield eqv_ends
+
+    def _eqv_parents(self, eqv_label: int) -> Iterator[int]:
+        """
+        Yield the equivalence label of the parent of every rule with a child in
+        the equivalence class.
+        """
+        for label in self._eqv_members[eqv_label]:
+            for parent in self._label_parent_labels(label):
+                yield self.equivdb[parent]
+
+    def _label_ends(self, label: int) -> Iterable[Tuple[int, ...]]:
+        """Return the children of the rules of the label indexed so far."""
+        return self._label_rules.get(label, ())
+
+    def _label_parent_labels(self, label: int) -> Iterable[int]:
+        """
+        Return the parent of every rule indexed so far with the label as a
+        child, once for each rule.
+        """
+        return self._label_parents.get(label, ())
+
+    def _index_pending_rules(self) -> Iterator[RuleKey]:
+        """
+        Index by label the rules added since the last call and yield them. The
+        labels seen for the first time are added to their equivalence class.
+        """
+        for start, ends in self._pending_rules:
+            for label in {start, *ends}:
+                if label not in self._label_rules and label not in self._label_parents:
+                    self._eqv_members[self.equivdb[label]].append(label)
+            self._label_rules[start].append(ends)
+            for end in set(ends):
+                self._label_parents[end].append(start)
+            yield start, ends
+        self._pending_rules.clear()
+
+    def _eqv_key(self, start: int, ends: Iterable[int]) -> RuleKey:
+        """Return the rule up to equivalence."""
+        return self.equivdb[start], tuple(sorted(map(self.equivdb.__getitem__, ends)))
+
+    def _index_rule(self, start: int, ends: Tuple[int, ...], two_way: bool) -> None:
+        """Add the rule to the index of rules up to equivalence."""
+        self._apply_merges()
+        eqv_key = self._eqv_key(start, ends)
+        self._eqv_rule_index[eqv_key][(two_way, (start, ends))] = self._rules_indexed
+        self._rules_indexed += 1
+        for eqv_label in (eqv_key[0], *eqv_key[1]):
+            self._eqv_label_index_keys[eqv_label].add(eqv_key)
+
+    def _unindex_rule(self, start: int, ends: Tuple[int, ...]) -> None:
+        """Remove the rule, which is not two way, from the index of rules."""
+        self._apply_merges()
+        self._eqv_rule_index[self._eqv_key(start, ends)].pop((False, (start, ends)))
+
+    def _apply_merges(self) -> None:
+        """
+        Update the data kept by equivalence labels with the merges of the
+        equivalence database since the last call.
+        """
+        for old_root, new_root in self.equivdb.merges:
+            self._eqv_members[new_root].extend(self._eqv_members.pop(old_root, ()))
+            if old_root in self._productive:
+                self._productive.remove(old_root)
+                self._productive.add(new_root)
+            self._merged_roots.add(new_root)
+            for eqv_key in self._eqv_label_index_keys.pop(old_root, ()):
+                new_eqv_key = self._eqv_key(*eqv_key)
+                if eqv_key not in self._eqv_rule_index or new_eqv_key == eqv_key:
+                    continue
+                self._eqv_rule_index[new_eqv_key].update(
+                    self._eqv_rule_index.pop(eqv_key)
+                )
+                for eqv_label in (new_eqv_key[0], *new_eqv_key[1]):
+                    self._eqv_label_index_keys[eqv_label].add(new_eqv_key)
+        self.equivdb.merges.clear()
+
+    def _update_productive(self) -> None:
+        """
+        Bring the set of equivalence labels in a specification up to date with
+        the rules and equivalences added since the last update.
+
+        Only the classes that could be affected by the changes are visited.
+        """
+        self._apply_merges()
+        seeds: Set[int] = set(map(self.equivdb.__getitem__, self._merged_roots))
+        self._merged_roots.clear()
+        merged = set(seeds)
+        for start, _ in self._index_pending_rules():
+            if self.equivdb[start] not in self._productive:
+                seeds.add(start)
+        seeds = set(map(self.equivdb.__getitem__, seeds))
+        if self.iterative and self.equivdb[self.root_label] in merged:
+            # Some labels may have only been productive thanks to classes that are
+            # now equivalent to the root, so we start again.
+            self._productive.clear()
+            seeds = set(self._eqv_members)
+        if self.iterative:
+            new_productive = self._grow_iterative_productive(seeds)
+        else:
+            new_productive = self._grow_productive(seeds)
+        for eqv_label in new_productive:
+            self.equivdb.set_verified(eqv_label)
+        if self._searcher is not None:
+            self._credit_strategies(new_productive)
+
+    def _credit_strategies(self, new_productive: Iterable[int]) -> None:
+        """
+        Count in the `func_used` of the searcher the strategy of every rule of
+        the equivalence labels now in a specification whose children are all
+        in one too.
+        """
+        used = self.searcher.func_used
+        for eqv_label in new_productive:
+            for label in self._eqv_members[eqv_label]:
+                for ends in self._label_ends(label):
+                    eqv_ends = tuple(self.equivdb[end] for end in ends)
+                    if eqv_ends == (eqv_label,) or not self._is_productive_rule(
+                        eqv_ends
+                    ):
+                        continue
+                    strategy = self.rule_to_strategy.get((label, ends))
+                    if strategy is not None:
+                        used[str(strategy)] += 1
+
+    def _grow_productive(self, seeds: Set[int]) -> Set[int]:
+        """
+        Add to the productive set the equivalence labels in a specification that
+        depend on one of the seeds, and return them.
+
+        A new label reaches a new seed through rules whose children are all new
+        or productive. So the new labels are first looked for among the seeds
+        and the unproductive labels below them, which is usually a handful of
+        labels, and only if some are found among the unproductive labels above
+        these and the productive seeds.
+        """
+        sources = seeds.intersection(self._productive)
+        below = self._unproductive_closure(seeds - sources, self._eqv_children)
+        new_productive = self._greatest_productive(below)
+        self._productive.update(new_productive)
+        sources.update(new_productive)
+        if sources:
+            above = self._unproductive_closure(sources, self._eqv_parents)
+            new_above = self._greatest_productive(above)
+            self._productive.update(new_above)
+            new_productive.update(new_above)
+        return new_productive
+
+    def _eqv_children(self, eqv_label: int) -> Iterator[int]:
+        """Yield the children of the rules of the equivalence class."""
+        for eqv_ends in self._eqv_rules(eqv_label):
+            yield from eqv_ends
+
+    def _unproductive_closure(
+        self, labels: Set[int], neighbours: Callable[[int], Iterator[int]]
+    ) -> Set[int]:
+        """
+        Return the unproductive equivalence labels reached from the labels by
+        going through neighbours that are not productive, including the labels
+        themselves if unproductive.
+        """
+        closure = labels.difference(self._productive)
+        stack = list(labels)
+        while stack:
+            for neighbour in neighbours(stack.pop()):
+                if neighbour not in closure and neighbour not in self._productive:
+                    closure.add(neighbour)
+                    stack.append(neighbour)
+        return closure
+
+    def _greatest_productive(self, candidates: Set[int]) -> Set[int]:
+        """
+        Return the largest set of candidates such that each has a rule whose
+        children are all candidates in the set or productive.
+
+        Every rule with only candidates or productive children keeps its
+        parent, and every candidate the count of these rules. The candidates
+        without any are removed, which removes the rules with them as a child,
+        until none can be.
+        """
+        parents: List[int] = []
+        removed_rules: Set[int] = set()
+        rules_with_child: Dict[int, List[int]] = defaultdict(list)
+        alive_rules: Dict[int, int] = {}
+        for eqv_label in candidates:
+            alive_rules[eqv_label] = 0
+            for eqv_ends in self._eqv_rules(eqv_label):
+                children = set(eqv_ends).difference(self._productive)
+                if not children.issubset(candidates):
+                    continue
+                alive_rules[eqv_label] += 1
+                for child in children:
+                    rules_with_child[child].append(len(parents))
+                parents.append(eqv_label)
+        stack = [label for label, alive in alive_rules.items() if alive == 0]
+        removed = set(stack)
+        while stack:
+            for rule in rules_with_child.pop(stack.pop(), ()):
+                if rule in removed_rules:
+                    continue
+                removed_rules.add(rule)
+                parent = parents[rule]
+                alive_rules[parent] -= 1
+                if alive_rules[parent] == 0 and parent not in removed:
+                    removed.add(parent)
+                    stack.append(parent)
+        return candidates - removed
+
+    def _grow_iterative_productive(self, seeds: Set[int]) -> Set[int]:
+        """
+        Add to the productive set the equivalence labels with an iterative
+        specification that can now be found from the seeds, and return them.
+
+        A label is productive as soon as one of its rules has only productive
+        children, the root being counted as productive. This is propagated as
+        Horn clauses: every rule of a label visited keeps the number of its
+        children not yet productive, which is decreased when one becomes
+        productive, and only the parents of the new productive labels are
+        visited.
+        """
+        root = self.equivdb[self.root_label]
+        waiting: Dict[int, Dict[int, List[int]]] = {}
+        counts: Dict[int, List[int]] = {}
+        new_productive: Set[int] = set()
+        stack = [seed for seed in seeds if seed in self._productive or seed == root]
+        for eqv_label in seeds:
+            if eqv_label not in self._productive and self._count_unproductive(
+                eqv_label, root, counts, waiting
+            ):
+                self._productive.add(eqv_label)
+                new_productive.add(eqv_label)
+                stack.append(eqv_label)
+        while stack:
+            child = stack.pop()
+            for parent in set(self._eqv_parents(child)):
+                if parent in self._productive:
+                    continue
+                if parent in counts:
+                    parent_counts = counts[parent]
+                    satisfied = False
+                    for rule in waiting[parent].pop(child, ()):
+                        parent_counts[rule] -= 1
+                        satisfied = satisfied or parent_counts[rule] == 0
+                else:
+                    satisfied = self._count_unproductive(parent, root, counts, waiting)
+                if satisfied:
+                    self._productive.add(parent)
+                    new_productive.add(parent)
+                    stack.append(parent)
+        return new_productive
+
+    def _count_unproductive(
+        self,
+        eqv_label: int,
+        root: int,
+        counts: Dict[int, List[int]],
+        waiting: Dict[int, Dict[int, List[int]]],
+    ) -> bool:
+        """
+        Store the number of children neither productive nor the root of each
+        rule of the label, and the rules waiting for each of these children.
+        Return True if a rule has none.
+        """
+        label_counts = counts[eqv_label] = []
+        label_waiting = waiting[eqv_label] = defaultdict(list)
+        for eqv_ends in self._eqv_rules(eqv_label):
+            children = {
+                end for end in eqv_ends if end not in self._productive and end != root
+            }
+            for child in children:
+                label_waiting[child].append(len(label_counts))
+            label_counts.append(len(children))
+        return 0 in label_counts
 
     def rule_from_equivalence_rule(
         self, eqv_start: int, eqv_ends: Iterable[int]
@@ -230,15 +578,11 @@ class RuleDBBase(RuleDBAbstract):
 
         Returns None if no such rule exists.
         """
-        eqv_start = self.equivdb[eqv_start]
-        eqv_ends = tuple(sorted(map(self.equivdb.__getitem__, eqv_ends)))
-        for rule in self:
-            start, ends = rule
-            temp_start = self.equivdb[start]
-            temp_ends = tuple(sorted(map(self.equivdb.__getitem__, ends)))
-            if eqv_start == temp_start and eqv_ends == temp_ends:
-                return start, ends
-        return None
+        self._apply_merges()
+        rules = self._eqv_rule_index.get(self._eqv_key(eqv_start, eqv_ends))
+        if not rules:
+            return None
+        return min(rules.items(), key=lambda item: (item[0][0], item[1]))[0][1]
 
     def rule_from_equivalence_rule_dict(
         self, eqv_rules: Iterable[RuleKey]
@@ -246,14 +590,17 @@ class RuleDBBase(RuleDBAbstract):
         """
         Return a dictionary pointing from an equivalence rule to an actual rule.
         """
-        eqv_rules = set(eqv_rules)
+        self._apply_merges()
         res: Dict[RuleKey, RuleKey] = {}
-        for start, ends in self.rule_to_strategy:
-            eqv_start = self.equivdb[start]
-            eqv_ends = tuple(sorted(map(self.equivdb.__getitem__, ends)))
-            eqv_key = (eqv_start, eqv_ends)
-            if eqv_key in eqv_rules:
-                res[eqv_key] = (start, ends)
+        for eqv_key in set(eqv_rules):
+            rules = self._eqv_rule_index.get(eqv_key, {})
+            positions = [
+                (position, rule)
+                for (two_way, rule), position in rules.items()
+                if not two_way
+            ]
+            if positions:
+                res[eqv_key] = max(positions)[1]
         return res
 
     @ensure_specification
@@ -412,3 +759,70 @@ class RuleDB(RuleDBBase):
                 )
             eqs.add(eq)
         return eqs
+
+
+class ThreadSafeRuleDB(RuleDB):
+    """
+    A RuleDB that can be used by several threads at once.
+
+    Every method reading or changing the rules holds the same lock, and the
+    rules yielded are computed under it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def add(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule, hint: int = -1
+    ) -> None:
+        with self._lock:
+            super().add(start, ends, rule, hint)
+
+    def insert(
+        self,
+        start: int,
+        ends: Tuple[int, ...],
+        strategy: AbstractStrategy,
+        verification: bool,
+        two_way: bool,
+    ) -> None:
+        with self._lock:
+            super().insert(start, ends, strategy, verification, two_way)
+
+    def is_verified(self, label: int) -> bool:
+        with self._lock:
+            return super().is_verified(label)
+
+    def are_equivalent(self, label: int, other: int) -> bool:
+        with self._lock:
+            return super().are_equivalent(label, other)
+
+    def rules_up_to_equivalence(self) -> Dict[int, Set[Tuple[int, ...]]]:
+        with self._lock:
+            return super().rules_up_to_equivalence()
+
+    def status(self, elaborate: bool) -> str:
+        with self._lock:
+            return super().status(elaborate)
+
+    def has_specification(self) -> bool:
+        with self._lock:
+            return super().has_specification()
+
+    def get_specification_rules(self, **kwargs) -> Iterator[AbstractRule]:
+        with self._lock:
+            return iter(list(super().get_specification_rules(**kwargs)))
+
+    def all_rules(self) -> Iterator[AbstractRule]:
+        with self._lock:
+            return iter(list(super().all_rules()))
@@ -0,0 +1,379 @@
+"""
+A database to search for tree.
+
+The database stores the rules in flat arrays of integers to save memory.
+"""
+
+import itertools
+import json
+import sys
+from array import array
+from collections import defaultdict
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+from comb_spec_searcher.strategies.strategy import AbstractStrategy
+from comb_spec_searcher.typing import RuleKey
+from comb_spec_searcher.utils import size_to_readable
+
+from .base import RuleDBBase
+from .forest import LinkedLists
+
+__all__ = ["RuleDBFlat"]
+
+# The slot of the hash table not pointing to a rule
+FREE = -1
+
+
+class StrategyTable:
+    """
+    The strategies of a database, each stored once and referred to by its
+    position in the table. Strategies are mostly not hashable, so equal
+    strategies are found by comparing those with the same JSON. The id found
+    for a strategy object is cached, as the same object is often stored for
+    several rules.
+    """
+
+    def __init__(self) -> None:
+        self.strategies: List[AbstractStrategy] = []
+        self._ids: Dict[str, List[int]] = {}
+        self._id_of_object: Dict[int, int] = {}
+        self._last: Tuple[Optional[AbstractStrategy], int] = (None, -1)
+
+    def __len__(self) -> int:
+        return len(self.strategies)
+
+    def __getitem__(self, strategy_id: int) -> AbstractStrategy:
+        return self.strategies[strategy_id]
+
+    def __getstate__(self) -> dict:
+        return {"strategies": self.strategies, "ids": self._ids}
+
+    def __setstate__(self, state: dict) -> None:
+        self.strategies = state["strategies"]
+        self._ids = state["ids"]
+        self._id_of_object = {
+            id(strategy): strategy_id
+            for strategy_id, strategy in enumerate(self.strategies)
+        }
+        self._last = (None, -1)
+
+    def intern(self, strategy: AbstractStrategy) -> int:
+        """Return the id of the strategy, adding it to the table if new."""
+        # The objects in the table are kept alive, so their ids are not reused.
+        strategy_id = self._id_of_object.get(id(strategy))
+        if strategy_id is not None:
+            return strategy_id
+        if self._last[0] is strategy:
+            return self._last[1]
+        key = json.dumps(strategy.to_jsonable(), sort_keys=True, default=repr)
+        candidates = self._ids.setdefault(key, [])
+        for strategy_id in candidates:
+            if self.strategies[strategy_id] == strategy:
+                break
+        else:
+            strategy_id = len(self.strategies)
+            candidates.append(strategy_id)
+            self.strategies.append(strategy)
+            self._id_of_object[id(strategy)] = strategy_id
+        self._last = (strategy, strategy_id)
+        return strategy_id
+
+
+# pylint: disable=too-many-ancestors
+class FlatRuleDict(MutableMapping[RuleKey, AbstractStrategy]):
+    """
+    A mapping from rules to strategies stored in columns of integers, as a
+    sparse matrix in CSR format: the rule in row i is
+    `parents[i] -> children[offsets[i]:offsets[i + 1]]` and its strategy is
+    the one in the table with id `strategy_ids[i]`.
+
+    The rows are found with an open addressing hash table of row numbers. A
+    rule deleted keeps its row, with the strategy id -1, so that the rows stay
+    numbered in the order the rules were added.
+    """
+
+    def __init__(self, strategies: StrategyTable) -> None:
+        self.strategies = strategies
+        self.parents = array("q")
+        self.offsets = array("q", [0])
+        self.children = array("q")
+        self.strategy_ids = array("q")
+        self._slots = array("q", [FREE]) * 8
+        self._len = 0
+
+    def _rule(self, row: int) -> RuleKey:
+        return self.parents[row], self.ends(row)
+
+    def ends(self, row: int) -> Tuple[int, ...]:
+        """Return the children of the rule in the row."""
+        return tuple(self.children[self.offsets[row] : self.offsets[row + 1]])
+
+    def is_deleted(self, row: int) -> bool:
+        """Return True if the rule in the row was deleted."""
+        return self.strategy_ids[row] < 0
+
+    def _find(self, key: RuleKey) -> Tuple[int, int]:
+        """
+        Return the slot of the rule in the hash table and its row, or the free
+        slot it would use and -1 if the rule is not stored.
+        """
+        start, ends = key[0], tuple(key[1])
+        mask = len(self._slots) - 1
+        slot = hash((start, ends)) & mask
+        while True:
+            row = self._slots[slot]
+            if row == FREE:
+                return slot, -1
+            if (
+                self.strategy_ids[row] >= 0
+                and self.parents[row] == start
+                and self.ends(row) == ends
+            ):
+                return slot, row
+            slot = (slot + 1) & mask
+
+    def _resize(self) -> None:
+        """Rebuild a hash table with the rows that are not deleted."""
+        size = len(self._slots)
+        while size <= 4 * (len(self.parents) + 1):
+            size *= 2
+        self._slots = array("q", [FREE]) * size
+        for row in range(len(self.parents)):
+            if not self.is_deleted(row):
+                self._slots[self._find(self._rule(row))[0]] = row
+
+    def _append(self, slot: int, key: RuleKey, strategy_id: int) -> None:
+        self._slots[slot] = len(self.parents)
+        self.parents.append(key[0])
+        self.children.extend(key[1])
+        self.offsets.append(len(self.children))
+        self.strategy_ids.append(strategy_id)
+
+    def __getitem__(self, key: RuleKey) -> AbstractStrategy:
+        row = self._find(key)[1]
+        if row == -1:
+            raise KeyError(key)
+        return self.strategies[self.strategy_ids[row]]
+
+    def __setitem__(self, key: RuleKey, value: AbstractStrategy) -> None:
+        strategy_id = self.strategies.intern(value)
+        slot, row = self._find(key)
+        if row != -1:
+            self.strategy_ids[row] = strategy_id
+            return
+        if 2 * (len(self.parents) + 1) > len(self._slots):
+            self._resize()
+            slot = self._find(key)[0]
+        self._append(slot, key, strategy_id)
+        self._len += 1
+
+    def __delitem__(self, key: RuleKey) -> None:
+        row = self._find(key)[1]
+        if row == -1:
+            raise KeyError(key)
+        self.strategy_ids[row] = -1
+        self._len -= 1
+
+    def __iter__(self) -> Iterator[RuleKey]:
+        for row in range(len(self.parents)):
+            if self.strategy_ids[row] >= 0:
+                yield self._rule(row)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, key: object) -> bool:
+        return self._find(cast(RuleKey, key))[1] != -1
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used by the columns and the hash table."""
+        return sum(
+            column.itemsize * len(column)
+            for column in (
+                self.parents,
+                self.offsets,
+                self.children,
+                self.strategy_ids,
+                self._slots,
+            )
+        )
+
+
+class RuleDBFlat(RuleDBBase):
+    """
+    A RuleDB storing the rules in columns of integers, with each distinct
+    strategy stored once in a table shared by the combinatorial and the
+    equivalence rules.
+
+    The indices of the combinatorial rules by label are linked lists in arrays
+    of their rows: the rules of each label and the rules with each label as a
+    child. The rows from `_rows_indexed` on are not indexed yet. The rules up
+    to equivalence are not indexed but found by going through the rules of the
+    equivalence class of their parent.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.strategies = StrategyTable()
+        self._rule_to_strategy = FlatRuleDict(self.strategies)
+        self._eqv_rule_to_strategy = FlatRuleDict(self.strategies)
+        self._label_rows = LinkedLists()
+        self._child_rows = LinkedLists()
+        self._rows_indexed = 0
+
+    @property
+    def rule_to_strategy(self) -> FlatRuleDict:
+        return self._rule_to_strategy
+
+    @property
+    def eqv_rule_to_strategy(self) -> FlatRuleDict:
+        return self._eqv_rule_to_strategy
+
+    def _add_rule_key(
+        self, start: int, ends: Tuple[int, ...], strategy: AbstractStrategy
+    ) -> None:
+        # A new rule is in a new row, so it is indexed at the next update.
+        self.rule_to_strategy[(start, ends)] = strategy
+
+    def _label_ends(self, label: int) -> Iterator[Tuple[int, ...]]:
+        rules = self.rule_to_strategy
+        return (rules.ends(row) for row in self._label_rows[label])
+
+    def _label_parent_labels(self, label: int) -> Iterator[int]:
+        parents = self.rule_to_strategy.parents
+        return (parents[row] for row in self._child_rows[label])
+
+    def _index_pending_rules(self) -> Iterator[RuleKey]:
+        rules = self.rule_to_strategy
+        while self._rows_indexed < len(rules.parents):
+            row = self._rows_indexed
+            self._rows_indexed += 1
+            start, ends = rules.parents[row], rules.ends(row)
+            for label in {start, *ends}:
+                if not (
+                    _has_entries(self._label_rows, label)
+                    or _has_entries(self._child_rows, label)
+                ):
+                    self._eqv_members[self.equivdb[label]].append(label)
+            self._label_rows.append(start, row)
+            for end in set(ends):
+                self._child_rows.append(end, row)
+            yield start, ends
+
+    def _index_rule(self, start: int, ends: Tuple[int, ...], two_way: bool) -> None:
+        """The rules up to equivalence are found from the rows of each label."""
+
+    def _unindex_rule(self, start: int, ends: Tuple[int, ...]) -> None:
+        """The rows deleted are skipped when looking for rules."""
+
+    def _rows_up_to_equivalence(
+        self, eqv_rules: Set[RuleKey]
+    ) -> Dict[RuleKey, List[int]]:
+        """
+        Return the rows of the combinatorial rules, not deleted, that are the
+        equivalence rules. Only the rules of the equivalence class of their
+        parents and those not indexed yet are visited.
+        """
+        self._apply_merges()
+        rules = self.rule_to_strategy
+        eqv_starts = {self.equivdb[eqv_start] for eqv_start, _ in eqv_rules}
+        rows = itertools.chain(
+            (
+                row
+                for eqv_start in eqv_starts
+                for label in self._eqv_members.get(eqv_start, ())
+                for row in self._label_rows[label]
+            ),
+            range(self._rows_indexed, len(rules.parents)),
+        )
+        res: Dict[RuleKey, List[int]] = defaultdict(list)
+        for row in rows:
+            if rules.is_deleted(row):
+                continue
+            eqv_key = self._eqv_key(rules.parents[row], rules.ends(row))
+            if eqv_key in eqv_rules:
+                res[eqv_key].append(row)
+        return res
+
+    def rule_from_equivalence_rule(
+        self, eqv_start: int, eqv_ends: Iterable[int]
+    ) -> Optional[Tuple[int, Tuple[int, ...]]]:
+        eqv_key = self._eqv_key(eqv_start, eqv_ends)
+        rows = self._rows_up_to_equivalence({eqv_key}).get(eqv_key)
+        if rows:
+            row = min(rows)
+            return self.rule_to_strategy.parents[row], self.rule_to_strategy.ends(row)
+        for start, ends in self.eqv_rule_to_strategy:
+            if self._eqv_key(start, ends) == eqv_key:
+                return start, ends
+        return None
+
+    def rule_from_equivalence_rule_dict(
+        self, eqv_rules: Iterable[RuleKey]
+    ) -> Dict[RuleKey, RuleKey]:
+        rules = self.rule_to_strategy
+        return {
+            eqv_key: (rules.parents[max(rows)], rules.ends(max(rows)))
+            for eqv_key, rows in self._rows_up_to_equivalence(set(eqv_rules)).items()
+        }
+
+    def _index_nbytes(self) -> int:
+        """Return the number of bytes used by the indices of the rules by label."""
+        nbytes = sum(
+            column.itemsize * len(column)
+            for lists in (self._label_rows, self._child_rows)
+            for column in (lists.head, lists.tail, lists.values, lists.next)
+        )
+        return nbytes + _deep_sizeof((self._eqv_members, self._productive))
+
+    def status(self, elaborate: bool) -> str:
+        status = super().status(elaborate)
+        columns = self.rule_to_strategy.nbytes() + self.eqv_rule_to_strategy.nbytes()
+        indices = self._index_nbytes()
+        rules = len(self.rule_to_strategy) + len(self.eqv_rule_to_strategy)
+        status += (
+            f"\tRules stored in {size_to_readable(columns)} of columns and "
+            f"{size_to_readable(indices)} of indices by label, "
+            f"{(columns + indices) / max(rules, 1):.1f} bytes per rule, "
+            f"with {len(self.strategies):,d} distinct strategies.\n"
+        )
+        return status
+
+
+def _has_entries(lists: LinkedLists, label: int) -> bool:
+    """Return True if the list of the label is not empty."""
+    return label < len(lists.head) and lists.head[label] != -1
+
+
+def _deep_sizeof(obj: Any) -> int:
+    """
+    Return the number of bytes used by the object and the objects in it,
+    following the items of dicts, lists, tuples and sets and counting each
+    object once.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+    return total
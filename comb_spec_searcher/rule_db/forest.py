@@ -1,9 +1,13 @@
+# pylint: disable=too-many-lines
 import gc
 import itertools
 import platform
 import time
+from array import array
+from collections import defaultdict
 from datetime import timedelta
 from typing import (
+    Any,
     Callable,
     Deque,
     Dict,
@@ -40,8 +44,26 @@ from comb_spec_searcher.typing import CSSstrategy, ForestRuleKey, RuleBucket, Ru
 T = TypeVar("T")
 RuleWithShifts = Tuple[RuleKey, Tuple[int, ...]]
 SortedRWS = Dict[RuleBucket, List[ForestRuleKey]]
+Undo = Tuple[Any, ...]
 empty_strategy: EmptyStrategy = EmptyStrategy()
 
+# The kind of each change of the undo log of a TableMethod, given as its first entry
+(
+    UNDO_LENGTH,
+    UNDO_VALUE,
+    UNDO_RULE,
+    UNDO_GAP,
+    UNDO_APPEND,
+    UNDO_CLEAR,
+    UNDO_SHIFT,
+) = range(7)
+
+# The shift of a rule for a child that is infinite
+INFINITY = 1 << 62
+# The bits used for the index of the child in the lists of rules using a class
+CHILD_BITS = 16
+CHILD_MASK = (1 << CHILD_BITS) - 1
+
 
 class DefaultList(Generic[T]):
     """
@@ -80,6 +102,80 @@ class DefaultList(Generic[T]):
         return str(self._list)
 
 
+class ZeroRuns:
+    """
+    A segment tree over a sequence of natural numbers, followed by infinitely
+    many zeros, to find the first run of zeros of a given length.
+
+    Each node keeps, for the values below it, the length of the run of zeros
+    at the start, the one at the end and the longest one.
+    """
+
+    def __init__(self) -> None:
+        self._size = 1
+        self._prefix = array("q", [1, 1])
+        self._suffix = array("q", [1, 1])
+        self._longest = array("q", [1, 1])
+
+    def set_zero(self, pos: int, is_zero: bool) -> None:
+        """Record whether the value at the given position is zero."""
+        while pos >= self._size:
+            self._grow()
+        node = self._size + pos
+        self._prefix[node] = self._suffix[node] = self._longest[node] = int(is_zero)
+        width = 1
+        while node > 1:
+            node >>= 1
+            self._combine(node, width)
+            width <<= 1
+
+    def _combine(self, node: int, width: int) -> None:
+        """Compute the node from its children, that have the given width."""
+        left, right = 2 * node, 2 * node + 1
+        prefix, suffix = self._prefix, self._suffix
+        prefix[node] = prefix[left]
+        if prefix[left] == width:
+            prefix[node] += prefix[right]
+        suffix[node] = suffix[right]
+        if suffix[right] == width:
+            suffix[node] += suffix[left]
+        self._longest[node] = max(
+            self._longest[left], self._longest[right], suffix[left] + prefix[right]
+        )
+
+    def _grow(self) -> None:
+        """Double the number of leaves, the new ones being zeros."""
+        leaves = self._prefix[self._size :] + array("q", [1]) * self._size
+        self._size = size = 2 * self._size
+        self._prefix = array("q", [0]) * size + leaves
+        self._suffix = array("q", [0]) * size + leaves
+        self._longest = array("q", [0]) * size + leaves
+        width = 1
+        start = size
+        while start > 1:
+            start >>= 1
+            for node in range(start, 2 * start):
+                self._combine(node, width)
+            width <<= 1
+
+    def first_run(self, length: int) -> int:
+        """Return the position of the first run of at least length zeros."""
+        if self._longest[1] < length:
+            return self._size - self._suffix[1]
+        node, start, width = 1, 0, self._size
+        while node < self._size:
+            width >>= 1
+            left = 2 * node
+            if self._longest[left] >= length:
+                node = left
+            elif self._suffix[left] + self._prefix[left + 1] >= length:
+                return start + width - self._suffix[left]
+            else:
+                node = left + 1
+                start += width
+        return start
+
+
 class Function:
     """
     A python representation of a function.
@@ -88,12 +184,30 @@ class Function:
     by the use of None)
 
     The default value of the function is 0.
+
+    The changes are recorded in the undo log if it is set, so that they can be
+    reverted with `undo`. The keys whose value is increased are added to
+    `changed` if it is set.
     """
 
+    undo_log: Optional[List[Undo]] = None
+    changed: Optional[Set[int]] = None
+
     def __init__(self) -> None:
         self._value: List[Optional[int]] = []
         self._preimage_count: DefaultList[int] = DefaultList(int)
-        self._infinity_count: int = 0
+        self._zero_runs = ZeroRuns()
+        self._infinite: Set[int] = set()
+
+    def __setstate__(self, state: dict) -> None:
+        """Build the indices of a function pickled before they existed."""
+        self.__dict__.update(state)
+        if "_zero_runs" not in state:
+            self._zero_runs = ZeroRuns()
+            for value, count in enumerate(self._preimage_count):
+                self._zero_runs.set_zero(value, count == 0)
+            self._infinite = {k for k, v in enumerate(self._value) if v is None}
+            del self.__dict__["_infinity_count"]
 
     @property
     def preimage_count(self) -> List[int]:
@@ -107,7 +221,7 @@ class Function:
 
     @property
     def infinity_count(self) -> int:
-        return self._infinity_count
+        return len(self._infinite)
 
     def __getitem__(self, key: int) -> Optional[int]:
         """
@@ -120,9 +234,11 @@ class Function:
             return 0
 
     def _increase_list_len(self, key: int) -> None:
+        if self.undo_log is not None:
+            self.undo_log.append((UNDO_LENGTH, len(self._value)))
         num_new_entry = key - len(self._value) + 1
         self._value.extend((0 for _ in range(num_new_entry)))
-        self._preimage_count[0] += num_new_entry
+        self._change_count(0, num_new_entry)
 
     def increase_value(self, key: int) -> None:
         """
@@ -135,9 +251,13 @@ class Function:
         except IndexError:
             self._increase_list_len(key)
             old_value = 0
+        if self.undo_log is not None:
+            self.undo_log.append((UNDO_VALUE, key, old_value))
+        if self.changed is not None:
+            self.changed.add(key)
         self._value[key] = old_value + 1
-        self._preimage_count[old_value] -= 1
-        self._preimage_count[old_value + 1] += 1
+        self._change_count(old_value, -1)
+        self._change_count(old_value + 1, 1)
 
     def set_infinite(self, key: int) -> None:
         """
@@ -150,9 +270,36 @@ class Function:
         except IndexError:
             self._increase_list_len(key)
             old_value = 0
+        if self.undo_log is not None:
+            self.undo_log.append((UNDO_VALUE, key, old_value))
+        if self.changed is not None:
+            self.changed.add(key)
         self._value[key] = None
-        self._preimage_count[old_value] -= 1
-        self._infinity_count += 1
+        self._change_count(old_value, -1)
+        self._infinite.add(key)
+
+    def undo(self, change: Undo) -> None:
+        """Revert a change recorded in the undo log."""
+        if change[0] == UNDO_LENGTH:
+            length = change[1]
+            self._change_count(0, length - len(self._value))
+            del self._value[length:]
+            return
+        _, key, old_value = change
+        value = self._value[key]
+        if value is None:
+            self._infinite.remove(key)
+        else:
+            self._change_count(value, -1)
+        self._change_count(old_value, 1)
+        self._value[key] = old_value
+
+    def _change_count(self, value: int, change: int) -> None:
+        """Change the size of the preimage of the value."""
+        count = self._preimage_count[value]
+        self._preimage_count[value] = count + change
+        if (count == 0) != (count + change == 0):
+            self._zero_runs.set_zero(value, count != 0)
 
     def preimage_gap(self, length: int) -> int:
         """
@@ -161,13 +308,7 @@ class Function:
         """
         if length <= 0:
             raise ValueError("length argument must be positive")
-        last_non_zero = -1
-        for i, v in enumerate(self._preimage_count):
-            if v != 0:
-                last_non_zero = i
-            elif i - last_non_zero >= length:
-                return last_non_zero + 1
-        return last_non_zero + 1
+        return self._zero_runs.first_run(length)
 
     def preimage(self, value: Optional[int]) -> Iterator[int]:
         """
@@ -175,6 +316,8 @@ class Function:
         """
         if value == 0:
             raise ValueError("The preimage of 0 is infinite.")
+        if value is None:
+            return iter(self._infinite)
         return (k for k, v in enumerate(self._value) if v == value)
 
     def to_dict(self) -> Dict[int, Optional[int]]:
@@ -190,18 +333,112 @@ class Function:
         return "\n".join(parts)
 
 
+class LinkedLists:
+    """
+    Lists of integers, one for each label, stored in arrays.
+
+    The entries of all the lists are in `values` in the order they were
+    appended, with `next` giving the position of the next entry in the same
+    list, or -1 for the last one. A list is cleared by forgetting its head,
+    its entries staying in the arrays.
+    """
+
+    def __init__(self) -> None:
+        self.head = array("q")
+        self.tail = array("q")
+        self.values = array("q")
+        self.next = array("q")
+
+    def __getitem__(self, label: int) -> Iterator[int]:
+        pos = self.head[label] if label < len(self.head) else -1
+        while pos != -1:
+            yield self.values[pos]
+            pos = self.next[pos]
+
+    def append(self, label: int, value: int) -> int:
+        """Append the value to the list of the label and return the old tail."""
+        missing = label + 1 - len(self.head)
+        if missing > 0:
+            self.head.extend(itertools.repeat(-1, missing))
+            self.tail.extend(itertools.repeat(-1, missing))
+        pos = len(self.values)
+        self.values.append(value)
+        self.next.append(-1)
+        tail = self.tail[label]
+        if tail == -1:
+            self.head[label] = pos
+        else:
+            self.next[tail] = pos
+        self.tail[label] = pos
+        return tail
+
+    def pop(self, label: int, tail: int) -> None:
+        """Remove the last entry appended, to the list of the label."""
+        self.values.pop()
+        self.next.pop()
+        self.tail[label] = tail
+        if tail == -1:
+            self.head[label] = -1
+        else:
+            self.next[tail] = -1
+
+    def clear(self, label: int) -> Tuple[int, int]:
+        """Empty the list of the label and return its old head and tail."""
+        if label >= len(self.head):
+            return -1, -1
+        old = self.head[label], self.tail[label]
+        self.head[label] = self.tail[label] = -1
+        return old
+
+    def restore(self, label: int, head: int, tail: int) -> None:
+        """Give back to the label the list cleared."""
+        if label < len(self.head):
+            self.head[label], self.tail[label] = head, tail
+
+
 class TableMethod:
+    """
+    Compute the classes that are pumping in the universe given by the rules
+    added.
+
+    The rules are stored in arrays, as a sparse matrix in CSR format: the rule
+    i is `parents[i] -> children[offsets[i]:offsets[i + 1]]`, with the shifts
+    it was added with and its current shifts at the same positions, an
+    infinite shift being INFINITY. The rules pumping each class and the rules
+    using each class to pump, given as `rule_idx << CHILD_BITS | child_idx`,
+    are linked lists in arrays. A rule whose parent is infinite is skipped
+    rather than removed from the lists using its children.
+
+    Once `checkpoint` is called, every change is recorded in an undo log so
+    that the rules added after a checkpoint can be removed with `rollback`.
+    """
+
+    _undo_log: Optional[List[Undo]] = None
+
     def __init__(self) -> None:
-        self._rules: List[ForestRuleKey] = []
-        self._shifts: List[List[Optional[int]]] = []
+        self._parents = array("q")
+        self._buckets = array("b")
+        self._offsets = array("q", [0])
+        self._children = array("q")
+        self._key_shifts = array("q")
+        self._shifts = array("q")
         self._function: Function = Function()
         self._gap_size: int = 1
-        self._rules_using_class: DefaultList[List[Tuple[int, int]]] = DefaultList(list)
-        self._rules_pumping_class: DefaultList[List[int]] = DefaultList(list)
+        self._rules_using_class = LinkedLists()
+        self._rules_pumping_class = LinkedLists()
         self._processing_queue: Deque[int] = Deque()
         self._current_gap: Tuple[int, int] = (1, 1)
         self._rule_holding_extra_terms: Set[int] = set()
 
+    def __setstate__(self, state: dict) -> None:
+        """Add again the rules of a table pickled before the rules were arrays."""
+        if "_rules" not in state:
+            self.__dict__.update(state)
+            return
+        self.__init__()  # type: ignore
+        for rule_key in state["_rules"]:
+            self.add_rule_key(rule_key)
+
     @property
     def function(self) -> Dict[int, Optional[int]]:
         """
@@ -225,21 +462,100 @@ class TableMethod:
           about any of the classes.
           - `rule_bucket` the type of rule
         """
-        self._rules.append(rule_key)
-        self._shifts.append(self._compute_shift(rule_key.key, rule_key.shifts))
+        assert len(rule_key.children) <= CHILD_MASK, "Too many children"
+        if self._undo_log is not None:
+            self._undo_log.append((UNDO_RULE,))
+            self._undo_log.append((UNDO_GAP, self._gap_size, self._current_gap))
+        rule_idx = len(self._parents)
+        self._parents.append(rule_key.parent)
+        self._buckets.append(rule_key.bucket.value)
+        self._children.extend(rule_key.children)
+        self._key_shifts.extend(rule_key.shifts)
+        self._offsets.append(len(self._children))
+        self._compute_shift(rule_key)
         max_gap = max((abs(s) for s in rule_key.shifts), default=0)
         if max_gap > self._gap_size:
             self._gap_size = max_gap
             self._correct_gap()
         if self._function[rule_key.parent] is not None:
-            rule_idx = len(self._rules) - 1
-            self._rules_pumping_class[rule_key.parent].append(rule_idx)
+            self._append(self._rules_pumping_class, rule_key.parent, rule_idx)
             for child_idx, child in enumerate(rule_key.children):
                 if self._function[child] is not None:
-                    self._rules_using_class[child].append((rule_idx, child_idx))
+                    self._append(
+                        self._rules_using_class,
+                        child,
+                        rule_idx << CHILD_BITS | child_idx,
+                    )
             self._processing_queue.append(rule_idx)
         self._process_queue()
 
+    def checkpoint(self) -> int:
+        """
+        Return a checkpoint of the current state, to which the table can be
+        brought back with `rollback`.
+        """
+        assert not self._processing_queue and not self._rule_holding_extra_terms
+        if self._undo_log is None:
+            self._undo_log = []
+            self._function.undo_log = self._undo_log
+        return len(self._undo_log)
+
+    def rollback(self, checkpoint: int) -> None:
+        """
+        Bring the table back to the state it was in at the checkpoint, removing
+        the rules added since.
+        """
+        assert self._undo_log is not None, "No checkpoint was made"
+        log = self._undo_log
+        while len(log) > checkpoint:
+            change = log.pop()
+            kind = change[0]
+            if kind in (UNDO_LENGTH, UNDO_VALUE):
+                self._function.undo(change)
+            elif kind == UNDO_RULE:
+                start = self._offsets[-2]
+                self._parents.pop()
+                self._buckets.pop()
+                self._offsets.pop()
+                del self._children[start:]
+                del self._key_shifts[start:]
+                del self._shifts[start:]
+            elif kind == UNDO_GAP:
+                self._gap_size, self._current_gap = change[1], change[2]
+            elif kind == UNDO_APPEND:
+                change[1].pop(change[2], change[3])
+            elif kind == UNDO_CLEAR:
+                change[1].restore(change[2], change[3], change[4])
+            else:
+                self._shifts[change[1]] = change[2]
+
+    def _append(self, lists: LinkedLists, label: int, value: int) -> None:
+        """Append the value to the list of the label."""
+        tail = lists.append(label, value)
+        if self._undo_log is not None:
+            self._undo_log.append((UNDO_APPEND, lists, label, tail))
+
+    def _clear(self, lists: LinkedLists, label: int) -> None:
+        """Empty the list of the label."""
+        head, tail = lists.clear(label)
+        if self._undo_log is not None:
+            self._undo_log.append((UNDO_CLEAR, lists, label, head, tail))
+
+    def _set_shift(self, pos: int, value: int) -> None:
+        """Set the shift at the given position of the shifts array."""
+        if self._undo_log is not None:
+            self._undo_log.append((UNDO_SHIFT, pos, self._shifts[pos]))
+        self._shifts[pos] = value
+
+    def _rule_key(self, rule_idx: int) -> ForestRuleKey:
+        start, end = self._offsets[rule_idx], self._offsets[rule_idx + 1]
+        return ForestRuleKey(
+            self._parents[rule_idx],
+            tuple(self._children[start:end]),
+            tuple(self._key_shifts[start:end]),
+            RuleBucket(self._buckets[rule_idx]),
+        )
+
     def is_pumping(self, label: int) -> bool:
         """
         Determine if the comb_class is pumping in the current universe.
@@ -252,6 +568,35 @@ class TableMethod:
         s += f"\tSizes of the pre-images: {self._function.preimage_count}\n"
         return s
 
+    def blocking_child(self, rule_key: ForestRuleKey) -> Optional[int]:
+        """
+        Return a child whose value keeps the rule from increasing the value of
+        its parent if it was added, or None if there is none. The parent must
+        not be pumping.
+        """
+        parent_value = self._function[rule_key.parent]
+        assert parent_value is not None, "The parent is pumping"
+        for child, sfz in zip(rule_key.children, rule_key.shifts):
+            value = self._function[child]
+            if value is not None and value + sfz <= parent_value:
+                return child
+        return None
+
+    def track_changes(self) -> None:
+        """Start recording the classes whose value changes, see `changed`."""
+        if self._function.changed is None:
+            self._function.changed = set()
+
+    def changed(self) -> Set[int]:
+        """
+        Return the classes whose value changed since the last call, or since
+        `track_changes` was called.
+        """
+        changed = self._function.changed
+        assert changed is not None, "The changes are not tracked"
+        self._function.changed = set()
+        return changed
+
     def stable_subset(self) -> Iterator[int]:
         return self._function.preimage(None)
 
@@ -263,29 +608,25 @@ class TableMethod:
         combinatorial classes.
         """
         stable_subset = set(self.stable_subset())
-        for forest_key in self._rules:
-            if forest_key.parent in stable_subset and stable_subset.issuperset(
-                forest_key.children
+        for rule_idx, parent in enumerate(self._parents):
+            start, end = self._offsets[rule_idx], self._offsets[rule_idx + 1]
+            if parent in stable_subset and stable_subset.issuperset(
+                self._children[start:end]
             ):
-                yield forest_key
+                yield self._rule_key(rule_idx)
 
-    def _compute_shift(
-        self,
-        rule_key: RuleKey,
-        shifts_for_zero: Tuple[int, ...],
-    ) -> List[Optional[int]]:
-        """
-        Compute the initial value for the shifts a rule based on the current state of
-        the function.
-        """
-        parent_current_value = self._function[rule_key[0]]
-        if parent_current_value is None:
-            return [None for _ in shifts_for_zero]
-        chidlren_function_value = map(self._function.__getitem__, rule_key[1])
-        return [
-            fvalue + sfz - parent_current_value if fvalue is not None else None
-            for fvalue, sfz in zip(chidlren_function_value, shifts_for_zero)
-        ]
+    def _compute_shift(self, rule_key: ForestRuleKey) -> None:
+        """
+        Append the initial value for the shifts of a rule based on the current
+        state of the function.
+        """
+        parent_current_value = self._function[rule_key.parent]
+        for child, sfz in zip(rule_key.children, rule_key.shifts):
+            fvalue = self._function[child]
+            if parent_current_value is None or fvalue is None:
+                self._shifts.append(INFINITY)
+            else:
+                self._shifts.append(fvalue + sfz - parent_current_value)
 
     def _correct_gap(self) -> None:
         """
@@ -297,6 +638,8 @@ class TableMethod:
         """
         k = self._function.preimage_gap(self._gap_size)
         new_gap = (k, k + self._gap_size - 1)
+        if self._undo_log is not None:
+            self._undo_log.append((UNDO_GAP, self._gap_size, self._current_gap))
         if new_gap[1] > self._current_gap[1]:
             self._processing_queue.extend(self._rule_holding_extra_terms)
             self._rule_holding_extra_terms.clear()
@@ -309,21 +652,28 @@ class TableMethod:
         while self._processing_queue or self._rule_holding_extra_terms:
             while self._processing_queue:
                 rule_idx = self._processing_queue.popleft()
-                shifts = self._shifts[rule_idx]
-                if self._can_give_terms(shifts):
-                    parent = self._rules[rule_idx].parent
+                if self._can_give_terms(rule_idx):
+                    parent = self._parents[rule_idx]
                     self._increase_value(parent, rule_idx)
             if self._rule_holding_extra_terms:
                 rule_idx = self._rule_holding_extra_terms.pop()
-                parent = self._rules[rule_idx].parent
+                parent = self._parents[rule_idx]
                 self._set_infinite(parent)
 
-    @staticmethod
-    def _can_give_terms(shifts: List[Optional[int]]) -> bool:
+    def _can_give_terms(self, rule_idx: int) -> bool:
         """
-        Return True if the shifts indicate that a new terms can be computed.
+        Return True if the shifts of the rule indicate that a new terms can be
+        computed.
         """
-        return all(s is None or s > 0 for s in shifts)
+        shifts = self._shifts
+        for pos in range(self._offsets[rule_idx], self._offsets[rule_idx + 1]):
+            if shifts[pos] <= 0:
+                return False
+        return True
+
+    def _is_pumping_rule(self, rule_idx: int) -> bool:
+        """Return True if the parent of the rule can still be increased."""
+        return self._function[self._parents[rule_idx]] is not None
 
     def _increase_value(self, comb_class: int, rule_idx: int) -> None:
         """
@@ -343,20 +693,23 @@ class TableMethod:
         gap_start = self._function.preimage_gap(self._gap_size)
         if self._current_gap[0] != gap_start:
             self._correct_gap()
+        shifts = self._shifts
         # Correction of the shifts for rule pumping comb_class
         for r_idx in self._rules_pumping_class[comb_class]:
-            shifts = self._shifts[r_idx]
-            for i, v in enumerate(shifts):
-                shifts[i] = v - 1 if v is not None else None
-            if self._can_give_terms(shifts):
+            for pos in range(self._offsets[r_idx], self._offsets[r_idx + 1]):
+                if shifts[pos] != INFINITY:
+                    self._set_shift(pos, shifts[pos] - 1)
+            if self._can_give_terms(r_idx):
                 self._processing_queue.append(r_idx)
         # Correction of the shifts for rules using comb_class to pump
-        for r_idx, class_idx in self._rules_using_class[comb_class]:
-            shifts = self._shifts[r_idx]
-            current_shift = shifts[class_idx]
-            assert current_shift is not None
-            shifts[class_idx] = current_shift + 1
-            if self._can_give_terms(shifts):
+        for entry in self._rules_using_class[comb_class]:
+            r_idx = entry >> CHILD_BITS
+            if not self._is_pumping_rule(r_idx):
+                continue
+            pos = self._offsets[r_idx] + (entry & CHILD_MASK)
+            assert shifts[pos] != INFINITY
+            self._set_shift(pos, shifts[pos] + 1)
+            if self._can_give_terms(r_idx):
                 self._processing_queue.append(r_idx)
 
     def _set_infinite(self, comb_class: int) -> None:
@@ -372,24 +725,18 @@ class TableMethod:
         assert current_value > self._current_gap[1]
         assert not self._processing_queue
         self._function.set_infinite(comb_class)
-        # This class will never be increased again so we remove any occurrence
-        # of the rule of any rule for that class from _rules_using_class and
-        # _rules_pumping_class
-        for rule_idx in self._rules_pumping_class[comb_class]:
-            for child in self._rules[rule_idx].children:
-                self._rules_using_class[child] = [
-                    (ri, ci)
-                    for ri, ci in self._rules_using_class[child]
-                    if ri != rule_idx
-                ]
-        self._rules_pumping_class[comb_class].clear()
+        # This class will never be increased again so the rules for that class
+        # are skipped from now on in the lists of rules using their children.
+        self._clear(self._rules_pumping_class, comb_class)
         # Correction of the shifts for rules using comb_class to pump
-        for rule_idx, class_idx in self._rules_using_class[comb_class]:
-            shifts = self._shifts[rule_idx]
-            shifts[class_idx] = None
-            if self._can_give_terms(shifts):
-                self._processing_queue.append(rule_idx)
-        self._rules_using_class[comb_class].clear()
+        for entry in self._rules_using_class[comb_class]:
+            r_idx = entry >> CHILD_BITS
+            if not self._is_pumping_rule(r_idx):
+                continue
+            self._set_shift(self._offsets[r_idx] + (entry & CHILD_MASK), INFINITY)
+            if self._can_give_terms(r_idx):
+                self._processing_queue.append(r_idx)
+        self._clear(self._rules_using_class, comb_class)
 
     def rule_info(self, rule_idx: int) -> str:
         """
@@ -399,15 +746,16 @@ class TableMethod:
 
         def v_to_str(v: Optional[int]) -> str:
             """Return a string for the integer and infinity if None"""
-            if v is None:
+            if v is None or v == INFINITY:
                 return "∞"
             return str(v)
 
-        rule_key = self._rules[rule_idx]
+        rule_key = self._rule_key(rule_idx)
         current_value = f"{v_to_str(self._function[rule_key.parent])} -> " + ", ".join(
             map(v_to_str, (self._function[c] for c in rule_key.children))
         )
-        shifts = map(v_to_str, self._shifts[rule_idx])
+        start, end = self._offsets[rule_idx], self._offsets[rule_idx + 1]
+        shifts = map(v_to_str, self._shifts[start:end])
         child_with_shift = ", ".join(
             f"({c}, {s})" for c, s in zip(rule_key.children, shifts)
         )
@@ -499,21 +847,25 @@ class ForestRuleExtractor:
             rules for k, rules in self.rule_by_bucket.items() if k != key
         )
         minimizing = self.rule_by_bucket[key]
+        # The rules we are not trying to minimize are added once, and the rules
+        # added to find the one making the root productive are then removed.
+        tb = TableMethod()
+        for rk in itertools.chain.from_iterable(not_minimizing):
+            tb.add_rule_key(rk)
         while minimizing:
-            tb = TableMethod()
-            # Add the rule we are not trying to minimize
-            for rk in itertools.chain.from_iterable(not_minimizing):
-                tb.add_rule_key(rk)
             if tb.is_pumping(self.root_label):
                 minimizing.clear()
                 break
             # Add rule until it gets productive
+            checkpoint = tb.checkpoint()
             for i, rk in enumerate(minimizing):
                 tb.add_rule_key(rk)
                 if tb.is_pumping(self.root_label):
                     break
             else:
                 raise RuntimeError("Not pumping after adding all rules")
+            tb.rollback(checkpoint)
+            tb.add_rule_key(rk)
             maybe_useful.append(rk)
             assert minimizing, "variable i won't be set"
             # pylint: disable=undefined-loop-variable
@@ -522,11 +874,28 @@ class ForestRuleExtractor:
             # added to avoid doubling in memory when minimizing with pypy
             if platform.python_implementation() == "PyPy":
                 gc.collect_step()  # type: ignore
+        # The rules maybe useful are removed from the last one. A checkpoint is
+        # kept before adding each of them, and the rules found to be needed
+        # are added again after rolling back to it.
+        tb = TableMethod()
+        for rk in itertools.chain.from_iterable(
+            rules for rules in not_minimizing if rules is not maybe_useful
+        ):
+            tb.add_rule_key(rk)
+        checkpoints = []
+        for rk in maybe_useful:
+            checkpoints.append(tb.checkpoint())
+            tb.add_rule_key(rk)
+        needed: List[ForestRuleKey] = []
         counter = 0
         while maybe_useful:
             rk = maybe_useful.pop()
-            if not self._is_productive(itertools.chain.from_iterable(not_minimizing)):
+            tb.rollback(checkpoints.pop())
+            for needed_rk in needed:
+                tb.add_rule_key(needed_rk)
+            if not tb.is_pumping(self.root_label):
                 self.needed_rules.append(rk)
+                needed.append(rk)
                 counter += 1
             # added to avoid doubling in memory when minimizing with pypy
             if platform.python_implementation() == "PyPy":
@@ -616,23 +985,41 @@ class RuleDBForest(RuleDBAbstract):
     current rule in the database.
 
     Set `reverse` to prevent the reverse of the added rules to be added to the database.
+
+    Set `lazy_reverse` to keep the reverse rules aside and only add them to the
+    table method once they can increase the value of their parent. Each is kept
+    with a child whose value prevents it, and checked again when the value of
+    that child changes, so the classes pumping are the same as when they are
+    all added.
     """
 
     def __init__(
         self,
         *,
         reverse: bool = True,
+        lazy_reverse: bool = False,
         rule_cache: Iterable[AbstractRule] = tuple(),
     ) -> None:
         super().__init__()
         self.reverse = reverse
+        self.lazy_reverse = lazy_reverse
+        # The reverse rules set aside, by the child preventing them to be added
+        self._pending_reverse: Dict[int, List[ForestRuleKey]] = defaultdict(list)
         self._num_rules = 0
         self._time_table_method = 0.0
         self._time_key = 0.0
         self.table_method = TableMethod()
+        if lazy_reverse:
+            self.table_method.track_changes()
         self._already_empty: Set[int] = set()
         self._rule_cache = tuple(rule_cache)
 
+    def __setstate__(self, state: dict) -> None:
+        """Set the attributes missing from databases pickled before lazy_reverse."""
+        state.setdefault("lazy_reverse", False)
+        state.setdefault("_pending_reverse", defaultdict(list))
+        self.__dict__.update(state)
+
     # Implementation of RuleDBAbstract
 
     def status(self, elaborate: bool) -> str:
@@ -642,6 +1029,9 @@ class RuleDBForest(RuleDBAbstract):
         tm_time = timedelta(seconds=int(self._time_table_method))
         s += f"\tTime spent computing forest keys: {key_time}\n"
         s += f"\tTime spent running the table method: {tm_time}\n"
+        if self.lazy_reverse:
+            pending = sum(map(len, self._pending_reverse.values()))
+            s += f"\tReverse rules set aside: {pending}\n"
         s += self.table_method.status()
         return s
 
@@ -654,24 +1044,29 @@ class RuleDBForest(RuleDBAbstract):
     def has_specification(self) -> bool:
         return self.is_verified(self.root_label)
 
-    def add(self, start: int, ends: Tuple[int, ...], rule: AbstractRule) -> None:
+    def add(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule, hint: int = -1
+    ) -> None:
+        # pylint: disable=unused-argument
         self._add_empty_rule(ends, rule)
         self._num_rules += 1
         start_time = time.time()
-        new_rule_keys = [rule.forest_key(self.classdb.get_label, self.classdb.is_empty)]
-
+        get_label, is_empty = self._label_functions(start, ends, rule)
+        new_rule_keys = [rule.forest_key(get_label, is_empty)]
         if self.reverse and rule.is_reversible():
             assert isinstance(rule, Rule)
             new_rule_keys.extend(
-                rule.to_reverse_rule(i).forest_key(
-                    self.classdb.get_label, self.classdb.is_empty
-                )
+                rule.reverse_forest_key(i, get_label, is_empty)
                 for i in range(len(rule.children))
             )
         self._time_key += time.time() - start_time
         start_time = time.time()
-        for new_key in new_rule_keys:
-            self.table_method.add_rule_key(new_key)
+        if self.lazy_reverse:
+            self.table_method.add_rule_key(new_rule_keys[0])
+            self._set_aside(new_rule_keys[1:])
+        else:
+            for new_key in new_rule_keys:
+                self.table_method.add_rule_key(new_key)
         self._time_table_method += time.time() - start_time
 
     @ensure_specification
@@ -684,6 +1079,53 @@ class RuleDBForest(RuleDBAbstract):
 
     # Other methods
 
+    def _set_aside(self, rule_keys: Iterable[ForestRuleKey]) -> None:
+        """
+        Add to the table method the reverse rules that can increase the value of
+        their parent and keep the others aside with a child preventing it. The
+        rules kept with a class whose value changed, including through the
+        rules just added, are checked again until none is. The rules whose
+        parent is pumping are dropped.
+        """
+        table_method = self.table_method
+        stack = list(rule_keys)
+        while True:
+            while stack:
+                rule_key = stack.pop()
+                if table_method.is_pumping(rule_key.parent):
+                    continue
+                child = table_method.blocking_child(rule_key)
+                if child is None:
+                    table_method.add_rule_key(rule_key)
+                else:
+                    self._pending_reverse[child].append(rule_key)
+            for label in table_method.changed():
+                stack.extend(self._pending_reverse.pop(label, ()))
+            if not stack:
+                return
+
+    def _label_functions(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule
+    ) -> Tuple[Callable[[Any], int], Callable[[Any], bool]]:
+        """
+        Return the functions giving the label and the emptiness of the classes
+        of the rule, using the labels given by the searcher rather than looking
+        the classes up in the class database.
+        """
+        labels = dict(zip(map(id, rule.children), ends))
+        labels[id(rule.comb_class)] = start
+
+        def get_label(comb_class: Any) -> int:
+            label = labels.get(id(comb_class))
+            if label is None:
+                return self.classdb.get_label(comb_class)
+            return label
+
+        def is_empty(comb_class: Any) -> bool:
+            return self.classdb.is_empty(comb_class, get_label(comb_class))
+
+        return get_label, is_empty
+
     def _add_empty_rule(self, ends: Iterable[int], rule: AbstractRule) -> None:
         """
         Add empty rule for the children of the rule if needed.
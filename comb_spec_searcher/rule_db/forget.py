@@ -7,11 +7,11 @@ The database do not store the strategy to save memory.
 import itertools
 from typing import (
     TYPE_CHECKING,
+    Dict,
     Iterable,
     Iterator,
     MutableMapping,
     Optional,
-    Set,
     Tuple,
     Union,
     cast,
@@ -22,7 +22,7 @@ from comb_spec_searcher.exception import StrategyDoesNotApply
 from comb_spec_searcher.strategies.rule import AbstractRule
 from comb_spec_searcher.strategies.strategy import AbstractStrategy, StrategyFactory
 from comb_spec_searcher.strategies.strategy_pack import StrategyPack
-from comb_spec_searcher.typing import RuleKey
+from comb_spec_searcher.typing import CombinatorialClassType, CSSstrategy, RuleKey
 
 from .base import RuleDBBase
 
@@ -42,6 +42,13 @@ class RecomputingDict(MutableMapping[RuleKey, AbstractStrategy]):
 
     Also in order to save memory we store flat version of the rules, i.e. for a rule
     (a, (b, c,...)) we store (a, b, c,...)
+
+    Each rule is stored with the hint given by the searcher when adding it,
+    i.e. the strategy of the pack, and for a factory the position of the
+    strategy it yields, that gave the rule when applied to the parent. The
+    strategy is recomputed by replaying the hint, and all the strategies of the
+    pack are only tried on all the classes of the rule if there is no hint or
+    it does not give the rule.
     """
 
     def __init__(
@@ -50,8 +57,18 @@ class RecomputingDict(MutableMapping[RuleKey, AbstractStrategy]):
     ) -> None:
         self._classdb: Optional[ClassDB] = None
         self._pack: Optional[StrategyPack] = None
-        self.rules: Set[Tuple[int, ...]] = set()
+        # The flat rules, each with the hint used to recompute its strategy
+        self.rules: Dict[Tuple[int, ...], int] = {}
         self.only_equiv: bool = only_equiv
+        # The parent and hint of the rule being added
+        self.adding: Tuple[int, int] = (-1, -1)
+
+    def __setstate__(self, state: dict) -> None:
+        """Give no hint to the rules pickled before the hints were stored."""
+        if isinstance(state["rules"], set):
+            state["rules"] = dict.fromkeys(state["rules"], -1)
+        state.setdefault("adding", (-1, -1))
+        self.__dict__.update(state)
 
     def link_searcher(self, classdb: ClassDB, strat_pack: StrategyPack) -> None:
         if self._classdb is not None or self._pack is not None:
@@ -80,8 +97,13 @@ class RecomputingDict(MutableMapping[RuleKey, AbstractStrategy]):
         return (tuple_[0], tuple_[1:])
 
     def __getitem__(self, key: RuleKey) -> AbstractStrategy:
-        if self._flatten(key) not in self.rules:
+        hint = self.rules.get(self._flatten(key))
+        if hint is None:
             raise KeyError(key)
+        if hint >= 0:
+            strategy = self._replay(key, hint)
+            if strategy is not None:
+                return strategy
         possible_labels = (key[0],) + key[1]
         for label, strat in itertools.product(possible_labels, self.pack):
             comb_class = self.classdb.get_class(label)
@@ -92,27 +114,9 @@ class RecomputingDict(MutableMapping[RuleKey, AbstractStrategy]):
             else:
                 strats_or_rules = [strat]
             for x in strats_or_rules:
-                if isinstance(x, AbstractStrategy):
-                    try:
-                        rule = x(comb_class)
-                    except StrategyDoesNotApply:
-                        continue
-                else:
-                    rule = x
-                try:
-                    start_label = self.classdb.get_label(rule.comb_class)
-                    nonempty_children = tuple(
-                        c for c in rule.children if not self.classdb.is_empty(c)
-                    )
-                    end_labels = tuple(
-                        sorted(map(self.classdb.get_label, nonempty_children))
-                    )
-                    if (start_label, end_labels) == key:
-                        if self.only_equiv and not rule.is_two_way():
-                            continue
-                        return rule.strategy
-                except StrategyDoesNotApply:
-                    pass
+                strategy = self._strategy_if_matching(key, comb_class, x)
+                if strategy is not None:
+                    return strategy
         err_message = (
             f"Could not recompute the strategy for the rule {key} with "
             " any of the strategies. Classes are:\n"
@@ -122,12 +126,64 @@ class RecomputingDict(MutableMapping[RuleKey, AbstractStrategy]):
             err_message += str(self.classdb.get_class(label)) + "\n"
         raise RuntimeError(err_message)
 
+    def _strategy_if_matching(
+        self,
+        key: RuleKey,
+        comb_class: CombinatorialClassType,
+        strat_or_rule: Union[AbstractRule, AbstractStrategy],
+    ) -> Optional[AbstractStrategy]:
+        """
+        Return the strategy of the rule given by the strategy or rule applied
+        to the class if it is the rule key, and None otherwise.
+        """
+        if isinstance(strat_or_rule, AbstractStrategy):
+            try:
+                rule = strat_or_rule(comb_class)
+            except StrategyDoesNotApply:
+                return None
+        else:
+            rule = strat_or_rule
+        try:
+            start_label = self.classdb.get_label(rule.comb_class)
+            nonempty_children = tuple(
+                c for c in rule.children if not self.classdb.is_empty(c)
+            )
+            end_labels = tuple(sorted(map(self.classdb.get_label, nonempty_children)))
+        except StrategyDoesNotApply:
+            return None
+        if (start_label, end_labels) != key:
+            return None
+        if self.only_equiv and not rule.is_two_way():
+            return None
+        return rule.strategy
+
+    def _replay(self, key: RuleKey, hint: int) -> Optional[AbstractStrategy]:
+        """
+        Return the strategy of the rule recomputed from its hint, or None if
+        the hint does not give the rule.
+        """
+        strategies = list(self.pack)
+        idx, ordinal = hint % len(strategies), hint // len(strategies) - 1
+        comb_class = self.classdb.get_class(key[0])
+        strat: CSSstrategy = strategies[idx]
+        x: Optional[Union[AbstractRule, AbstractStrategy]] = None
+        if ordinal < 0 and isinstance(strat, AbstractStrategy):
+            x = strat
+        elif ordinal >= 0 and isinstance(strat, StrategyFactory):
+            x = next(itertools.islice(strat(comb_class), ordinal, None), None)
+        if x is None:
+            return None
+        return self._strategy_if_matching(key, comb_class, x)
+
     def __setitem__(self, key: RuleKey, value: AbstractStrategy) -> None:
         assert not self.only_equiv or len(key[1]) == 1
-        self.rules.add(self._flatten(key))
+        flat_key = self._flatten(key)
+        if flat_key not in self.rules:
+            start, hint = self.adding
+            self.rules[flat_key] = hint if key[0] == start else -1
 
     def __delitem__(self, key: RuleKey) -> None:
-        self.rules.remove(self._flatten(key))
+        del self.rules[self._flatten(key)]
 
     def __iter__(self) -> Iterator[RuleKey]:
         for rule in self.rules:
@@ -153,6 +209,18 @@ class RuleDBForgetStrategy(RuleDBBase):
         self.rule_to_strategy.link_searcher(classdb, strat_pack)
         self.eqv_rule_to_strategy.link_searcher(classdb, strat_pack)
 
+    def add(
+        self, start: int, ends: Tuple[int, ...], rule: AbstractRule, hint: int = -1
+    ) -> None:
+        """Add the rule, storing the hint with it rather than its strategy."""
+        for rdict in (self.rule_to_strategy, self.eqv_rule_to_strategy):
+            rdict.adding = (start, hint)
+        try:
+            super().add(start, ends, rule, hint)
+        finally:
+            for rdict in (self.rule_to_strategy, self.eqv_rule_to_strategy):
+                rdict.adding = (-1, -1)
+
     @property
     def rule_to_strategy(self) -> RecomputingDict:
         return self._rule_to_strategy
@@ -153,28 +153,18 @@ class PartialSpecificationRuleExtractor(SpecificationRuleExtractor):
         self,
     ) -> Tuple[Dict[RuleKey, RuleKey], Dict[RuleKey, Tuple[int, ...]]]:
         """Altered version of rule_from_equivalence_rule_dict that deals with order."""
-        eqv_rules = set(self.eqv_rulekeys)
-        eqvrule_to_rule: Dict[RuleKey, RuleKey] = {}
+        eqvrule_to_rule = self.ruledb.rule_from_equivalence_rule_dict(self.eqv_rulekeys)
         # Maps our children index order to that of the actual rules
         index_order_map: Dict[RuleKey, Tuple[int, ...]] = {}
-        for start, ends in self.ruledb.rule_to_strategy:
-            eqv_start = self.ruledb.equivdb[start]
+        for eqv_key, (_, ends) in eqvrule_to_rule.items():
             # Sort but keep knowledge of original order
-            index_order, eqv_ends = (
-                zip(
-                    *sorted(
-                        enumerate(map(self.ruledb.equivdb.__getitem__, ends)),
-                        key=itemgetter(1),
-                    )
+            index_order_map[eqv_key] = tuple(
+                idx
+                for idx, _ in sorted(
+                    enumerate(map(self.ruledb.equivdb.__getitem__, ends)),
+                    key=itemgetter(1),
                 )
-                if ends
-                else ((), ())
             )
-
-            eqv_key = (eqv_start, eqv_ends)
-            index_order_map[eqv_key] = index_order
-            if eqv_key in eqv_rules:
-                eqvrule_to_rule[eqv_key] = (start, ends)
         return eqvrule_to_rule, index_order_map
 
 
@@ -491,6 +491,45 @@ class Rule(AbstractRule[CombinatorialClassType, CombinatorialObjectType]):
         assert self.is_reversible()
         return ReverseRule(self, idx)
 
+    def reverse_shifts(self, idx: int) -> Tuple[int, ...]:
+        """
+        Return the shifts of the reverse rule where the child at the given index
+        is the parent.
+        """
+        original_shifts = self.shifts()
+        pshift = -original_shifts[idx]
+        return (pshift,) + tuple(
+            s + pshift for s in (s for i, s in enumerate(original_shifts) if i != idx)
+        )
+
+    def reverse_forest_key(
+        self,
+        idx: int,
+        get_label: Callable[[CombinatorialClassType], int],
+        is_empty: Optional[Callable[[CombinatorialClassType], bool]] = None,
+    ) -> ForestRuleKey:
+        """
+        Return the forest key of the reverse rule where the child at the given
+        index is the parent. The reverse rule is only built when it could be an
+        equivalence, that is when only one of its children is non-empty.
+        """
+        assert self.is_reversible()
+        if is_empty is None:
+
+            def _is_empty(comb_class: CombinatorialClassType) -> bool:
+                return comb_class.is_empty()
+
+            is_empty = _is_empty
+        children = (self.comb_class, *self.children[:idx], *self.children[idx + 1 :])
+        if sum(not is_empty(child) for child in children) == 1:
+            return self.to_reverse_rule(idx).forest_key(get_label, is_empty)
+        return ForestRuleKey(
+            get_label(self.children[idx]),
+            tuple(map(get_label, children)),
+            self.reverse_shifts(idx),
+            RuleBucket.REVERSE,
+        )
+
     def _ensure_level(self, n: int) -> None:
         if self.subterms is None:
             raise RuntimeError("set_subrecs must be set first")
@@ -785,6 +824,14 @@ class EquivalenceRule(Rule[CombinatorialClassType, CombinatorialObjectType]):
         assert idx == 0
         return self.original_rule.to_reverse_rule(self.child_idx).to_equivalence_rule()
 
+    def reverse_forest_key(
+        self,
+        idx: int,
+        get_label: Callable[[CombinatorialClassType], int],
+        is_empty: Optional[Callable[[CombinatorialClassType], bool]] = None,
+    ) -> ForestRuleKey:
+        return self.to_reverse_rule(idx).forest_key(get_label, is_empty)
+
     def to_equivalence_rule(self) -> "EquivalenceRule":
         raise NotImplementedError("You don't want to do that! I promise")
 
@@ -909,6 +956,14 @@ class EquivalencePathRule(Rule[CombinatorialClassType, CombinatorialObjectType])
     def to_reverse_rule(self, idx: int) -> "Rule":
         raise NotImplementedError("You don't want to do that! I promise")
 
+    def reverse_forest_key(
+        self,
+        idx: int,
+        get_label: Callable[[CombinatorialClassType], int],
+        is_empty: Optional[Callable[[CombinatorialClassType], bool]] = None,
+    ) -> ForestRuleKey:
+        raise NotImplementedError("You don't want to do that! I promise")
+
     def backward_map(
         self, objs: Tuple[Optional[CombinatorialObjectType], ...]
     ) -> Iterator[CombinatorialObjectType]:
@@ -1000,13 +1055,16 @@ class ReverseRule(Rule[CombinatorialClassType, CombinatorialObjectType]):
     def to_reverse_rule(self, idx: int) -> "Rule":
         raise NotImplementedError("You don't want to do that! I promise")
 
+    def reverse_forest_key(
+        self,
+        idx: int,
+        get_label: Callable[[CombinatorialClassType], int],
+        is_empty: Optional[Callable[[CombinatorialClassType], bool]] = None,
+    ) -> ForestRuleKey:
+        raise NotImplementedError("You don't want to do that! I promise")
+
     def shifts(self) -> Tuple[int, ...]:
-        original_shifts = self.original_rule.shifts()
-        pshift = -original_shifts[self.idx]
-        return (pshift,) + tuple(
-            s + pshift
-            for s in (s for i, s in enumerate(original_shifts) if i != self.idx)
-        )
+        return self.original_rule.reverse_shifts(self.idx)
 
     def forest_key(
         self,
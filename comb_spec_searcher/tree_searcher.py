@@ -4,10 +4,19 @@ Finds and returns a combinatorial specification, that we call a proof tree.
 
 import time
 from collections import defaultdict, deque
-from copy import deepcopy
 from itertools import chain, product
 from random import choice, shuffle
-from typing import Dict, FrozenSet, Iterator, List, Optional, Sequence, Set, Tuple
+from typing import (
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 from comb_spec_searcher.typing import RuleKey, RulesDict
 
@@ -71,39 +80,69 @@ def prune(rdict: RulesDict) -> None:
     """
     Prune all nodes not in a combinatorial specification. This changes rdict
     in place.
+
+    A label whose rule set is empty to begin with is kept, and so are the rules
+    using it. Only the labels losing all their rules are removed.
+
+    A reverse index from a label to the rules using it is built once, and the
+    removed labels are propagated through it, so each rule is visited a
+    bounded number of times.
     """
-    changed = True
-    while changed:
-        changed = False
-        for k, rule_set in list(rdict.items()):
-            for rule in list(rule_set):
-                if any(x not in rdict for x in rule):
-                    rule_set.remove(rule)
-                    changed = True
-                if not rule_set:
-                    del rdict[k]
+    parents: Dict[int, List[RuleKey]] = defaultdict(list)
+    for start, rule_set in rdict.items():
+        for rule in rule_set:
+            for child in set(rule):
+                parents[child].append((start, rule))
+    queue = deque(label for label in parents if label not in rdict)
+    while queue:
+        for start, rule in parents[queue.popleft()]:
+            rules = rdict.get(start)
+            if rules is not None and rule in rules:
+                rules.remove(rule)
+                if not rules:
+                    del rdict[start]
+                    queue.append(start)
+
+
+def _iterative_rules(rules_dict: RulesDict, root: Optional[int]) -> Iterator[RuleKey]:
+    """
+    Yield the rules whose children are all iteratively verifiable, such that the
+    children of a rule are verified by the rules yielded before it.
+
+    Each rule keeps a count of its children that are not verified yet, and is
+    yielded once the count reaches zero.
+    """
+    verified: Set[int] = set()
+    if root is not None:
+        verified.add(root)
+    missing: Dict[RuleKey, int] = {}
+    parents: Dict[int, List[RuleKey]] = defaultdict(list)
+    queue: Deque[RuleKey] = deque()
+    for start, rule_set in rules_dict.items():
+        for rule in rule_set:
+            children = set(rule).difference(verified)
+            if children:
+                missing[(start, rule)] = len(children)
+                for child in children:
+                    parents[child].append((start, rule))
+            else:
+                queue.append((start, rule))
+    while queue:
+        start, rule = queue.popleft()
+        yield start, rule
+        if start not in verified:
+            verified.add(start)
+            for rule_key in parents[start]:
+                missing[rule_key] -= 1
+                if missing[rule_key] == 0:
+                    queue.append(rule_key)
 
 
 def iterative_prune(rules_dict: RulesDict, root: Optional[int] = None) -> RulesDict:
     """Prune all nodes not iteratively verifiable."""
-    verified_labels: Set[int] = set()
-    if root is not None:
-        verified_labels.add(root)
-    rdict = deepcopy(rules_dict)
     new_rules_dict: RulesDict = defaultdict(set)
-    while True:
-        changed = False
-        for k, rule_set in list(rdict.items()):
-            for rule in list(rule_set):
-                if all(x in verified_labels for x in rule):
-                    changed = True
-                    verified_labels.add(k)
-                    new_rules_dict[k].add(rule)
-                    rdict[k].remove(rule)
-            if not rule_set:
-                del rdict[k]
-        if not changed:
-            break
+    for start, rule in _iterative_rules(rules_dict, root):
+        new_rules_dict[start].add(rule)
     return new_rules_dict
 
 
@@ -288,25 +327,8 @@ def iterative_proof_tree_finder(rules_dict: RulesDict, root: int) -> Node:
         root.children = children
         trees[start] = root
 
-    verified_labels = set()
-    if root is not None:
-        verified_labels.add(root)
-    rdict = deepcopy(rules_dict)
-    new_rules_dict: RulesDict = defaultdict(set)
-    while True:
-        changed = False
-        for k, rule_set in list(rdict.items()):
-            for rule in list(rule_set):
-                if all(x in verified_labels for x in rule):
-                    changed = True
-                    verified_labels.add(k)
-                    new_rules_dict[k].add(rule)
-                    create_tree(k, rule)
-                    rdict[k].remove(rule)
-            if not rule_set:
-                del rdict[k]
-        if not changed:
-            break
-    if root in trees:
-        return trees[root]
+    for start, rule in _iterative_rules(rules_dict, root):
+        create_tree(start, rule)
+        if start == root:
+            return trees[root]
     raise ValueError(f"{root} has no tree in rules_dict")
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from example import AvoidingWithPrefix
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-rules",
+        default="",
+        help="numbers of rules of the graphs of the benchmarks, e.g. 1e5,1e6,1e7",
+    )
+
+
+@pytest.fixture
+def bytes_class(monkeypatch):
+    monkeypatch.setattr(
+        AvoidingWithPrefix,
+        "to_bytes",
+        lambda self: json.dumps(self.to_jsonable()).encode(),
+        raising=False,
+    )
+    monkeypatch.setattr(
+        AvoidingWithPrefix,
+        "from_bytes",
+        classmethod(lambda cls, b: cls.from_dict(json.loads(b))),
+        raising=False,
+    )
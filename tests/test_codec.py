@@ -0,0 +1,49 @@
+import json
+import pickle
+
+import pytest
+
+from comb_spec_searcher import CombinatorialSpecificationSearcher
+from comb_spec_searcher.class_db import ClassDB
+from comb_spec_searcher.codec import ZdictCodec, ZlibCodec
+from example import AvoidingWithPrefix, pack
+
+
+def test_codecs_decompress_each_other():
+    samples = [
+        json.dumps({"prefix": "ab" * i, "patterns": ["aa", "bab"]}).encode()
+        for i in range(20)
+    ]
+    codec = ZdictCodec(training_size=10)
+    compressed = [codec.compress(sample) for sample in samples]
+    assert codec.zdict is not None and codec.version == 1
+    assert [codec.decompress(data) for data in compressed] == samples
+    fast = ZlibCodec(1)
+    assert codec.decompress(fast.compress(samples[0])) == samples[0]
+    assert fast.decompress(compressed[0]) == samples[0]
+    assert sum(map(len, compressed[10:])) < sum(
+        len(ZlibCodec().compress(sample)) for sample in samples[10:]
+    )
+    assert pickle.loads(pickle.dumps(codec)) == codec
+
+
+@pytest.mark.parametrize("codec", [ZlibCodec(1), ZdictCodec(training_size=5)])
+def test_codec_in_searcher(bytes_class, tmp_path, codec):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    expected = CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    path = str(tmp_path / "search.journal")
+    searcher = CombinatorialSpecificationSearcher(
+        start_class, pack, classdb=ClassDB(AvoidingWithPrefix, codec), journal=path
+    )
+    assert searcher.auto_search() == expected
+    assert "bytes per class" in searcher.classdb.status()
+    searcher.journal.close()
+    resumed = CombinatorialSpecificationSearcher.resume(
+        path, classdb=ClassDB(AvoidingWithPrefix)
+    )
+    assert resumed.classdb.codec == codec
+    assert resumed.classdb == searcher.classdb
+    for label in searcher.classdb:
+        assert resumed.classdb.get_class(label) == searcher.classdb.get_class(label)
+    resumed.journal.close()
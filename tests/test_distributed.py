@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from comb_spec_searcher import CombinatorialSpecificationSearcher
+from comb_spec_searcher.distributed import (
+    Coordinator,
+    remote_searcher,
+    start_coordinator,
+)
+from example import AvoidingWithPrefix, pack
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("to_bytes", [False, True])
+def test_shared_universe(request, to_bytes):
+    if to_bytes:
+        request.getfixturevalue("bytes_class")
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    manager = start_coordinator(start_class, pack)
+    try:
+        searchers = [
+            remote_searcher(start_class, pack, manager.address) for _ in range(2)
+        ]
+        specs = [None, None]
+
+        def search(idx):
+            specs[idx] = searchers[idx].auto_search()
+
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        serial_spec = CombinatorialSpecificationSearcher(
+            start_class, pack
+        ).auto_search()
+        for spec in specs:
+            assert spec is not None
+            assert [spec.count_objects_of_size(n) for n in range(10)] == [
+                serial_spec.count_objects_of_size(n) for n in range(10)
+            ]
+        # Each worker labels classes with the same labels.
+        labels = [s.classdb.get_label(start_class) for s in searchers]
+        assert labels[0] == labels[1]
+    finally:
+        manager.shutdown()
+
+
+def test_coordinator_uses_lookup_keys(bytes_class, monkeypatch):
+    """The coordinator finds the classes by the digests the workers send."""
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], ["a", "b"])
+    coordinator = Coordinator(start_class, pack)
+    worker = coordinator.register()
+    classdb = coordinator.searcher.classdb
+    comb_class = AvoidingWithPrefix("ab", ["ababa", "babb"], ["a", "b"])
+    key, raw = classdb._lookup_key(comb_class)
+    compressed = classdb._compress_bytes(raw)
+
+    def decompress(data):
+        raise AssertionError("The coordinator decompressed a class.")
+
+    monkeypatch.setattr(classdb.codec, "decompress", decompress)
+    operations = [("get_labels", ([(key, compressed)],))] * 2
+    [(label, _, _)], [(same_label, _, _)] = coordinator.execute(worker, operations)
+    assert label == same_label == classdb.get_label(comb_class)
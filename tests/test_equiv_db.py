@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from comb_spec_searcher.equiv_db import EquivalenceDB
+
+
+def strong_components(size, edges):
+    reachable = {label: {label} for label in range(size)}
+    for label in range(size):
+        stack = [label]
+        while stack:
+            start = stack.pop()
+            for edge_start, end in edges:
+                if edge_start == start and end not in reachable[label]:
+                    reachable[label].add(end)
+                    stack.append(end)
+    return {
+        label: {other for other in reachable[label] if label in reachable[other]}
+        for label in range(size)
+    }
+
+
+def test_connect_cycles():
+    equivdb = EquivalenceDB()
+    equivdb.add_one_way_edge(0, 1)
+    equivdb.add_one_way_edge(1, 2)
+    equivdb.add_one_way_edge(3, 2)
+    assert not equivdb.equivalent(0, 2)
+    equivdb.add_one_way_edge(2, 0)
+    assert equivdb.equivalent(0, 1) and equivdb.equivalent(1, 2)
+    assert not equivdb.equivalent(0, 3)
+    equivdb.add_two_way_edge(3, 4)
+    equivdb.add_one_way_edge(4, 5)
+    equivdb.add_one_way_edge(5, 3)
+    assert equivdb.equivalent(3, 5)
+    assert equivdb.get_one_way_vertices() == {equivdb[3]: {equivdb[0]}}
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_strong_components(seed):
+    random.seed(seed)
+    size = 12
+    equivdb = EquivalenceDB()
+    edges = []
+    for _ in range(30):
+        start, end = random.sample(range(size), 2)
+        if random.random() < 0.2:
+            equivdb.add_two_way_edge(start, end)
+            edges.extend([(start, end), (end, start)])
+        else:
+            equivdb.add_one_way_edge(start, end)
+            edges.append((start, end))
+        components = strong_components(size, edges)
+        for label in range(size):
+            assert components[label] == {
+                other for other in range(size) if equivdb.equivalent(label, other)
+            }
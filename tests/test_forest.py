@@ -4,10 +4,15 @@ from typing import Dict, List, Union
 import pytest
 
 from comb_spec_searcher import CombinatorialSpecificationSearcher
-from comb_spec_searcher.rule_db.forest import Function, RuleDBForest, TableMethod
+from comb_spec_searcher.rule_db.forest import (
+    Function,
+    LinkedLists,
+    RuleDBForest,
+    TableMethod,
+)
 from comb_spec_searcher.strategies.strategy import EmptyStrategy
 from comb_spec_searcher.typing import ForestRuleKey, RuleBucket
-from example import AvoidingWithPrefix, pack
+from example import AvoidingWithPrefix, ExpansionStrategy, pack
 
 
 def assert_function_values(
@@ -112,6 +117,25 @@ class TestFunction:
         assert f.preimage_gap(2) == 4
         assert f.preimage_gap(3) == 4
 
+    def test_gap_after_undo(self):
+        f = Function()
+        f.undo_log = []
+        for key in (0, 1, 1, 2, 2, 2):
+            f.increase_value(key)
+        assert f.preimage_gap(7) == 4
+        checkpoint = len(f.undo_log)
+        for _ in range(10):
+            f.increase_value(3)
+        f.set_infinite(1)
+        assert f.preimage_gap(1) == 0
+        assert f.preimage_gap(6) == 4
+        assert f.preimage_gap(7) == 11
+        assert sorted(f.preimage(None)) == [1]
+        while len(f.undo_log) > checkpoint:
+            f.undo(f.undo_log.pop())
+        assert f.preimage_gap(7) == 4
+        assert list(f.preimage(None)) == []
+
 
 # Test of the table method
 
@@ -188,6 +212,54 @@ def test_132_universe_pumping_progressive():
     assert tb.function == {i: None for i in range(6)}
 
 
+def test_table_method_rollback():
+    """
+    Rolling back to a checkpoint gives the state of a table with only the rules
+    added before it.
+    """
+    rules = [
+        ForestRuleKey(0, (1, 2), (0, 0), RuleBucket.NORMAL),
+        ForestRuleKey(1, (), (), RuleBucket.VERIFICATION),
+        ForestRuleKey(2, (3,), (0,), RuleBucket.NORMAL),
+        ForestRuleKey(3, (4,), (0,), RuleBucket.NORMAL),
+        ForestRuleKey(2, (7,), (2,), RuleBucket.UNDEFINED),
+        ForestRuleKey(5, (), (), RuleBucket.VERIFICATION),
+        ForestRuleKey(4, (5, 0, 0), (0, 1, 1), RuleBucket.NORMAL),
+    ]
+    tb = TableMethod()
+    checkpoints = []
+    for rule in rules:
+        checkpoints.append(tb.checkpoint())
+        tb.add_rule_key(rule)
+    assert tb.function == {i: None for i in range(6)}
+    for n in reversed(range(len(rules))):
+        tb.rollback(checkpoints[n])
+        expected = TableMethod()
+        for rule in rules[:n]:
+            expected.add_rule_key(rule)
+        assert tb.function == expected.function
+        assert tb.status() == expected.status()
+        assert tb._shifts == expected._shifts
+    tb.add_rule_key(rules[0])
+    assert tb.function == {}
+
+
+def test_linked_lists():
+    lists = LinkedLists()
+    assert lists.append(3, 10) == -1
+    assert lists.append(1, 11) == -1
+    tail = lists.append(3, 12)
+    assert list(lists[3]) == [10, 12]
+    assert list(lists[1]) == [11]
+    assert list(lists[7]) == []
+    lists.pop(3, tail)
+    assert list(lists[3]) == [10]
+    head, tail = lists.clear(3)
+    assert list(lists[3]) == []
+    lists.restore(3, head, tail)
+    assert list(lists[3]) == [10]
+
+
 def test_universe_not_pumping():
     tb = TableMethod()
     rules = [
@@ -328,6 +400,66 @@ def test_segmented():
     assert all(tb.is_pumping(c) for c in range(21))
 
 
+def test_add_uses_given_labels(monkeypatch):
+    """
+    The forest keys of a rule and of its reverse rules are computed from the
+    labels given to `add` without looking the classes up.
+    """
+    start = AvoidingWithPrefix("", ["aa", "bb"], ["a", "b"])
+    css = CombinatorialSpecificationSearcher(start, pack, ruledb=RuleDBForest())
+    rule = ExpansionStrategy()(start)
+    assert rule.is_reversible()
+    start_label = css.classdb.get_label(start)
+    end_labels = tuple(css.classdb.get_labels(rule.children))
+    for label in end_labels:
+        css.classdb.set_empty(label, False)
+    expected = [rule.forest_key(css.classdb.get_label, css.classdb.is_empty)]
+    expected.extend(
+        rule.to_reverse_rule(i).forest_key(css.classdb.get_label, css.classdb.is_empty)
+        for i in range(len(rule.children))
+    )
+
+    def no_lookup(_):
+        raise AssertionError("the class was looked up")
+
+    monkeypatch.setattr(css.classdb, "get_label", no_lookup)
+    get_label, is_empty = css.ruledb._label_functions(start_label, end_labels, rule)
+    assert [rule.forest_key(get_label, is_empty)] + [
+        rule.reverse_forest_key(i, get_label, is_empty)
+        for i in range(len(rule.children))
+    ] == expected
+    css.ruledb.add(start_label, end_labels, rule)
+
+
+def test_lazy_reverse():
+    """
+    Setting the reverse rules aside finds the same specification with fewer
+    rules in the table method, keeping each rule set aside with a child
+    preventing it from increasing the value of its parent.
+    """
+    start = AvoidingWithPrefix("", ["ababa", "babb"], ["a", "b"])
+    specs, num_rules = [], []
+    for lazy_reverse in (False, True):
+        ruledb = RuleDBForest(lazy_reverse=lazy_reverse)
+        css = CombinatorialSpecificationSearcher(start, pack, ruledb=ruledb)
+        for _ in range(3):
+            css.do_level()
+        assert not ruledb.has_specification()
+        assert bool(ruledb._pending_reverse) == lazy_reverse
+        table_method = ruledb.table_method
+        for child, rule_keys in ruledb._pending_reverse.items():
+            for key in rule_keys:
+                assert table_method.is_pumping(key.parent) or (
+                    table_method.blocking_child(key) == child
+                )
+        specs.append(css.auto_search())
+        num_rules.append(len(table_method._parents))
+    assert num_rules[1] < num_rules[0]
+    assert [specs[0].count_objects_of_size(n) for n in range(12)] == [
+        specs[1].count_objects_of_size(n) for n in range(12)
+    ]
+
+
 # Test of the extractor
 
 
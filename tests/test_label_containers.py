@@ -0,0 +1,42 @@
+import pickle
+import random
+from collections import deque
+
+from comb_spec_searcher.label_containers import (
+    LabelCounter,
+    LabelSet,
+    SpillCounter,
+    SpillDeque,
+)
+
+
+def test_spill_containers(tmp_path):
+    rng = random.Random(0)
+    counter, spill_counter = LabelCounter(), SpillCounter(5, str(tmp_path))
+    queue, spill_queue = deque(), SpillDeque(5, str(tmp_path))
+    for step in range(500):
+        label = rng.randrange(60)
+        if rng.random() < 0.1:
+            assert spill_counter.pop(label) == counter.pop(label)
+        elif rng.random() < 0.1:
+            spill_counter.discard(label)
+            counter.discard(label)
+        else:
+            counter.update((label,))
+            spill_counter.update((label,))
+        if queue and rng.random() < 0.4:
+            assert spill_queue.popleft() == queue.popleft()
+        else:
+            queue.append(label)
+            spill_queue.append(label)
+        assert len(spill_counter) == len(counter)
+        assert len(spill_queue) == len(queue)
+        if step % 50 == 0:
+            assert list(spill_counter.by_count()) == list(counter.by_count())
+    assert list(spill_queue) == list(queue)
+    assert pickle.loads(pickle.dumps(spill_counter)) == spill_counter
+    assert pickle.loads(pickle.dumps(spill_queue)) == spill_queue
+    assert list(spill_counter.by_count()) == list(counter.by_count())
+    assert LabelSet(counter) == LabelSet(spill_counter.by_count())
+    spill_counter.clear()
+    assert not list(spill_counter.by_count())
@@ -1,8 +1,11 @@
 import pickle
+from collections import Counter
 
 import pytest
 
 from comb_spec_searcher import CombinatorialSpecificationSearcher
+from comb_spec_searcher.journal import Journal
+from comb_spec_searcher.label_containers import LabelCounter, LabelSet
 from example import AvoidingWithPrefix, pack
 
 
@@ -32,6 +35,28 @@ def test_pickle_queue_not_exhausted():
     assert list(queue) == list(new_queue)
 
 
+def test_unpickle_queue_with_sets():
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    searcher = CombinatorialSpecificationSearcher[AvoidingWithPrefix](start_class, pack)
+    searcher.do_level()
+    queue = searcher.classqueue
+    assert isinstance(queue.ignore, LabelSet)
+    assert isinstance(queue.next_level, LabelCounter)
+    # the state of a queue pickled when the bookkeeping used sets and a Counter
+    state = dict(queue.__dict__)
+    state.update(
+        ignore=set(queue.ignore),
+        _inferral_expanded=set(queue._inferral_expanded),
+        _initial_expanded=set(queue._initial_expanded),
+        next_level=Counter(dict(queue.next_level.items())),
+    )
+    old_queue = type(queue).__new__(type(queue))
+    old_queue.__setstate__(state)
+    assert old_queue == queue
+    assert queue.status() == old_queue.status()
+
+
 def tests_pickling_css():
     alphabet = ["a", "b"]
     start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
@@ -50,3 +75,49 @@ def test_pickle_specification():
     spec = searcher.auto_search()
     spec.count_objects_of_size(10)
     pickle.dumps(spec)
+
+
+def test_journal_resume(tmp_path):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    path = str(tmp_path / "search.journal")
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, journal=path)
+    for _ in range(3):
+        searcher.do_level()
+    searcher.journal.close()
+    # A transaction cut by a crash is ignored.
+    with open(path, "ab") as journal_file:
+        journal_file.write(pickle.dumps(list(range(100)))[:-10])
+    resumed = CombinatorialSpecificationSearcher.resume(path)
+    assert resumed.classdb == searcher.classdb
+    assert resumed.ruledb == searcher.ruledb
+    assert resumed.tried_to_verify == searcher.tried_to_verify
+    searcher.classqueue.journal = resumed.classqueue.journal
+    assert resumed.classqueue == searcher.classqueue
+    spec = resumed.auto_search()
+    resumed.journal.close()
+    assert spec == CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    resumed = CombinatorialSpecificationSearcher.resume(path)
+    assert resumed.get_specification() == spec
+    resumed.journal.close()
+
+
+def test_journal_record_while_committing(tmp_path, monkeypatch):
+    """A record added by another thread while a transaction is written is kept."""
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], ["a", "b"])
+    journal = Journal(str(tmp_path / "search.journal"), start_class, pack)
+    sync = journal._sync
+
+    def record_then_sync():
+        journal.record("during")
+        sync()
+
+    journal.record("before")
+    monkeypatch.setattr(journal, "_sync", record_then_sync)
+    journal.commit()
+    monkeypatch.setattr(journal, "_sync", sync)
+    journal.commit()
+    journal.close()
+    journal = Journal(journal.path, start_class, pack)
+    assert list(journal.transactions()) == [[("before",)], [("during",)]]
+    journal.close()
@@ -1,11 +1,38 @@
+import itertools
+import pickle
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
-from comb_spec_searcher import CombinatorialSpecificationSearcher
+from comb_spec_searcher import (
+    AtomStrategy,
+    CombinatorialSpecificationSearcher,
+    StrategyPack,
+)
+from comb_spec_searcher.class_db import ClassDB, DiskClassDB, ThreadSafeClassDB
+from comb_spec_searcher.class_queue import (
+    AdaptiveQueue,
+    CostQueue,
+    DefaultQueue,
+    SpillQueue,
+    depth_score,
+    size_score,
+    strategy_cost_score,
+)
 from comb_spec_searcher.exception import (
+    InvalidOperationError,
     NoMoreClassesToExpandError,
     SpecificationNotFound,
 )
-from example import AvoidingWithPrefix, pack
+from comb_spec_searcher.expansion_cache import ExpansionCache
+from comb_spec_searcher.parallel import ExpansionPool, WorkerStats
+from comb_spec_searcher.rule_db import ThreadSafeRuleDB
+from comb_spec_searcher.tree_searcher import iterative_prune, prune
+from comb_spec_searcher.typing import WorkPacket
+from example import AvoidingWithPrefix, ExpansionStrategy, RemoveFrontOfPrefix, pack
 
 
 @pytest.mark.timeout(5)
@@ -38,3 +65,404 @@ def test_iterative():
     it_pack = pack.make_iterative("iterative")
     searcher = CombinatorialSpecificationSearcher(start_class, it_pack)
     searcher.auto_search()
+
+
+@pytest.mark.timeout(60)
+def test_parallel_expansion():
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    serial = CombinatorialSpecificationSearcher(start_class, pack)
+    parallel = CombinatorialSpecificationSearcher(start_class, pack, workers=2)
+    assert parallel.auto_search() == serial.auto_search()
+    assert parallel.classdb == serial.classdb
+    assert parallel.ruledb == serial.ruledb
+    assert sum(parallel.worker_stats.tasks.values()) > 0
+    assert "Worker pool status" in parallel.status(elaborate=True)
+
+
+@pytest.mark.timeout(60)
+def test_pool_drops_wrong_speculation():
+    classes = [
+        AvoidingWithPrefix(prefix, ["aabb"], ["a", "b"])
+        for prefix in ("", "a", "b", "aa", "ab")
+    ]
+    strategy = pack.expansion_strats[0][0]
+    packets = [WorkPacket(label, (strategy,), False) for label in range(5)]
+    stats = WorkerStats()
+
+    def label_rule(comb_class, label, rule):
+        return label, (), rule
+
+    with ExpansionPool(pack, AvoidingWithPrefix, 1, stats, label_rule) as pool:
+        pool.speculate(packets, classes.__getitem__)
+        assert set(pool._pending) == {(label, id(strategy)) for label in range(4)}
+        # The packets 0 and 1 are expanded, 2 and 3 are no longer predicted.
+        for label in (0, 1):
+            _, rules = pool.rules(label, classes[label], strategy)
+            assert list(rules)
+        pool.speculate(packets[4:], classes.__getitem__)
+        assert set(pool._pending) == {(4, id(strategy))}
+        assert stats.wasted_tasks == 2
+
+
+@pytest.mark.parametrize("iterative", [False, True])
+def test_incremental_has_specification(iterative):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aa", "aba", "bab"], alphabet)
+    strat_pack = pack.make_iterative("iterative") if iterative else pack
+    searcher = CombinatorialSpecificationSearcher(start_class, strat_pack)
+    ruledb = searcher.ruledb
+    for label, strategies, inferral in searcher.classqueue:
+        comb_class = searcher.classdb.get_class(label)
+        searcher._expand(comb_class, label, strategies, inferral)
+        has_spec = ruledb.has_specification()
+        rules_dict = ruledb.rules_up_to_equivalence()
+        root = ruledb.equivdb[ruledb.root_label]
+        if iterative:
+            rules_dict = iterative_prune(rules_dict, root=root)
+        else:
+            prune(rules_dict)
+        assert dict(ruledb.pruned_dict) == dict(rules_dict)
+        assert has_spec == (root in rules_dict)
+        if has_spec:
+            break
+    assert ruledb.has_specification() != iterative
+
+
+def test_productive_cycle_above_new_rule():
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aa"], alphabet)
+    searcher = CombinatorialSpecificationSearcher(start_class, pack)
+    ruledb = searcher.ruledb
+    strategy = AtomStrategy()
+    # 101 -> 102 and 102 -> (101, 103) only become productive together, once
+    # 103 is verified.
+    ruledb.insert(101, (102,), strategy, False, False)
+    ruledb.insert(102, (101, 103), strategy, False, False)
+    ruledb.has_specification()
+    assert not ruledb.is_verified(101) and not ruledb.is_verified(102)
+    ruledb.insert(103, (), strategy, True, False)
+    ruledb.has_specification()
+    assert all(ruledb.is_verified(label) for label in (101, 102, 103))
+
+
+def test_disk_class_db(monkeypatch, tmp_path):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    classdb = DiskClassDB(AvoidingWithPrefix, str(tmp_path / "classes"), cache_size=3)
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, classdb=classdb)
+    serial = CombinatorialSpecificationSearcher(start_class, pack)
+    assert searcher.auto_search() == serial.auto_search()
+    assert list(classdb) == list(serial.classdb)
+    for label in classdb:
+        assert classdb.get_class(label) == serial.classdb.get_class(label)
+        assert classdb.get_label(serial.classdb.get_class(label)) == label
+        assert classdb.is_empty(
+            classdb.get_class(label), label
+        ) == serial.classdb.is_empty(serial.classdb.get_class(label), label)
+    assert pickle.loads(pickle.dumps(classdb)) == classdb
+    # The hash of a class changes from a process to another.
+    pickled = pickle.dumps(classdb)
+    monkeypatch.setattr(AvoidingWithPrefix, "__hash__", lambda self: len(repr(self)))
+    copy = pickle.loads(pickled)
+    assert all(copy.get_label(classdb.get_class(label)) == label for label in copy)
+    assert len(copy) == len(classdb)
+    classdb.close()
+    with pytest.raises(FileExistsError):
+        DiskClassDB(AvoidingWithPrefix, str(tmp_path / "classes"))
+
+
+@pytest.mark.parametrize("disk", [False, True])
+def test_class_db_digest_keys(bytes_class, tmp_path, disk):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    expected = CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    if disk:
+        classdb = DiskClassDB(AvoidingWithPrefix, str(tmp_path / "classes"), 3)
+    else:
+        classdb = ClassDB(AvoidingWithPrefix)
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, classdb=classdb)
+    assert searcher.auto_search() == expected
+    for label in classdb:
+        comb_class = classdb.get_class(label)
+        assert classdb.get_label(comb_class) == label
+        assert comb_class in classdb
+    assert "compressing classes" in classdb.status()
+    assert "emptiness and index" in classdb.status()
+    if not disk:
+        assert all(len(key) == 16 for key in classdb.label_dict)
+        assert all(
+            isinstance(info.comb_class, bytes) and info.comb_class.startswith(b"x")
+            for info in classdb.label_to_info.values()
+        )
+
+
+@pytest.mark.parametrize("disk", [False, True])
+def test_class_db_class_cache(bytes_class, tmp_path, disk):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    expected = CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    if disk:
+        classdb = DiskClassDB(
+            AvoidingWithPrefix, str(tmp_path / "classes"), class_cache_size=4
+        )
+    else:
+        classdb = ClassDB(AvoidingWithPrefix, class_cache_size=4)
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, classdb=classdb)
+    assert searcher.auto_search() == expected
+    cache = classdb.class_cache
+    assert cache is not None and len(cache) <= 4
+    assert cache.hits and cache.misses and cache.evictions
+    assert classdb.get_class(0) is classdb.get_class(0)
+    assert "Class cache:" in classdb.status()
+    copy = pickle.loads(pickle.dumps(classdb))
+    assert copy == classdb and len(copy.class_cache) == 0
+    assert copy.get_class(0) == classdb.get_class(0)
+
+    bounded = ClassDB(AvoidingWithPrefix, class_cache_bytes=100)
+    for label in range(5):
+        bounded.add(classdb.get_class(label))
+        bounded.get_class(label)
+    assert bounded.class_cache.size <= 100
+    assert len(bounded.class_cache) < 5
+
+
+def test_class_db_emptiness():
+    classdb = ClassDB(AvoidingWithPrefix)
+    classes = [AvoidingWithPrefix(prefix, ["aa"], ["a", "b"]) for prefix in "ab" * 5]
+    labels = [classdb.add(comb_class) for comb_class in classes]
+    assert labels == list(range(2)) * 5 and len(classdb) == 2
+    classes = [AvoidingWithPrefix("b" * i, ["aa"], ["a", "b"]) for i in range(9)]
+    labels = [classdb.add(comb_class) for comb_class in classes]
+    for label in labels[::3]:
+        classdb.set_empty(label, label % 2 == 0)
+    for label in labels:
+        expected = None if label not in labels[::3] else label % 2 == 0
+        assert classdb.label_to_info[label].empty is expected
+    assert classdb.get_class(labels[-1]) == classes[-1]
+
+
+def _rule_set(searcher):
+    get_class = searcher.classdb.get_class
+    return {
+        (get_class(start), tuple(sorted(map(get_class, ends), key=repr)))
+        for start, ends in searcher.ruledb
+    }
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.parametrize("to_bytes", [False, True])
+def test_threaded_expansion(request, to_bytes):
+    if to_bytes:
+        request.getfixturevalue("bytes_class")
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    serial = CombinatorialSpecificationSearcher(start_class, pack)
+    threaded = CombinatorialSpecificationSearcher(start_class, pack, threads=4)
+    assert isinstance(threaded.classdb, ThreadSafeClassDB)
+    assert isinstance(threaded.ruledb, ThreadSafeRuleDB)
+    serial.auto_search()
+    threaded.auto_search()
+    assert _rule_set(threaded) == _rule_set(serial)
+    classes = [threaded.classdb.get_class(label) for label in threaded.classdb]
+    assert len(set(classes)) == len(classes)
+    assert sum(threaded.worker_stats.tasks.values()) > 0
+    assert "Worker pool status" in threaded.status(elaborate=True)
+    assert pickle.loads(pickle.dumps(threaded.classdb)) == threaded.classdb
+    with pytest.raises(InvalidOperationError):
+        CombinatorialSpecificationSearcher(start_class, pack, workers=2, threads=2)
+    with pytest.raises(InvalidOperationError):
+        CombinatorialSpecificationSearcher(
+            start_class, pack, threads=2, classdb=ClassDB(AvoidingWithPrefix)
+        )
+
+
+def test_thread_safe_class_db_labels():
+    alphabet = ["a", "b"]
+    classes = [
+        AvoidingWithPrefix("".join(prefix), ["aa"], alphabet)
+        for length in range(7)
+        for prefix in itertools.product(alphabet, repeat=length)
+    ]
+    classdb = ThreadSafeClassDB(AvoidingWithPrefix)
+    barrier = threading.Barrier(8)
+
+    def add_all(seed):
+        order = list(classes)
+        random.Random(seed).shuffle(order)
+        barrier.wait()
+        return {comb_class: classdb.add(comb_class) for comb_class in order}
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(add_all, range(8)))
+    assert all(labels == results[0] for labels in results)
+    assert sorted(results[0].values()) == list(range(len(classes)))
+    for comb_class, label in results[0].items():
+        assert classdb.get_class(label) == comb_class
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize("score", [depth_score, size_score, strategy_cost_score])
+def test_cost_queue(score):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    queue = CostQueue(pack, score)
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, classqueue=queue)
+    spec = searcher.auto_search()
+    assert spec.count_objects_of_size(6) == (
+        CombinatorialSpecificationSearcher(start_class, pack)
+        .auto_search()
+        .count_objects_of_size(6)
+    )
+    assert queue.depth[searcher.start_label] == 0
+    assert queue.replayable == (score is not strategy_cost_score)
+    assert f"Scores ({score.__name__})" in searcher.status(elaborate=False)
+    assert pickle.loads(pickle.dumps(searcher)) == searcher
+
+
+def test_cost_queue_order():
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    queue = CostQueue(pack)
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, classqueue=queue)
+    depths = []
+    with pytest.raises(NoMoreClassesToExpandError):
+        while True:
+            for label, strategies, inferral in queue.do_level():
+                if not inferral and strategies[0] in queue.expansion_strats[0]:
+                    depths.append(queue.depth[label])
+                searcher._expand(
+                    searcher.classdb.get_class(label), label, strategies, inferral
+                )
+    assert depths and depths == sorted(depths)
+
+
+@pytest.mark.timeout(30)
+def test_adaptive_queue(tmp_path):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    remove_front, expansion = RemoveFrontOfPrefix(), ExpansionStrategy()
+    two_strats_pack = StrategyPack(
+        initial_strats=[],
+        inferral_strats=[],
+        expansion_strats=[[remove_front, expansion]],
+        ver_strats=[AtomStrategy()],
+        name="two expansion strategies",
+    )
+    queue = AdaptiveQueue(two_strats_pack)
+    searcher = CombinatorialSpecificationSearcher(
+        start_class, two_strats_pack, classqueue=queue
+    )
+    spec = searcher.auto_search()
+    expected = CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    assert [spec.count_objects_of_size(n) for n in range(8)] == [
+        expected.count_objects_of_size(n) for n in range(8)
+    ]
+    assert searcher.func_calls[str(expansion)] > 0
+    assert searcher.func_yield[str(expansion)] > 0
+    assert 0 < sum(searcher.func_used.values()) <= len(searcher.ruledb.rule_to_strategy)
+    assert "Strategy order" in queue.status()
+    with pytest.raises(InvalidOperationError):
+        CombinatorialSpecificationSearcher(
+            start_class,
+            two_strats_pack,
+            classqueue=AdaptiveQueue(two_strats_pack),
+            journal=str(tmp_path / "search.journal"),
+        )
+
+    searcher.func_calls = defaultdict(int, {str(remove_front): 1})
+    searcher.func_times = defaultdict(float, {str(remove_front): 1.0})
+    searcher.func_yield = defaultdict(int, {str(remove_front): 1})
+    searcher.func_used = defaultdict(int)
+    assert queue._expansion_order(0) == (expansion, remove_front)
+    searcher.func_calls[str(expansion)] = 1
+    searcher.func_times[str(expansion)] = 1.0
+    queue.exploration = 0
+    assert queue._expansion_order(0) == (remove_front, expansion)
+
+
+def test_spill_queue(tmp_path):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+
+    def expansions(queue):
+        searcher = CombinatorialSpecificationSearcher(
+            start_class, pack, classqueue=queue
+        )
+        packets = []
+        for _ in range(6):
+            for wp in queue.do_level():
+                packets.append(wp)
+                searcher._expand(
+                    searcher.classdb.get_class(wp.label),
+                    wp.label,
+                    wp.strategies,
+                    wp.inferral,
+                )
+        return searcher, packets
+
+    queue = SpillQueue(pack, max_labels=2, spill_dir=str(tmp_path))
+    searcher, packets = expansions(queue)
+    assert packets == expansions(DefaultQueue(pack))[1]
+    assert queue.levels_completed == 6 and max(queue.queue_sizes) > 4
+    assert pickle.loads(pickle.dumps(searcher)) == searcher
+
+
+def test_expansion_cache(bytes_class, tmp_path):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    expected = CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    path = str(tmp_path / "expansions.sqlite")
+    first = ExpansionCache(path)
+    searcher = CombinatorialSpecificationSearcher(
+        start_class, pack, expansion_cache=first
+    )
+    assert searcher.auto_search() == expected
+    assert first.misses > 0 and first.hits == 0
+    assert "hit rate" in searcher.status(elaborate=False)
+    first.close()
+
+    second = ExpansionCache(path)
+    searcher = CombinatorialSpecificationSearcher(
+        start_class, pack, expansion_cache=second
+    )
+    assert searcher.auto_search() == expected
+    assert second.hits == first.misses and second.misses == 0
+    assert pickle.loads(pickle.dumps(searcher)) == searcher
+    second.close()
+
+    small = ExpansionCache(str(tmp_path / "small.sqlite"), max_bytes=1000)
+    searcher = CombinatorialSpecificationSearcher(
+        start_class, pack, expansion_cache=small
+    )
+    assert searcher.auto_search() == expected
+    assert small.evictions > 0 and small._size <= 1000
+    small.close()
+
+
+@pytest.mark.timeout(60)
+def test_expansion_cache_with_threads(bytes_class, tmp_path):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["aabb", "bbbbab"], alphabet)
+    expected = CombinatorialSpecificationSearcher(start_class, pack).auto_search()
+    cache = ExpansionCache(str(tmp_path / "expansions.sqlite"))
+    threaded = CombinatorialSpecificationSearcher(
+        start_class, pack, threads=2, expansion_cache=cache
+    )
+    assert threaded.auto_search() == expected
+    assert cache.misses > 0 and cache.hits == 0
+    stored, cache.misses = cache.misses, 0
+
+    serial = CombinatorialSpecificationSearcher(
+        start_class, pack, expansion_cache=cache
+    )
+    assert serial.auto_search() == expected
+    assert cache.hits == stored and cache.misses == 0
+
+    threaded = CombinatorialSpecificationSearcher(
+        start_class, pack, threads=2, expansion_cache=cache
+    )
+    assert threaded.auto_search() == expected
+    assert cache.hits == 2 * stored and cache.misses == 0
+    assert sum(threaded.worker_stats.tasks.values()) == 0
+    cache.close()
@@ -1,5 +1,6 @@
 import itertools
 import json
+import pickle
 
 import pytest
 
@@ -8,11 +9,23 @@ from comb_spec_searcher import (
     CombinatorialSpecificationSearcher,
 )
 from comb_spec_searcher.exception import InvalidOperationError
-from comb_spec_searcher.rule_db import RuleDBForest, RuleDBForgetStrategy
-from comb_spec_searcher.strategies.strategy import VerificationStrategy
+from comb_spec_searcher.rule_db import (
+    RuleDB,
+    RuleDBFlat,
+    RuleDBForest,
+    RuleDBForgetStrategy,
+)
+from comb_spec_searcher.strategies.strategy import StrategyFactory, VerificationStrategy
 from comb_spec_searcher.strategies.strategy_pack import StrategyPack
 from comb_spec_searcher.utils import taylor_expand
-from example import AvoidingWithPrefix, Word, pack
+from example import (
+    AtomStrategy,
+    AvoidingWithPrefix,
+    ExpansionStrategy,
+    RemoveFrontOfPrefix,
+    Word,
+    pack,
+)
 
 
 @pytest.fixture
@@ -123,6 +136,83 @@ def test_forget_ruledb():
     assert count == expected_count
 
 
+class PrefixFactory(StrategyFactory[AvoidingWithPrefix]):
+    def __call__(self, comb_class):
+        yield RemoveFrontOfPrefix()
+        yield ExpansionStrategy()
+
+    def __str__(self):
+        return "prefix factory"
+
+    def __repr__(self):
+        return "PrefixFactory()"
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls()
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_forget_ruledb_hints(threads):
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    factory_pack = StrategyPack(
+        initial_strats=[],
+        inferral_strats=[],
+        expansion_strats=[[PrefixFactory()]],
+        ver_strats=[AtomStrategy()],
+        name="factory",
+    )
+    ruledb = RuleDBForgetStrategy()
+    searcher = CombinatorialSpecificationSearcher(
+        start_class, factory_pack, ruledb=ruledb, threads=threads
+    )
+    spec = searcher.auto_search()
+    count = [spec.count_objects_of_size(n) for n in range(10)]
+    assert count == [1, 2, 4, 8, 15, 27, 48, 87, 157, 283]
+    rules = ruledb.rule_to_strategy
+    assert all(hint >= 0 for hint in rules.rules.values())
+    assert {hint // len(list(factory_pack)) for hint in rules.rules.values()} == {
+        0,
+        1,
+        2,
+    }
+    for key, hint in rules.rules.items():
+        assert rules._replay(rules._unflatten(key), hint) is not None
+
+
+def test_flat_ruledb():
+    alphabet = ["a", "b"]
+    start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
+    ruledb = RuleDBFlat()
+    searcher = CombinatorialSpecificationSearcher(start_class, pack, ruledb=ruledb)
+    spec = searcher.auto_search()
+    expected_count = [1, 2, 4, 8, 15, 27, 48, 87, 157, 283]
+    count = [spec.count_objects_of_size(n) for n in range(10)]
+    assert count == expected_count
+    expected = CombinatorialSpecificationSearcher(start_class, pack, ruledb=RuleDB())
+    expected.auto_search()
+    assert dict(ruledb.rule_to_strategy) == expected.ruledb.rule_to_strategy
+    assert dict(ruledb.eqv_rule_to_strategy) == expected.ruledb.eqv_rule_to_strategy
+    assert len(ruledb.strategies) < len(ruledb.rule_to_strategy)
+    eqv_rules = [
+        (start, ends)
+        for start, rules in ruledb.rules_up_to_equivalence().items()
+        for ends in rules
+    ]
+    rules = ruledb.rule_from_equivalence_rule_dict(eqv_rules)
+    assert rules == expected.ruledb.rule_from_equivalence_rule_dict(eqv_rules)
+    assert all(
+        ruledb.rule_from_equivalence_rule(*eqv_rule)
+        == expected.ruledb.rule_from_equivalence_rule(*eqv_rule)
+        for eqv_rule in eqv_rules
+    )
+    # The indices by label are in arrays rather than in dicts.
+    assert not ruledb._label_rules and not ruledb._eqv_rule_index
+    assert "bytes per rule" in ruledb.status(elaborate=False)
+    assert pickle.loads(pickle.dumps(ruledb)) == ruledb
+
+
 def test_forest_ruledb():
     alphabet = ["a", "b"]
     start_class = AvoidingWithPrefix("", ["ababa", "babb"], alphabet)
@@ -0,0 +1,149 @@
+import random
+import time
+from collections import defaultdict
+from copy import deepcopy
+
+import pytest
+
+from comb_spec_searcher.tree_searcher import (
+    iterative_proof_tree_finder,
+    iterative_prune,
+    prune,
+)
+
+
+def naive_prune(rdict):
+    changed = True
+    while changed:
+        changed = False
+        for k, rule_set in list(rdict.items()):
+            for rule in list(rule_set):
+                if any(x not in rdict for x in rule):
+                    rule_set.remove(rule)
+                    changed = True
+                if not rule_set:
+                    del rdict[k]
+
+
+def naive_iterative_prune(rules_dict, root=None):
+    verified_labels = set() if root is None else {root}
+    rdict = deepcopy(rules_dict)
+    new_rules_dict = defaultdict(set)
+    changed = True
+    while changed:
+        changed = False
+        for k, rule_set in list(rdict.items()):
+            for rule in list(rule_set):
+                if all(x in verified_labels for x in rule):
+                    changed = True
+                    verified_labels.add(k)
+                    new_rules_dict[k].add(rule)
+                    rule_set.remove(rule)
+    return new_rules_dict
+
+
+def random_rules_dict(size):
+    rules_dict = defaultdict(set)
+    for _ in range(2 * size):
+        start = random.randrange(size)
+        length = random.choice((0, 1, 2, 2, 3))
+        rules_dict[start].add(
+            tuple(sorted(random.randrange(size + 2) for _ in range(length)))
+        )
+    for _ in range(size // 10):
+        rules_dict[random.randrange(size + 2)]
+    return rules_dict
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_prune(seed):
+    random.seed(seed)
+    rules_dict = random_rules_dict(30)
+    expected = deepcopy(rules_dict)
+    naive_prune(expected)
+    prune(rules_dict)
+    assert rules_dict == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_iterative_prune(seed):
+    random.seed(seed)
+    rules_dict = random_rules_dict(30)
+    original = deepcopy(rules_dict)
+    for root in (None, 0):
+        pruned = iterative_prune(rules_dict, root=root)
+        assert pruned == naive_iterative_prune(rules_dict, root=root)
+        assert rules_dict == original
+        if root is not None and root in pruned:
+            tree = iterative_proof_tree_finder(pruned, root)
+            assert tree.label == root
+            assert all(
+                node.label == root
+                or tuple(sorted(c.label for c in node.children)) in pruned[node.label]
+                for node in tree.nodes()
+            )
+
+
+def test_prune_long_chain():
+    size = 10**5
+    rules_dict = defaultdict(set, {i: {(i + 1,)} for i in range(size)})
+    rules_dict[size] = {()}
+    pruned = iterative_prune(rules_dict)
+    assert len(pruned) == size + 1
+    assert iterative_proof_tree_finder(rules_dict, 0).label == 0
+    del rules_dict[size]
+    prune(rules_dict)
+    assert not rules_dict
+
+
+def chains_rules_dict(size):
+    """
+    Two chains of rules each needing the next label, the first ending with a
+    leaf and the second with a label without rules.
+    """
+    half = size // 2
+    rules_dict = defaultdict(set, {i: {(i + 1,)} for i in range(size)})
+    rules_dict[half - 1] = {()}
+    return rules_dict
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("graph", [chains_rules_dict, random_rules_dict])
+def test_prune_benchmark(request, capsys, graph):
+    """
+    Time prune and iterative_prune on synthetic graphs with the numbers of
+    rules given by --benchmark-rules, and check that the time grows about
+    linearly. The graphs of 10^7 rules take several GB of memory.
+    """
+    option = request.config.getoption("benchmark_rules")
+    if not option:
+        pytest.skip("give the numbers of rules with --benchmark-rules")
+    random.seed(0)
+    times = []
+    for rules in sorted(int(float(n)) for n in option.split(",")):
+        rules_dict = graph(rules if graph is chains_rules_dict else rules // 2)
+        start = time.perf_counter()
+        iterative_prune(rules_dict)
+        iterative_time = time.perf_counter() - start
+        start = time.perf_counter()
+        prune(rules_dict)
+        prune_time = time.perf_counter() - start
+        with capsys.disabled():
+            print(
+                f"\n{graph.__name__} {rules:,d} rules: "
+                f"iterative_prune {iterative_time:.2f}s, prune {prune_time:.2f}s"
+            )
+        times.append((rules, iterative_time + prune_time))
+        del rules_dict
+    for (rules, taken), (more_rules, more_taken) in zip(times, times[1:]):
+        assert more_taken < 3 * taken * more_rules / rules
+
+
+def test_prune_keeps_labels_without_rules():
+    """
+    As in the original version, a label whose rule set is empty to begin with
+    is kept, and so are the rules using it.
+    """
+    rules_dict = defaultdict(set, {0: {(1,), (2,)}, 1: set(), 3: {(4,)}})
+    prune(rules_dict)
+    assert rules_dict == {0: {(1,)}, 1: set()}